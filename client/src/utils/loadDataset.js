@@ -19,23 +19,45 @@ export const loadAllDatasets = async () => {
 
 export const loadDatasetByFilterConditions = async (conditions) => {
     var geometryCollection = conditions
+        .filter((condition) => condition.type === 'region')
         .map((condition) => condition.geojson.geometry)
         .reduce((collection, geometry) => {
             collection.geometries.push(geometry);
             return collection;
         }, { type: 'GeometryCollection', geometries: [] })
 
-    if (geometryCollection.geometries.length) {
-        let { data: datasets } = await girder.girder.get('dataset/search', {
-            params: {
-                geojson: geometryCollection,
-                relation: 'intersects'
-            }
-        });
-        return datasets;
-    } else {
+    // Datasets must be within all the date ranges
+    var dateRanges = conditions.filter((condition) => condition.type === 'daterange');
+    var starts = dateRanges.map((condition) => condition.start).filter((date) => date);
+    var ends = dateRanges.map((condition) => condition.end).filter((date) => date);
+
+    if (!geometryCollection.geometries.length && !starts.length && !ends.length) {
         return loadAllDatasets();
     }
+
+    var params = {};
+    if (geometryCollection.geometries.length) {
+        params.geojson = geometryCollection;
+        params.relation = 'intersects';
+    }
+    if (starts.length) {
+        params.start = starts.sort()[starts.length - 1];
+    }
+    if (ends.length) {
+        params.end = ends.sort()[0];
+    }
+
+    // Load the pages of results
+    var datasets = [];
+    var cursor = null;
+    do {
+        let { data: page } = await girder.girder.get('dataset/search', {
+            params: cursor ? { ...params, cursor } : params
+        });
+        datasets = datasets.concat(page.datasets);
+        cursor = page.cursor;
+    } while (cursor);
+    return datasets;
 }
 
 export const loadDatasetByIds = (ids) => {
@@ -12,9 +12,9 @@ from .classify_materials import classifyMaterials  # noqa: F401
 from .fit_dtm import fitDtm  # noqa: F401
 from .generate_dsm import generateDsm  # noqa: F401
 from .generate_point_cloud import generatePointCloud  # noqa: F401
-from .msi_to_rgb import msiToRgb  # noqa: F401
+from .msi_to_rgb import msiToRgb, msiToRgbImage  # noqa: F401
 from .orthorectify import orthorectify  # noqa: F401
-from .pansharpen import pansharpen  # noqa: F401
+from .pansharpen import pansharpen, pansharpenImagePair  # noqa: F401
 from .roof_geon_extraction import roofGeonExtraction  # noqa: F401
 from .compute_ndvi import computeNdvi  # noqa: F401
 from .segment_by_height import segmentByHeight  # noqa: F401
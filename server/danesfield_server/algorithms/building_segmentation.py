@@ -7,20 +7,18 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderFolderIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
+    createModelVolume,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 
 
@@ -70,6 +68,9 @@ def buildingSegmentation(
     """
     gc = createGirderClient(requestInfo)
 
+    # Model version cached on the worker host
+    modelVolume = createModelVolume(gc, modelFolder)
+
     # Set output directory
     outputVolumePath = VolumePath(".")
 
@@ -77,15 +78,15 @@ def buildingSegmentation(
     containerArgs = [
         "danesfield/tools/building_segmentation.py",
         "--rgb_image",
-        GirderFileIdToVolume(rgbImageFile["_id"], gc=gc),
+        stageFile(gc, rgbImageFile),
         "--msi_image",
-        GirderFileIdToVolume(msiImageFile["_id"], gc=gc),
+        stageFile(gc, msiImageFile),
         "--dsm",
-        GirderFileIdToVolume(dsmFile["_id"], gc=gc),
+        stageFile(gc, dsmFile),
         "--dtm",
-        GirderFileIdToVolume(dtmFile["_id"], gc=gc),
+        stageFile(gc, dtmFile),
         "--model_dir",
-        GirderFolderIdToVolume(modelFolder["_id"], gc=gc),
+        modelVolume,
         "--model_prefix",
         modelFilePrefix,
         "--save_dir",
@@ -98,12 +99,13 @@ def buildingSegmentation(
     # - Provide upload metadata
     upload_kwargs = createUploadMetadata(jobId, stepName)
     resultHooks = [
-        GirderUploadVolumePathToFolder(
+        GirderUploadRasterVolumePathToFolder(
             outputVolumePath, outputFolder["_id"], upload_kwargs=upload_kwargs, gc=gc
         )
     ]
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         **createDockerRunArguments(
             image=DockerImage.DANESFIELD,
             containerArgs=containerArgs,
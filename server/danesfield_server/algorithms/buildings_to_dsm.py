@@ -9,19 +9,17 @@
 
 from celery import group
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
+    createDockerRunSignature,
     createGirderClient,
     createUploadMetadata,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 
 from ..constants import DockerImage
 from ..workflow_manager import DanesfieldWorkflowManager
@@ -70,11 +68,11 @@ def buildingsToDsm(
 
     containerArgsDSM = [
         "danesfield/tools/buildings_to_dsm.py",
-        GirderFileIdToVolume(dtmFile["_id"], gc=gc),
+        stageFile(gc, dtmFile),
         outputDSMVolumePath,
         "--input_obj_paths",
     ]
-    containerArgsDSM.extend([GirderFileIdToVolume(f["_id"], gc=gc) for f in objFiles])
+    containerArgsDSM.extend([stageFile(gc, f) for f in objFiles])
 
     # Set output path for CLS
     outputCLSName = outputPrefix + "_rendered_CLS.tif"
@@ -82,30 +80,31 @@ def buildingsToDsm(
 
     containerArgsCLS = [
         "danesfield/tools/buildings_to_dsm.py",
-        GirderFileIdToVolume(dtmFile["_id"], gc=gc),
+        stageFile(gc, dtmFile),
         outputCLSVolumePath,
         "--render_cls",
         "--input_obj_paths",
     ]
-    containerArgsCLS.extend([GirderFileIdToVolume(f["_id"], gc=gc) for f in objFiles])
+    containerArgsCLS.extend([stageFile(gc, f) for f in objFiles])
 
     # Result hooks
     # - Upload output files to output folder
     # - Provide upload metadata
     upload_kwargs = createUploadMetadata(jobId, stepName)
     dsmResultHooks = [
-        GirderUploadVolumePathToFolder(
+        GirderUploadRasterVolumePathToFolder(
             outputDSMVolumePath, outputFolder["_id"], upload_kwargs=upload_kwargs, gc=gc
         )
     ]
     clsResultHooks = [
-        GirderUploadVolumePathToFolder(
+        GirderUploadRasterVolumePathToFolder(
             outputCLSVolumePath, outputFolder["_id"], upload_kwargs=upload_kwargs, gc=gc
         )
     ]
 
     tasks = [
-        docker_run.s(
+        createDockerRunSignature(
+            stepName,
             **createDockerRunArguments(
                 image=DockerImage.DANESFIELD,
                 containerArgs=containerArgsDSM,
@@ -115,7 +114,8 @@ def buildingsToDsm(
                 resultHooks=dsmResultHooks,
             )
         ),
-        docker_run.s(
+        createDockerRunSignature(
+            stepName,
             **createDockerRunArguments(
                 image=DockerImage.DANESFIELD,
                 containerArgs=containerArgsCLS,
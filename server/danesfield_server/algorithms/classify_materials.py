@@ -9,19 +9,17 @@
 
 import itertools
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 
 
@@ -80,19 +78,16 @@ def classifyMaterials(
                 "python",
                 "danesfield/tools/material_classifier.py",
                 "--model_path",
-                GirderFileIdToVolume(modelFile["_id"], gc=gc),
+                stageFile(gc, modelFile),
                 "--output_dir",
                 outputVolumePath,
                 "--outfile_prefix",
                 outfilePrefix,
                 "--image_paths",
             ],
-            [GirderFileIdToVolume(imageFile["_id"], gc=gc) for imageFile in imageFiles],
+            [stageFile(gc, imageFile) for imageFile in imageFiles],
             ["--info_paths"],
-            [
-                GirderFileIdToVolume(metadataFile["_id"], gc=gc)
-                for metadataFile in metadataFiles
-            ],
+            [stageFile(gc, metadataFile) for metadataFile in metadataFiles],
         )
     )
     if cuda is None or cuda:
@@ -105,12 +100,13 @@ def classifyMaterials(
     # - Provide upload metadata
     upload_kwargs = createUploadMetadata(jobId, stepName)
     resultHooks = [
-        GirderUploadVolumePathToFolder(
+        GirderUploadRasterVolumePathToFolder(
             outputVolumePath, outputFolder["_id"], upload_kwargs=upload_kwargs, gc=gc
         )
     ]
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         runtime="nvidia",
         **createDockerRunArguments(
             image=DockerImage.DANESFIELD,
@@ -10,12 +10,36 @@
 import json
 import re
 
+from girder.exceptions import FilePathException
+from girder.models.file import File
 from girder_jobs import Job
 
 from girder_client import GirderClient
+from girder_worker.docker.tasks import docker_run
 
-from ..constants import DanesfieldJobKey
+from .container_pool import pooled_docker_run
+from .staging import (
+    AssetstoreFileToVolume,
+    GirderModelVolume,
+    MountedInput,
+)
+from ..constants import DanesfieldJobKey, DanesfieldStep
+from ..model_registry import getFolderModel, getReferencedModelVersions
 from ..utilities import removeDuplicateCount
+from ..workflow_manager import DanesfieldWorkflowManager
+
+# Steps whose tasks are short enough that starting a container dominates
+# their run time. They run in the container pool of worker hosts that have
+# one (see container_pool).
+POOLED_STEPS = {
+    DanesfieldStep.BUILDINGS_TO_DSM,
+    DanesfieldStep.COMPUTE_NDVI,
+    DanesfieldStep.CROP_AND_PANSHARPEN,
+    DanesfieldStep.FIT_DTM,
+    DanesfieldStep.MSI_TO_RGB,
+    DanesfieldStep.ORTHORECTIFY,
+    DanesfieldStep.PANSHARPEN,
+}
 
 
 def createGirderClient(requestInfo):
@@ -25,6 +49,48 @@ def createGirderClient(requestInfo):
     return gc
 
 
+def createModelVolume(gc, modelFolder):
+    """
+    Return a read-only volume containing the current version of a model
+    folder. Pass the volume in the volumes of the task, and use it as a
+    container argument for the path of the folder.
+
+    :param gc: Girder client.
+    :type gc: GirderClient
+    :param modelFolder: Model folder document.
+    :type modelFolder: dict
+    :returns: GirderModelVolume
+    """
+    return GirderModelVolume(
+        getFolderModel(modelFolder),
+        referencedVersions=getReferencedModelVersions(),
+        gc=gc,
+    )
+
+
+def stageFile(gc, file, filename=None):
+    """
+    Return a container argument for the path of an input file. Files in a
+    filesystem assetstore are mounted read-only from the assetstore when
+    it's on the worker host. Other files are downloaded through the file
+    cache of the worker host.
+
+    :param gc: Girder client.
+    :type gc: GirderClient
+    :param file: File document.
+    :type file: dict
+    :param filename: Name of the file in the container. Defaults to the
+        name of the file.
+    :type filename: str
+    """
+    try:
+        assetstorePath = File().getLocalFilePath(file)
+    except FilePathException:
+        # Not in a filesystem assetstore
+        assetstorePath = None
+    return AssetstoreFileToVolume(file, assetstorePath, filename=filename, gc=gc)
+
+
 def createUploadMetadata(jobId, stepName):
     """
     Return metadata to supply with uploaded files, including:
@@ -85,7 +151,85 @@ def createDockerRunArguments(
     return args
 
 
-def addJobInfo(job, jobId, stepName, workingSetId):
+def configureTaskPriorities(app):
+    """
+    Configure a Celery app so that the priorities of the docker_run tasks of
+    the steps take effect. The Girder server and the workers declare the
+    queues with the same maximum priority, since RabbitMQ doesn't change the
+    arguments of an existing queue.
+
+    :param app: The Celery app of Girder Worker.
+    :type app: celery.Celery
+    """
+    app.conf.task_queue_max_priority = DanesfieldWorkflowManager.MAX_PRIORITY
+    app.conf.task_default_priority = 0
+    # Reserve a single task at a time, so that tasks of higher priority
+    # queued later don't wait behind tasks that a worker already reserved
+    app.conf.worker_prefetch_multiplier = 1
+
+
+def createDockerRunOptions(stepName):
+    """
+    Return Celery options to use when sending a docker_run task for a step.
+    The task priority favors steps on the critical path of the workflow.
+
+    :param stepName: The name of the step.
+    :type stepName: str (DanesfieldStep)
+    :returns: dict
+    """
+    return {"priority": DanesfieldWorkflowManager.instance().getStepPriority(stepName)}
+
+
+def _addMountedInputs(kwargs):
+    """
+    Add the container arguments that are mounted inputs to the volumes
+    of a docker_run task.
+    """
+    volumes = list(kwargs.get("volumes") or [])
+    for arg in kwargs.get("container_args", []):
+        if isinstance(arg, MountedInput) and arg not in volumes:
+            volumes.append(arg)
+    if volumes:
+        kwargs["volumes"] = volumes
+    return kwargs
+
+
+def _getDockerRunTask(stepName):
+    """
+    Get the task that runs the containers of a step.
+    """
+    return pooled_docker_run if stepName in POOLED_STEPS else docker_run
+
+
+def dispatchDockerRun(stepName, **kwargs):
+    """
+    Send a docker_run task for a step.
+
+    :param stepName: The name of the step.
+    :type stepName: str (DanesfieldStep)
+    :param kwargs: Arguments to pass to docker_run.
+    :returns: celery.result.AsyncResult
+    """
+    return _getDockerRunTask(stepName).apply_async(
+        kwargs=_addMountedInputs(kwargs), **createDockerRunOptions(stepName)
+    )
+
+
+def createDockerRunSignature(stepName, **kwargs):
+    """
+    Return the signature of a docker_run task for a step, for use in
+    Celery groups.
+
+    :param stepName: The name of the step.
+    :type stepName: str (DanesfieldStep)
+    :param kwargs: Arguments to pass to docker_run.
+    :returns: celery.Signature
+    """
+    task = _getDockerRunTask(stepName)
+    return task.s(**_addMountedInputs(kwargs)).set(**createDockerRunOptions(stepName))
+
+
+def addJobInfo(job, jobId, stepName, workingSetId=None):
     """
     Add common information to a job for use by job event listeners.
     This information allows the job event handler/workflow manager to
@@ -97,6 +241,9 @@ def addJobInfo(job, jobId, stepName, workingSetId):
     :type jobId: str
     :param stepName: The name of the step.
     :type stepName: str (DanesfieldStep)
+    :param workingSetId: ID of the working set whose output folder
+    receives the results of the workflow, if any.
+    :type workingSetId: ObjectId
     :returns: Updated job document.
     """
     if jobId is not None:
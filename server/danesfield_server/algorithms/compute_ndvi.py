@@ -9,18 +9,16 @@
 
 import itertools
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 from .common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 
 
@@ -67,7 +65,7 @@ def computeNdvi(
                 "python",
                 "danesfield/tools/compute_ndvi.py",
             ],
-            [GirderFileIdToVolume(imageFile["_id"], gc=gc) for imageFile in imageFiles],
+            [stageFile(gc, imageFile) for imageFile in imageFiles],
             [ndviOutputVolumePath],
         )
     )
@@ -77,7 +75,7 @@ def computeNdvi(
     # - Provide upload metadata
     upload_kwargs = createUploadMetadata(jobId, stepName)
     resultHooks = [
-        GirderUploadVolumePathToFolder(
+        GirderUploadRasterVolumePathToFolder(
             ndviOutputVolumePath,
             outputFolder["_id"],
             upload_kwargs=upload_kwargs,
@@ -85,7 +83,8 @@ def computeNdvi(
         )
     ]
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         **createDockerRunArguments(
             image=DockerImage.DANESFIELD,
             containerArgs=containerArgs,
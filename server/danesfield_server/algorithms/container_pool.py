@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+"""
+Pool of long-lived Danesfield containers on worker hosts.
+
+Short steps spend most of their time starting a container. The
+pooled_docker_run task runs the container arguments of a task with
+docker exec in a container of the pool instead, when the worker host has
+a pool. The task otherwise behaves as docker_run: it uses the same
+volumes, result hooks and job status.
+
+The containers of the pool bind mount a set of host directories at the
+same path: read-write directories for the temporary volumes, and
+read-only directories for the inputs, such as the caches. The volumes of
+a task, which must be in those directories with the same mode, are
+linked at their path in the container before the command runs. Each
+container of the pool runs one command at a time; when all the
+containers are busy, the task runs in a new container.
+
+The pool is configured on the worker with environment variables:
+- DANESFIELD_CONTAINER_POOL_SIZE: Number of containers per image on the
+  host. The pool is disabled when it's 0, the default.
+- DANESFIELD_CONTAINER_POOL_MOUNTS: Host directories mounted read-write
+  in the containers, separated by colons. Defaults to the temporary
+  directory, which contains the temporary volumes.
+- DANESFIELD_CONTAINER_POOL_READONLY_MOUNTS: Host directories mounted
+  read-only in the containers, separated by colons. Defaults to the
+  staging directory of the file cache and the model cache. Add the
+  directory of the filesystem assetstore when inputs are mounted from it.
+- DANESFIELD_CONTAINER_POOL_MAX_USES: Number of commands after which a
+  container is replaced, so that files the commands leave in the
+  container don't accumulate.
+
+The entrypoint of the image must exec its command, so that the commands
+run in the environment it sets up.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+
+from girder_worker.app import app
+from girder_worker.docker.tasks import (
+    DockerTask,
+    _add_environment_kargs,
+    _docker_run,
+    _handle_streaming_args,
+    _run_container,
+)
+
+from .file_cache import FileCache, ModelCache
+
+DEFAULT_MAX_USES = 100
+
+# Arguments of docker_run that pooled containers support
+POOLED_RUN_ARGS = {"environment"}
+
+
+def _isUnder(path, directory):
+    path = os.path.realpath(path)
+    directory = os.path.realpath(directory)
+    return os.path.commonpath([path, directory]) == directory
+
+
+class ContainerPool:
+    """
+    Containers of the pool of a worker host. The containers are shared by
+    the worker processes of the host; a lock file for each container
+    ensures that it runs one command at a time.
+    """
+
+    def __init__(
+        self, size, mounts, readOnlyMounts=(), maxUses=DEFAULT_MAX_USES, lockDir=None
+    ):
+        """
+        :param size: Number of containers per image.
+        :type size: int
+        :param mounts: Host directories mounted read-write in the
+            containers.
+        :type mounts: list[str]
+        :param readOnlyMounts: Host directories mounted read-only in the
+            containers. They may be in the read-write directories.
+        :type readOnlyMounts: list[str]
+        :param maxUses: Number of commands after which a container is
+            replaced.
+        :type maxUses: int
+        :param lockDir: Directory of the lock files.
+        :type lockDir: str
+        """
+        self.size = size
+        self.mounts = [os.path.realpath(mount) for mount in mounts]
+        self.readOnlyMounts = [os.path.realpath(mount) for mount in readOnlyMounts]
+        self.maxUses = maxUses
+        self.lockDir = lockDir or os.path.join(
+            tempfile.gettempdir(), "danesfield-container-pool"
+        )
+        os.makedirs(self.lockDir, exist_ok=True)
+
+    @classmethod
+    def fromEnvironment(cls):
+        """
+        Create the pool configured by the environment of the worker, or
+        return None if the worker host has no pool.
+        """
+        size = int(os.environ.get("DANESFIELD_CONTAINER_POOL_SIZE", 0))
+        if size <= 0:
+            return None
+        mounts = os.environ.get("DANESFIELD_CONTAINER_POOL_MOUNTS")
+        readOnlyMounts = os.environ.get("DANESFIELD_CONTAINER_POOL_READONLY_MOUNTS")
+        return cls(
+            size,
+            mounts.split(":") if mounts else [tempfile.gettempdir()],
+            readOnlyMounts=(
+                readOnlyMounts.split(":")
+                if readOnlyMounts
+                else [
+                    FileCache.fromEnvironment().stagingDirectory,
+                    ModelCache.fromEnvironment().directory,
+                ]
+            ),
+            maxUses=int(
+                os.environ.get("DANESFIELD_CONTAINER_POOL_MAX_USES", DEFAULT_MAX_USES)
+            ),
+        )
+
+    def getVolumes(self):
+        """
+        Get the volumes of the containers, as passed to docker-py.
+        """
+        volumes = {mount: {"bind": mount, "mode": "rw"} for mount in self.mounts}
+        volumes.update(
+            {mount: {"bind": mount, "mode": "ro"} for mount in self.readOnlyMounts}
+        )
+        return volumes
+
+    def supports(self, volumes):
+        """
+        Whether the volumes of a task are in the directories mounted in
+        the containers with the same mode, so that read-only volumes
+        can't be written.
+
+        :param volumes: Volumes of the task, as passed to docker-py.
+        :type volumes: dict
+        """
+
+        def isSupported(hostPath, volume):
+            readOnly = any(_isUnder(hostPath, mount) for mount in self.readOnlyMounts)
+            if volume.get("mode") == "ro":
+                return readOnly
+            return not readOnly and any(
+                _isUnder(hostPath, mount) for mount in self.mounts
+            )
+
+        return all(
+            isSupported(hostPath, volume) for hostPath, volume in volumes.items()
+        )
+
+    def acquire(self, image):
+        """
+        Acquire a container of the pool that isn't running a command.
+
+        :param image: Docker image of the container.
+        :type image: str
+        :returns: PooledContainer or None if all the containers are busy.
+        """
+        prefix = re.sub("[^a-zA-Z0-9_.-]", "_", image)
+        for index in range(self.size):
+            name = "danesfield-pool-{}-{}".format(prefix, index)
+            lockFile = open(os.path.join(self.lockDir, name + ".lock"), "a+")
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lockFile.close()
+                continue
+            return PooledContainer(self, image, name, lockFile)
+        return None
+
+
+class PooledContainer:
+    """
+    A container of the pool, held by a task until it's released. The lock
+    file of the container records the number of commands it ran.
+    """
+
+    def __init__(self, pool, image, name, lockFile):
+        import docker
+
+        self.pool = pool
+        self.image = image
+        self.name = name
+        self._lockFile = lockFile
+        self.client = docker.from_env(version="auto")
+        self.container = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def release(self):
+        fcntl.flock(self._lockFile, fcntl.LOCK_UN)
+        self._lockFile.close()
+
+    def _getUses(self):
+        self._lockFile.seek(0)
+        try:
+            return int(self._lockFile.read() or 0)
+        except ValueError:
+            return 0
+
+    def _setUses(self, uses):
+        self._lockFile.seek(0)
+        self._lockFile.truncate()
+        self._lockFile.write(str(uses))
+        self._lockFile.flush()
+
+    def _start(self):
+        """
+        Get the running container, replacing it if it stopped, if its
+        image or mounts were updated, or if it ran too many commands.
+        """
+        from docker.errors import NotFound
+
+        try:
+            container = self.client.containers.get(self.name)
+        except NotFound:
+            container = None
+
+        volumes = self.pool.getVolumes()
+        mountsLabel = json.dumps(volumes, sort_keys=True)
+        if container is not None and (
+            container.status != "running"
+            or container.image.id != self.client.images.get(self.image).id
+            or container.labels.get("danesfield.mounts") != mountsLabel
+            or self._getUses() >= self.pool.maxUses
+        ):
+            container.remove(force=True)
+            container = None
+
+        if container is None:
+            runKwargs = {
+                "tty": False,
+                "detach": True,
+                "name": self.name,
+                "labels": {
+                    "danesfield.pool": self.image,
+                    "danesfield.mounts": mountsLabel,
+                },
+                "volumes": volumes,
+            }
+            _add_environment_kargs(runKwargs)
+            container = _run_container(self.image, ["sleep", "infinity"], **runKwargs)
+            self._setUses(0)
+        return container
+
+    def _exec(self, command, environment=None, output=True):
+        """
+        Run a command in the container, and return its exit code.
+        """
+        execId = self.client.api.exec_create(
+            self.container.id, command, environment=environment
+        )["Id"]
+        for stdout, stderr in self.client.api.exec_start(
+            execId, stream=True, demux=True
+        ):
+            if output and stdout:
+                sys.stdout.write(stdout.decode(errors="replace"))
+            if output and stderr:
+                sys.stderr.write(stderr.decode(errors="replace"))
+        return self.client.api.exec_inspect(execId)["ExitCode"]
+
+    def _getEnvironment(self):
+        """
+        Get the environment of the main process of the container, which
+        was set up by the entrypoint of the image.
+        """
+        execId = self.client.api.exec_create(
+            self.container.id, ["cat", "/proc/1/environ"]
+        )["Id"]
+        environ = self.client.api.exec_start(execId).decode(errors="replace")
+        return [variable for variable in environ.split("\0") if "=" in variable]
+
+    def _watchCancel(self, task, done):
+        """
+        Stop the container if the task is canceled while a command runs.
+        """
+        while not done.wait(1):
+            if task.canceled:
+                self.container.kill()
+                return
+
+    def run(self, task, containerArgs, volumes, environment=None):
+        """
+        Run the container arguments of a task as a command in the
+        container.
+
+        :param task: The task.
+        :type task: DockerTask
+        :param containerArgs: Container arguments.
+        :type containerArgs: list[str]
+        :param volumes: Volumes of the task, as passed to docker-py.
+        :type volumes: dict
+        :param environment: Environment variables of the form NAME=value.
+        :type environment: list[str]
+        """
+        from docker.errors import DockerException
+
+        self.container = self._start()
+        self._setUses(self._getUses() + 1)
+
+        # Link the volumes at their path in the container
+        links = [(volume["bind"], hostPath) for hostPath, volume in volumes.items()]
+        linkArgs = [arg for link in links for arg in link]
+        if linkArgs:
+            self._exec(
+                [
+                    "sh",
+                    "-c",
+                    'while [ $# -gt 0 ]; do mkdir -p "$(dirname "$1")" && '
+                    'ln -sfn "$2" "$1"; shift 2; done',
+                    "sh",
+                ]
+                + linkArgs
+            )
+
+        done = threading.Event()
+        watcher = threading.Thread(
+            target=self._watchCancel, args=(task, done), daemon=True
+        )
+        watcher.start()
+        try:
+            exitCode = self._exec(
+                [str(arg) for arg in containerArgs],
+                environment=self._getEnvironment() + list(environment or []),
+            )
+        finally:
+            done.set()
+            watcher.join()
+            if not task.canceled and links:
+                with contextlib.suppress(DockerException):
+                    self._exec(["rm", "-f"] + [link for link, _ in links])
+
+        if not task.canceled and exitCode != 0:
+            raise DockerException(
+                "Non-zero exit code from docker container (%d)." % exitCode
+            )
+
+
+@app.task(base=DockerTask, bind=True)
+def pooled_docker_run(
+    task,
+    image,
+    pull_image=True,
+    entrypoint=None,
+    container_args=None,
+    volumes=None,
+    remove_container=True,
+    **kwargs
+):
+    """
+    Run a docker_run task in a container of the pool of the worker host,
+    if possible. Takes the same arguments as docker_run.
+    """
+    pool = ContainerPool.fromEnvironment()
+    _, readStreams, writeStreams = _handle_streaming_args(container_args or [])
+    pooledContainer = None
+    if (
+        pool is not None
+        and entrypoint is None
+        and not readStreams
+        and not writeStreams
+        and set(kwargs) <= POOLED_RUN_ARGS
+        and pool.supports(volumes or {})
+    ):
+        pooledContainer = pool.acquire(image)
+
+    if pooledContainer is None:
+        return _docker_run(
+            task,
+            image,
+            pull_image,
+            entrypoint,
+            container_args,
+            volumes,
+            remove_container,
+            **kwargs
+        )
+
+    with pooledContainer:
+        pooledContainer.run(
+            task, container_args or [], volumes or {}, kwargs.get("environment")
+        )
+
+    # As docker_run, return a result for each result hook
+    results = []
+    if hasattr(task.request, "girder_result_hooks"):
+        results = (None,) * len(task.request.girder_result_hooks)
+    return results
@@ -9,21 +9,19 @@
 
 from celery import group
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
+    createDockerRunSignature,
     createGirderClient,
     createUploadMetadata,
     imagePrefix,
     rpcPrefix,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 from ..workflow_manager import DanesfieldWorkflowManager
 
@@ -78,26 +76,24 @@ def cropAndPansharpen(
 
         containerArgs = [
             "danesfield/tools/crop_and_pansharpen.py",
-            GirderFileIdToVolume(dsmFile["_id"], gc=gc),
+            stageFile(gc, dsmFile),
             outputVolumePath,
             "--pan",
-            GirderFileIdToVolume(panImageFile["_id"], gc=gc),
+            stageFile(gc, panImageFile),
         ]
         if panRpcFile is not None:
-            containerArgs.append(GirderFileIdToVolume(panRpcFile["_id"], gc=gc))
+            containerArgs.append(stageFile(gc, panRpcFile))
 
-        containerArgs.extend(
-            ["--msi", GirderFileIdToVolume(msiImageFile["_id"], gc=gc)]
-        )
+        containerArgs.extend(["--msi", stageFile(gc, msiImageFile)])
         if msiRpcFile is not None:
-            containerArgs.append(GirderFileIdToVolume(msiRpcFile["_id"], gc=gc))
+            containerArgs.append(stageFile(gc, msiRpcFile))
 
         # Result hooks
         # - Upload output files to output folder
         # - Provide upload metadata
         upload_kwargs = createUploadMetadata(jobId, stepName)
         resultHooks = [
-            GirderUploadVolumePathToFolder(
+            GirderUploadRasterVolumePathToFolder(
                 outputVolumePath,
                 outputFolder["_id"],
                 upload_kwargs=upload_kwargs,
@@ -105,7 +101,8 @@ def cropAndPansharpen(
             )
         ]
 
-        return docker_run.s(
+        return createDockerRunSignature(
+            stepName,
             **createDockerRunArguments(
                 image=DockerImage.DANESFIELD,
                 containerArgs=containerArgs,
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+"""
+Disk caches of Girder files and model folders on worker hosts.
+
+Files are keyed by their ID and SHA-512 checksum, so a file whose content
+changes is downloaded again. The cache is shared by all tasks on a host;
+file locks ensure that concurrent tasks download each file only once.
+The least recently used files are evicted when the cache exceeds its
+size.
+
+The cache is configured on the worker with environment variables:
+- DANESFIELD_FILE_CACHE_DIR: Directory of the cache. Staged files are
+  hard links to cached files in a subdirectory, which is bind mounted
+  read-only in the containers, so the Docker daemon must see the
+  directory at the same path as the worker.
+- DANESFIELD_FILE_CACHE_SIZE: Maximum size of the cache, in bytes.
+- DANESFIELD_MODEL_CACHE_DIR: Directory of the model cache. It should
+  persist across restarts of the worker.
+"""
+
+import contextlib
+import errno
+import fcntl
+import os
+import shutil
+
+from .transfer import downloadFile
+
+DEFAULT_CACHE_DIR = "/tmp/danesfield-file-cache"
+DEFAULT_CACHE_SIZE = 50 * 1024**3
+DEFAULT_MODEL_CACHE_DIR = "/tmp/danesfield-model-cache"
+
+# Subdirectory of the file cache in which files are staged
+STAGING_DIRNAME = "staged"
+
+
+@contextlib.contextmanager
+def _lock(directory, name):
+    """
+    Hold an exclusive lock shared by all processes on the host.
+    """
+    with open(os.path.join(directory, name + ".lock"), "w") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+
+class FileCache:
+    """
+    Size-capped LRU cache of Girder files in a directory.
+
+    The time at which a file was last used is its modification time, so
+    the cache has no state besides the files themselves.
+    """
+
+    def __init__(self, directory, maxBytes):
+        """
+        :param directory: Directory of the cache.
+        :type directory: str
+        :param maxBytes: Maximum size of the cache, in bytes.
+        :type maxBytes: int
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.stagingDirectory = os.path.join(directory, STAGING_DIRNAME)
+        os.makedirs(self.stagingDirectory, exist_ok=True)
+
+        # Statistics of this cache instance
+        self.hits = 0
+        self.misses = 0
+        self.evictedBytes = 0
+
+    @classmethod
+    def fromEnvironment(cls):
+        """
+        Create the cache configured by the environment of the worker.
+        """
+        return cls(
+            os.environ.get("DANESFIELD_FILE_CACHE_DIR", DEFAULT_CACHE_DIR),
+            int(os.environ.get("DANESFIELD_FILE_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+        )
+
+    def _lock(self, name):
+        return _lock(self.directory, name)
+
+    def _entries(self):
+        """
+        List cached files as tuples of the form (last use, size, path).
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name == STAGING_DIRNAME or name.endswith((".lock", ".partial")):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self, size):
+        """
+        Remove the least recently used files until a file of the given
+        size fits in the cache. Returns the number of bytes removed.
+        """
+        evicted = 0
+        with self._lock("cache"):
+            entries = sorted(self._entries())
+            total = sum(entrySize for _, entrySize, _ in entries)
+            for _, entrySize, path in entries:
+                if total + size <= self.maxBytes:
+                    break
+                # Inputs that staged the file keep their hard link
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                total -= entrySize
+                evicted += entrySize
+        self.evictedBytes += evicted
+        return evicted
+
+    def getStagingPath(self, stagingId):
+        """
+        Get the path of a directory in which to stage files.
+
+        :param stagingId: Unique ID of the directory.
+        :type stagingId: str
+        """
+        return os.path.join(self.stagingDirectory, stagingId)
+
+    def fetch(self, gc, fileId, checksum, size, destination):
+        """
+        Stage a file at a destination path in the staging directory (see
+        getStagingPath), downloading it if it isn't cached. The staged file
+        is a read-only hard link to the cached file, so it remains when the
+        cached file is evicted.
+
+        :param gc: Girder client.
+        :type gc: GirderClient
+        :param fileId: ID of the file.
+        :type fileId: str
+        :param checksum: SHA-512 checksum of the file.
+        :type checksum: str
+        :param size: Size of the file, in bytes.
+        :type size: int
+        :param destination: Path at which to stage the file.
+        :type destination: str
+        :returns: Tuple of the form (hit, evicted bytes).
+        """
+        key = "{}-{}".format(fileId, checksum)
+        path = os.path.join(self.directory, key)
+
+        # Only one process downloads the file; others wait for it
+        with self._lock(key):
+            # Eviction holds the cache lock, so the file can't be removed
+            # before it's staged
+            with self._lock("cache"):
+                if os.path.exists(path):
+                    # Mark as recently used
+                    os.utime(path)
+                    self._link(path, destination)
+                    self.hits += 1
+                    return True, 0
+
+            evicted = self._evict(size)
+            # Download to the destination, which is never evicted, and add
+            # it to the cache
+            downloadFile(gc, fileId, destination, size=size, checksum=checksum)
+            os.chmod(destination, 0o444)
+            with self._lock("cache"):
+                self._link(destination, path)
+            self.misses += 1
+            return False, evicted
+
+    def _link(self, path, destination):
+        """
+        Link a file to a destination path, or copy it if it can't be
+        linked.
+        """
+        try:
+            os.link(path, destination)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copyfile(path, destination)
+            os.chmod(destination, 0o444)
+
+
+class ModelCache:
+    """
+    Persistent cache of model folder versions (see model_registry). Each
+    version is downloaded once per host into a read-only directory named
+    by the version.
+
+    Tasks pin the versions they use with a shared lock on a pin file of
+    the version, so that versions that are no longer referenced are only
+    removed once no task uses them.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory of the cache.
+        :type directory: str
+        """
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def fromEnvironment(cls):
+        """
+        Create the cache configured by the environment of the worker.
+        """
+        return cls(
+            os.environ.get("DANESFIELD_MODEL_CACHE_DIR", DEFAULT_MODEL_CACHE_DIR)
+        )
+
+    def getPath(self, version):
+        """
+        Get the directory of a version.
+        """
+        return os.path.join(self.directory, version)
+
+    def _pin(self, version):
+        """
+        Open the pin file of a version and lock it. Call with the lock of
+        the version held, so that the version isn't removed meanwhile.
+        """
+        pin = open(os.path.join(self.directory, version + ".pin"), "w")
+        fcntl.flock(pin, fcntl.LOCK_SH)
+        return pin
+
+    def materialize(self, version, download):
+        """
+        Get the directory of a version, downloading it if necessary, and
+        pin the version. Close the returned pin once the version is no
+        longer used.
+
+        :param version: The version of the model.
+        :type version: str
+        :param download: Function that downloads the files of the version
+            to the directory passed to it.
+        :type download: callable
+        :returns: Tuple of the form (path, hit, pin).
+        """
+        path = self.getPath(version)
+        with _lock(self.directory, version):
+            if os.path.isdir(path):
+                return path, True, self._pin(version)
+
+            partialPath = path + ".partial"
+            shutil.rmtree(partialPath, ignore_errors=True)
+            download(partialPath)
+            for root, _, files in os.walk(partialPath):
+                for name in files:
+                    os.chmod(os.path.join(root, name), 0o444)
+            os.rename(partialPath, path)
+            return path, False, self._pin(version)
+
+    def collectGarbage(self, referencedVersions):
+        """
+        Remove the versions that aren't referenced and aren't pinned by a
+        task.
+
+        :param referencedVersions: Versions to keep.
+        :type referencedVersions: iterable of str
+        :returns: The removed versions.
+        """
+        referencedVersions = set(referencedVersions)
+        removed = []
+        with _lock(self.directory, "cache"):
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name in referencedVersions or not os.path.isdir(path):
+                    continue
+                if name.endswith(".partial"):
+                    continue
+                # Lock and pin files are kept, since other processes may
+                # wait on them
+                with _lock(self.directory, name):
+                    with open(os.path.join(self.directory, name + ".pin"), "w") as pin:
+                        try:
+                            fcntl.flock(pin, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except BlockingIOError:
+                            # A task uses the version
+                            continue
+                        shutil.rmtree(path, ignore_errors=True)
+                removed.append(name)
+        return removed
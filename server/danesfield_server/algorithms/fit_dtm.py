@@ -7,19 +7,17 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 
 
@@ -71,7 +69,7 @@ def fitDtm(
     containerArgs = [
         "python",
         "danesfield/tools/fit_dtm.py",
-        GirderFileIdToVolume(dsmFile["_id"], gc=gc),
+        stageFile(gc, dsmFile),
         outputVolumePath,
     ]
     if iterations is not None:
@@ -84,12 +82,13 @@ def fitDtm(
     # - Provide upload metadata
     upload_kwargs = createUploadMetadata(jobId, stepName)
     resultHooks = [
-        GirderUploadVolumePathToFolder(
+        GirderUploadRasterVolumePathToFolder(
             outputVolumePath, outputFolder["_id"], upload_kwargs=upload_kwargs, gc=gc
         )
     ]
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         **createDockerRunArguments(
             image=DockerImage.DANESFIELD,
             containerArgs=containerArgs,
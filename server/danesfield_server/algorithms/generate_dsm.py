@@ -7,19 +7,17 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 
 
@@ -67,7 +65,7 @@ def generateDsm(
         "danesfield/tools/generate_dsm.py",
         outputVolumePath,
         "--source_points",
-        GirderFileIdToVolume(pointCloudFile["_id"], gc=gc),
+        stageFile(gc, pointCloudFile),
     ]
 
     # Result hooks
@@ -75,12 +73,13 @@ def generateDsm(
     # - Provide upload metadata
     upload_kwargs = createUploadMetadata(jobId, stepName)
     resultHooks = [
-        GirderUploadVolumePathToFolder(
+        GirderUploadRasterVolumePathToFolder(
             outputVolumePath, outputFolder["_id"], upload_kwargs=upload_kwargs, gc=gc
         )
     ]
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         **createDockerRunArguments(
             image=DockerImage.DANESFIELD,
             containerArgs=containerArgs,
@@ -8,72 +8,26 @@
 ###############################################################################
 
 import itertools
-import shutil
-from typing import List, Union
-import docker
 
-import os
 import json
-import tempfile
 import utm
-from pathlib import Path
 
 from docker.types import DeviceRequest
-from girder_worker.docker.tasks import docker_run
-
-# from girder_worker.docker.transforms import Transform
-from girder_worker_utils.transforms.girder_io import ResultTransform
-from girder_worker.docker.transforms import BindMountVolume
-from girder_worker.docker.transforms.girder import (
-    GirderUploadVolumePathToFolder,
-)
+from girder_worker.docker.transforms import VolumePath
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
 )
+from .scratch import ScratchWorkspace
+from .staging import GirderFilesToVolume, TemplateFileToVolume
+from .upload import StreamingUploadVolume
 from ..constants import DockerImage
 
 
-class RemoveTemporaryPathsTransform(ResultTransform):
-    """Remove specified files/folders as a result hook."""
-
-    def __init__(self, paths: List[Union[Path, str]]) -> None:
-        self.paths = paths
-
-    def exception(self):
-        pass
-
-    def transform(self, *args, **kwargs):
-        for pathname in self.paths:
-            path = Path(pathname)
-            if not path.exists:
-                continue
-
-            if path.is_file():
-                os.remove(path)
-
-            if path.is_dir():
-                shutil.rmtree(path)
-
-
-class ResultRunDockerCommand(ResultTransform):
-    """Call `docker run` as a result hook."""
-
-    def __init__(self, *args, **kwargs) -> None:
-        self.args = args
-        self.kwargs = kwargs
-
-    def exception(self):
-        pass
-
-    def transform(self, *args, **kwargs):
-        client = docker.from_env()
-        client.containers.run(*self.args, **self.kwargs)
-
-
 def generatePointCloud(
     initWorkingSetName,
     stepName,
@@ -107,19 +61,22 @@ def generatePointCloud(
     """
     gc = createGirderClient(requestInfo)
 
-    outputDir = tempfile.mkdtemp()
-    outputDirBindMountVolume = BindMountVolume(
-        host_path=outputDir, container_path=outputDir
+    # Work directory in the scratch space of the worker, removed once the
+    # job completes. Output files are uploaded while the container runs.
+    workspace = ScratchWorkspace(
+        jobId, expectedBytes=sum(file["size"] for pair in filePairs for file in pair)
+    )
+    outputVolume = StreamingUploadVolume(
+        workspace,
+        outputFolder["_id"],
+        upload_kwargs=createUploadMetadata(jobId, stepName),
+        gc=gc,
     )
 
-    datasetDir = tempfile.mkdtemp()
-    datasetDirPath = Path(datasetDir)
-
-    # Download images and tars to dir
-    for pair in filePairs:
-        for file in pair:
-            filepath = datasetDirPath / file["name"]
-            gc.downloadFile(str(file["_id"]), str(filepath))
+    # Images and tars are downloaded on the worker
+    datasetDir = GirderFilesToVolume(
+        [file for pair in filePairs for file in pair], dirname="dataset", gc=gc
+    )
 
     # Calculate variables from bbox
     minX, minY, maxX, maxY = aoiBBox
@@ -132,8 +89,9 @@ def generatePointCloud(
 
     # Create config dict
     config_dict = {
-        "dataset_dir": datasetDir,
-        "work_dir": outputDir,
+        # Substituted on the worker
+        "dataset_dir": "$dataset_dir",
+        "work_dir": "$work_dir",
         "bounding_box": {
             "zone_number": zone_number,
             "hemisphere": hemisphere,
@@ -160,26 +118,18 @@ def generatePointCloud(
     }
 
     # Specify output filename
-    point_cloud_output_filename = f"{outputDir}/point_cloud.las"
+    point_cloud_output_filename = VolumePath("point_cloud.las", volume=workspace)
 
-    # Create and write to config file
-    config_file_path = tempfile.mkstemp(suffix=".json")[1]
-    with open(config_file_path, "w") as config_file_in:
-        config_file_in.write(json.dumps(config_dict, indent=2))
+    # Config file is written on the worker
+    configFile = TemplateFileToVolume(
+        json.dumps(config_dict, indent=2),
+        filename="config.json",
+        substitutions={"dataset_dir": datasetDir, "work_dir": workspace},
+    )
 
     # Docker volumes
     volumes = [
-        BindMountVolume(
-            host_path=config_file_path,
-            container_path=config_file_path,
-            mode="ro",
-        ),
-        BindMountVolume(
-            host_path=datasetDir,
-            container_path=datasetDir,
-            mode="ro",
-        ),
-        outputDirBindMountVolume,
+        outputVolume,
     ]
 
     # Docker container arguments
@@ -193,9 +143,9 @@ def generatePointCloud(
                 "python",
                 "/danesfield/tools/generate_point_cloud.py",
                 "--config_file",
-                config_file_path,
+                configFile,
                 "--work_dir",
-                outputDir,
+                workspace,
                 "--point_cloud",
                 point_cloud_output_filename,
                 "--utm",
@@ -205,24 +155,14 @@ def generatePointCloud(
     )
 
     resultHooks = [
-        # - Fix output folder permissions
-        ResultRunDockerCommand(
-            DockerImage.DANESFIELD,
-            command=["chown", "-R", f"{os.getuid()}:{os.getgid()}", outputDir],
-            volumes=outputDirBindMountVolume._repr_json_(),
-        ),
-        # - Provide upload metadata & upload output files to output folder
-        GirderUploadVolumePathToFolder(
-            outputDir,
-            outputFolder["_id"],
-            upload_kwargs=createUploadMetadata(jobId, stepName),
-            gc=gc,
-        ),
-        # - Remove temporary files/folders
-        RemoveTemporaryPathsTransform([outputDir, datasetDir, config_file_path]),
+        # - Upload the remaining output files to output folder
+        outputVolume.finish(),
+        # - Remove the work directory
+        workspace.release(),
     ]
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         volumes=volumes,
         device_requests=device_requests,
         **createDockerRunArguments(
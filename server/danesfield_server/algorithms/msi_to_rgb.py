@@ -10,25 +10,159 @@
 from celery import group
 from six.moves import zip
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
+    createDockerRunSignature,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 from ..utilities import getPrefix
 from ..workflow import DanesfieldWorkflowException
 from ..workflow_manager import DanesfieldWorkflowManager
 
 
+def createMsiToRgbArguments(
+    gc,
+    initWorkingSetName,
+    stepName,
+    requestInfo,
+    jobId,
+    outputFolder,
+    prefix,
+    imageFile,
+    byte=None,
+    alpha=None,
+    rangePercentile=None,
+):
+    """
+    Return arguments to pass to the docker_run task that converts a
+    multispectral (MSI) image to RGB. Other parameters are as in msiToRgb().
+
+    :param gc: Girder client.
+    :type gc: GirderClient
+    :param prefix: The image prefix, used in the output file name.
+    :type prefix: str
+    :param imageFile: Pansharpened MSI image file.
+    :type imageFile: dict
+    :returns: dict
+    """
+    # Set output file name based on prefix
+    outputName = prefix + "_rgb_byte_image.tif"
+    outputVolumePath = VolumePath(outputName)
+
+    # Docker container arguments
+    containerArgs = [
+        "danesfield/tools/msi_to_rgb.py",
+        # Pansharpened MSI image
+        stageFile(gc, imageFile),
+        # Output image
+        outputVolumePath,
+    ]
+    # Enable byte option by default
+    if byte or byte is None:
+        containerArgs.append("--byte")
+    if alpha:
+        containerArgs.append("--alpha")
+    if rangePercentile is not None:
+        containerArgs.extend(["--range-percentile", str(rangePercentile)])
+    # TODO: Handle --big option (i.e. BIGTIFF)
+
+    # Result hooks
+    # - Upload output files to output folder
+    # - Provide upload metadata
+    upload_kwargs = createUploadMetadata(jobId, stepName)
+    resultHooks = [
+        GirderUploadRasterVolumePathToFolder(
+            outputVolumePath,
+            outputFolder["_id"],
+            upload_kwargs=upload_kwargs,
+            gc=gc,
+        )
+    ]
+
+    return createDockerRunArguments(
+        image=DockerImage.DANESFIELD,
+        containerArgs=containerArgs,
+        jobTitle=("[%s] Convert MSI to RGB: %s" % (initWorkingSetName, prefix)),
+        jobType=stepName,
+        user=requestInfo.user,
+        resultHooks=resultHooks,
+    )
+
+
+def msiToRgbImage(
+    initWorkingSetName,
+    stepName,
+    requestInfo,
+    jobId,
+    outputFolder,
+    imageFile,
+    byte=None,
+    alpha=None,
+    rangePercentile=None,
+):
+    """
+    Run a Girder Worker job to convert a multispectral (MSI) image to RGB.
+
+    Requirements:
+    - Danesfield Docker image is available on host
+
+    :param initWorkingSetName: The name of the top-level working set.
+    :type initWorkingSetName: str
+    :param stepName: The name of the step.
+    :type stepName: str (DanesfieldStep)
+    :param requestInfo: HTTP request and authorization info.
+    :type requestInfo: RequestInfo
+    :param jobId: Job ID.
+    :type jobId: str
+    :param outputFolder: Output folder document.
+    :type outputFolder: dict
+    :param imageFile: Pansharpened MSI image file.
+    :type imageFile: dict
+    :param byte: Stretch intensity range and convert to a byte image.
+    :type byte: bool
+    :param alpha: Create an alpha channel instead of using zero as a
+    no-value marker.
+    :type alpha: bool
+    :param rangePercentile: The percent of largest and smallest
+    intensities to ignore when computing range for intensity scaling.
+    :type rangePercentile: float
+    :returns: Job document.
+    """
+    prefix = getPrefix(imageFile["name"])
+    if not prefix:
+        raise DanesfieldWorkflowException(
+            "Invalid pansharpened image file name.", step=stepName
+        )
+
+    asyncResult = dispatchDockerRun(
+        stepName,
+        **createMsiToRgbArguments(
+            createGirderClient(requestInfo),
+            initWorkingSetName,
+            stepName,
+            requestInfo,
+            jobId,
+            outputFolder,
+            prefix,
+            imageFile,
+            byte=byte,
+            alpha=alpha,
+            rangePercentile=rangePercentile,
+        )
+    )
+
+    # Add info for job event listeners
+    return addJobInfo(asyncResult.job, jobId=jobId, stepName=stepName)
+
+
 def msiToRgb(
     initWorkingSetName,
     stepName,
@@ -71,48 +205,20 @@ def msiToRgb(
     gc = createGirderClient(requestInfo)
 
     def createConvertMsiToRgbTask(prefix, imageFile):
-        # Set output file name based on prefix
-        outputName = prefix + "_rgb_byte_image.tif"
-        outputVolumePath = VolumePath(outputName)
-
-        # Docker container arguments
-        containerArgs = [
-            "danesfield/tools/msi_to_rgb.py",
-            # Pansharpened MSI image
-            GirderFileIdToVolume(imageFile["_id"], gc=gc),
-            # Output image
-            outputVolumePath,
-        ]
-        # Enable byte option by default
-        if byte or byte is None:
-            containerArgs.append("--byte")
-        if alpha:
-            containerArgs.append("--alpha")
-        if rangePercentile is not None:
-            containerArgs.extend(["--range-percentile", str(rangePercentile)])
-        # TODO: Handle --big option (i.e. BIGTIFF)
-
-        # Result hooks
-        # - Upload output files to output folder
-        # - Provide upload metadata
-        upload_kwargs = createUploadMetadata(jobId, stepName)
-        resultHooks = [
-            GirderUploadVolumePathToFolder(
-                outputVolumePath,
-                outputFolder["_id"],
-                upload_kwargs=upload_kwargs,
-                gc=gc,
-            )
-        ]
-
-        return docker_run.s(
-            **createDockerRunArguments(
-                image=DockerImage.DANESFIELD,
-                containerArgs=containerArgs,
-                jobTitle=("[%s] Convert MSI to RGB: %s" % (initWorkingSetName, prefix)),
-                jobType=stepName,
-                user=requestInfo.user,
-                resultHooks=resultHooks,
+        return createDockerRunSignature(
+            stepName,
+            **createMsiToRgbArguments(
+                gc,
+                initWorkingSetName,
+                stepName,
+                requestInfo,
+                jobId,
+                outputFolder,
+                prefix,
+                imageFile,
+                byte=byte,
+                alpha=alpha,
+                rangePercentile=rangePercentile,
             )
         )
 
@@ -11,19 +11,17 @@ import os
 
 from celery import group
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
+    createDockerRunSignature,
     createGirderClient,
     createUploadMetadata,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 from ..workflow_manager import DanesfieldWorkflowManager
 
@@ -82,13 +80,13 @@ def orthorectify(
             "python",
             "danesfield/tools/orthorectify.py",
             # Source image
-            GirderFileIdToVolume(imageFile["_id"], gc=gc),
+            stageFile(gc, imageFile),
             # DSM
-            GirderFileIdToVolume(dsmFile["_id"], gc=gc),
+            stageFile(gc, dsmFile),
             # Destination image
             outputVolumePath,
             "--dtm",
-            GirderFileIdToVolume(dtmFile["_id"], gc=gc),
+            stageFile(gc, dtmFile),
         ]
         if occlusionThreshold is not None:
             containerArgs.extend(["--occlusion-thresh", str(occlusionThreshold)])
@@ -100,7 +98,7 @@ def orthorectify(
         # - Provide upload metadata
         upload_kwargs = createUploadMetadata(jobId, stepName)
         resultHooks = [
-            GirderUploadVolumePathToFolder(
+            GirderUploadRasterVolumePathToFolder(
                 outputVolumePath,
                 outputFolder["_id"],
                 upload_kwargs=upload_kwargs,
@@ -108,7 +106,8 @@ def orthorectify(
             )
         ]
 
-        return docker_run.s(
+        return createDockerRunSignature(
+            stepName,
             **createDockerRunArguments(
                 image=DockerImage.DANESFIELD,
                 containerArgs=containerArgs,
@@ -10,19 +10,18 @@
 from celery import group
 
 from girder import logprint
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
+    createDockerRunSignature,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 from ..utilities import getPrefix
 from ..workflow import DanesfieldWorkflowException
@@ -30,6 +29,124 @@ from ..workflow_manager import DanesfieldWorkflowManager
 from ..workflow_utilities import isMsiImage, isPanImage
 
 
+def createPansharpenArguments(
+    gc,
+    initWorkingSetName,
+    stepName,
+    requestInfo,
+    jobId,
+    outputFolder,
+    prefix,
+    panImageFile,
+    msiImageFile,
+):
+    """
+    Return arguments to pass to the docker_run task that pansharpens a pair
+    of orthorectified PAN and MSI images. Other parameters are as in
+    pansharpen().
+
+    :param gc: Girder client.
+    :type gc: GirderClient
+    :param prefix: The image prefix, used in the output file name.
+    :type prefix: str
+    :param panImageFile: Orthorectified PAN image file.
+    :type panImageFile: dict
+    :param msiImageFile: Orthorectified MSI image file.
+    :type msiImageFile: dict
+    :returns: dict
+    """
+    # Set output file name based on prefix
+    outputName = prefix + "_ortho_pansharpened.tif"
+    outputVolumePath = VolumePath(outputName)
+
+    # Docker container arguments
+    containerArgs = [
+        "gdal_pansharpen.py",
+        # PAN image
+        stageFile(gc, panImageFile),
+        # MSI image
+        stageFile(gc, msiImageFile),
+        # Output image
+        outputVolumePath,
+    ]
+
+    # Result hooks
+    # - Upload output files to output folder
+    # - Provide upload metadata
+    upload_kwargs = createUploadMetadata(jobId, stepName)
+    resultHooks = [
+        GirderUploadRasterVolumePathToFolder(
+            outputVolumePath,
+            outputFolder["_id"],
+            upload_kwargs=upload_kwargs,
+            gc=gc,
+        )
+    ]
+
+    return createDockerRunArguments(
+        image=DockerImage.DANESFIELD,
+        containerArgs=containerArgs,
+        jobTitle="[%s] Pansharpen: %s" % (initWorkingSetName, prefix),
+        jobType=stepName,
+        user=requestInfo.user,
+        resultHooks=resultHooks,
+    )
+
+
+def pansharpenImagePair(
+    initWorkingSetName,
+    stepName,
+    requestInfo,
+    jobId,
+    outputFolder,
+    prefix,
+    panImageFile,
+    msiImageFile,
+):
+    """
+    Run a Girder Worker job to pansharpen a pair of orthorectified PAN and
+    MSI images.
+
+    Requirements:
+    - Danesfield Docker image is available on host
+
+    :param initWorkingSetName: The name of the top-level working set.
+    :type initWorkingSetName: str
+    :param stepName: The name of the step.
+    :type stepName: str (DanesfieldStep)
+    :param requestInfo: HTTP request and authorization info.
+    :type requestInfo: RequestInfo
+    :param jobId: Job ID.
+    :type jobId: str
+    :param outputFolder: Output folder document.
+    :type outputFolder: dict
+    :param prefix: The image prefix, used in the output file name.
+    :type prefix: str
+    :param panImageFile: Orthorectified PAN image file.
+    :type panImageFile: dict
+    :param msiImageFile: Orthorectified MSI image file.
+    :type msiImageFile: dict
+    :returns: Job document.
+    """
+    asyncResult = dispatchDockerRun(
+        stepName,
+        **createPansharpenArguments(
+            createGirderClient(requestInfo),
+            initWorkingSetName,
+            stepName,
+            requestInfo,
+            jobId,
+            outputFolder,
+            prefix,
+            panImageFile,
+            msiImageFile,
+        )
+    )
+
+    # Add info for job event listeners
+    return addJobInfo(asyncResult.job, jobId=jobId, stepName=stepName)
+
+
 def pansharpen(
     initWorkingSetName, stepName, requestInfo, jobId, outputFolder, imageFiles
 ):
@@ -56,42 +173,18 @@ def pansharpen(
     gc = createGirderClient(requestInfo)
 
     def createPansharpenTask(prefix, panImageFile, msiImageFile):
-        # Set output file name based on prefix
-        outputName = prefix + "_ortho_pansharpened.tif"
-        outputVolumePath = VolumePath(outputName)
-
-        # Docker container arguments
-        containerArgs = [
-            "gdal_pansharpen.py",
-            # PAN image
-            GirderFileIdToVolume(panImageFile["_id"], gc=gc),
-            # MSI image
-            GirderFileIdToVolume(msiImageFile["_id"], gc=gc),
-            # Output image
-            outputVolumePath,
-        ]
-
-        # Result hooks
-        # - Upload output files to output folder
-        # - Provide upload metadata
-        upload_kwargs = createUploadMetadata(jobId, stepName)
-        resultHooks = [
-            GirderUploadVolumePathToFolder(
-                outputVolumePath,
-                outputFolder["_id"],
-                upload_kwargs=upload_kwargs,
-                gc=gc,
-            )
-        ]
-
-        return docker_run.s(
-            **createDockerRunArguments(
-                image=DockerImage.DANESFIELD,
-                containerArgs=containerArgs,
-                jobTitle="[%s] Pansharpen: %s" % (initWorkingSetName, prefix),
-                jobType=stepName,
-                user=requestInfo.user,
-                resultHooks=resultHooks,
+        return createDockerRunSignature(
+            stepName,
+            **createPansharpenArguments(
+                gc,
+                initWorkingSetName,
+                stepName,
+                requestInfo,
+                jobId,
+                outputFolder,
+                prefix,
+                panImageFile,
+                msiImageFile,
             )
         )
 
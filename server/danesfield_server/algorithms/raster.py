@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+"""
+Finalization of raster outputs on the worker.
+
+GeoTIFF files written by the tools are converted to Cloud Optimized
+GeoTIFFs (COGs) before they're uploaded: tiled, compressed, with internal
+overviews, so that the tile server reads only the tiles and the overview
+level a map view needs. The conversion runs in the Danesfield image, which
+has GDAL. The layout of each converted file is recorded in the metadata of
+its item.
+
+Set DANESFIELD_CLOUD_OPTIMIZE=0 on the worker to upload rasters as
+written.
+"""
+
+import json
+import os
+
+from girder_worker.docker.transforms import _maybe_transform
+from girder_worker.docker.transforms.girder import GirderUploadVolumePathToFolder
+
+from ..constants import DockerImage
+
+# Size of the tiles of converted files
+BLOCK_SIZE = 512
+
+# Prefix of the lines of output of the conversion script that describe the
+# layout of a converted file
+LAYOUT_PREFIX = "RASTER_LAYOUT "
+
+# Prefix of the lines of output of the conversion script that describe an
+# error
+ERROR_PREFIX = "RASTER_ERROR "
+
+# Conversion script, run with the paths of the files to convert. Files
+# that fail to convert are left as written. GDAL versions before 3.1 don't
+# have the COG driver; the files are then written with the equivalent
+# GeoTIFF creation options.
+COG_SCRIPT = """
+import json
+import os
+import sys
+
+from osgeo import gdal
+
+gdal.UseExceptions()
+for path in sys.argv[1:]:
+    try:
+        src = gdal.Open(path)
+        band = src.GetRasterBand(1)
+        # Classification and integer images aren't interpolated
+        continuous = (
+            band.DataType in (gdal.GDT_Float32, gdal.GDT_Float64)
+            and band.GetColorTable() is None
+        )
+        resampling = "AVERAGE" if continuous else "NEAREST"
+        cogPath = path + ".cog"
+        if gdal.GetDriverByName("COG") is not None:
+            gdal.Translate(
+                cogPath,
+                src,
+                format="COG",
+                creationOptions=[
+                    "BLOCKSIZE={blockSize}",
+                    "COMPRESS=DEFLATE",
+                    "PREDICTOR=YES",
+                    "BIGTIFF=IF_SAFER",
+                    "RESAMPLING=" + resampling,
+                ],
+            )
+        else:
+            tiledPath = path + ".tiled"
+            gdal.Translate(
+                tiledPath,
+                src,
+                format="GTiff",
+                creationOptions=["TILED=YES", "BIGTIFF=IF_SAFER"],
+            )
+            tiled = gdal.Open(tiledPath, gdal.GA_Update)
+            levels = []
+            factor = 2
+            while max(src.RasterXSize, src.RasterYSize) // factor >= {blockSize}:
+                levels.append(factor)
+                factor *= 2
+            tiled.BuildOverviews(resampling, levels)
+            tiled = None
+            gdal.Translate(
+                cogPath,
+                tiledPath,
+                format="GTiff",
+                creationOptions=[
+                    "TILED=YES",
+                    "BLOCKXSIZE={blockSize}",
+                    "BLOCKYSIZE={blockSize}",
+                    "COMPRESS=DEFLATE",
+                    "COPY_SRC_OVERVIEWS=YES",
+                    "BIGTIFF=IF_SAFER",
+                ],
+            )
+            os.remove(tiledPath)
+        src = None
+        os.replace(cogPath, path)
+
+        dataset = gdal.Open(path)
+        band = dataset.GetRasterBand(1)
+        layout = {{
+            "format": "COG",
+            "blockSize": band.GetBlockSize(),
+            "overviews": [
+                [band.GetOverview(i).XSize, band.GetOverview(i).YSize]
+                for i in range(band.GetOverviewCount())
+            ],
+            "compression": dataset.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE"),
+            "resampling": resampling,
+        }}
+        print("{layoutPrefix}" + json.dumps({{"path": path, "layout": layout}}))
+    except Exception as e:
+        print("{errorPrefix}" + json.dumps({{"path": path, "error": str(e)}}))
+    sys.stdout.flush()
+""".format(
+    blockSize=BLOCK_SIZE, layoutPrefix=LAYOUT_PREFIX, errorPrefix=ERROR_PREFIX
+)
+
+
+def isGeoTiff(path):
+    """
+    Whether a path is the path of a GeoTIFF file, by its extension.
+    """
+    return path.lower().endswith((".tif", ".tiff"))
+
+
+def _listGeoTiffs(path):
+    if os.path.isfile(path):
+        paths = [path]
+    else:
+        paths = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(path)
+            for name in names
+        ]
+    return [path for path in paths if isGeoTiff(path) and not os.path.islink(path)]
+
+
+def cloudOptimizeGeoTiffs(path, image=DockerImage.DANESFIELD):
+    """
+    Convert the GeoTIFF files of a file or directory to COGs, in place.
+
+    :param path: Path of the file or directory on the host.
+    :type path: str
+    :param image: Docker image that runs the conversion.
+    :type image: str
+    :returns: The layouts of the converted files, by path.
+    """
+    if os.environ.get("DANESFIELD_CLOUD_OPTIMIZE", "1") == "0":
+        return {}
+    paths = _listGeoTiffs(path)
+    if not paths:
+        return {}
+
+    import docker
+
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    client = docker.from_env(version="auto")
+    output = client.containers.run(
+        image,
+        ["python", "-c", COG_SCRIPT] + paths,
+        volumes={directory: {"bind": directory, "mode": "rw"}},
+        remove=True,
+    )
+
+    layouts = {}
+    for line in output.decode(errors="replace").splitlines():
+        if line.startswith(LAYOUT_PREFIX):
+            result = json.loads(line[len(LAYOUT_PREFIX) :])
+            layouts[result["path"]] = result["layout"]
+        elif line.startswith(ERROR_PREFIX):
+            result = json.loads(line[len(ERROR_PREFIX) :])
+            # Logged to the job
+            print(
+                "Failed to convert {} to a COG, uploading it as written: "
+                "{}".format(os.path.basename(result["path"]), result["error"]),
+                flush=True,
+            )
+    # Logged to the job
+    print("Converted {} files to COGs".format(len(layouts)), flush=True)
+    return layouts
+
+
+class GirderUploadRasterVolumePathToFolder(GirderUploadVolumePathToFolder):
+    """
+    Upload a file or directory as GirderUploadVolumePathToFolder does,
+    converting its GeoTIFF files to COGs first (see cloudOptimizeGeoTiffs).
+    The layout of each COG is set in the rasterLayout metadata of its item.
+    """
+
+    def _uploadFile(self, folder_id, path):
+        file = self.gc.uploadFileToFolder(folder_id, path, **self.upload_kwargs)
+        layout = self._layouts.get(path)
+        if file and layout is not None:
+            self.gc.addMetadataToItem(file["itemId"], {"rasterLayout": layout})
+
+    def _uploadFolder(self, path, folder_id):
+        for name in os.listdir(path):
+            childPath = os.path.join(path, name)
+            if os.path.isfile(childPath):
+                self._uploadFile(folder_id, childPath)
+            elif os.path.isdir(childPath) and not os.path.islink(childPath):
+                folder = self.gc.createFolder(folder_id, name, reuseExisting=True)
+                self._uploadFolder(childPath, folder["_id"])
+
+    def transform(self, *args, **kwargs):
+        path = _maybe_transform(self._volumepath, *args, **kwargs)
+        self.output_file_path = path
+        if not self.must_exist and not os.path.exists(path):
+            return None
+        self._layouts = cloudOptimizeGeoTiffs(path)
+        if os.path.isdir(path):
+            self._uploadFolder(path, self.folder_id)
+        else:
+            self._uploadFile(self.folder_id, path)
+        return self.folder_id
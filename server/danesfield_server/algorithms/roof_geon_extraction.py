@@ -7,19 +7,17 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-    GirderFolderIdToVolume,
-)
+from girder_worker.docker.transforms.girder import GirderUploadVolumePathToFolder
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
+    createModelVolume,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
 
 from ..constants import DockerImage
@@ -68,6 +66,9 @@ def roofGeonExtraction(
     """
     gc = createGirderClient(requestInfo)
 
+    # Model version cached on the worker host
+    modelVolume = createModelVolume(gc, modelFolder)
+
     # Set output directory
     outputVolumePath = VolumePath("__output__")
 
@@ -76,13 +77,13 @@ def roofGeonExtraction(
         "python",
         "danesfield/tools/roof_geon_extraction.py",
         "--las",
-        GirderFileIdToVolume(pointCloudFile["_id"], gc=gc),
+        stageFile(gc, pointCloudFile),
         "--cls",
-        GirderFileIdToVolume(buildingMaskFile["_id"], gc=gc),
+        stageFile(gc, buildingMaskFile),
         "--dtm",
-        GirderFileIdToVolume(dtmFile["_id"], gc=gc),
+        stageFile(gc, dtmFile),
         "--model_dir",
-        GirderFolderIdToVolume(modelFolder["_id"], gc=gc),
+        modelVolume,
         "--model_prefix",
         modelFilePrefix,
         "--output_dir",
@@ -99,7 +100,8 @@ def roofGeonExtraction(
         )
     ]
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         runtime="nvidia",
         **createDockerRunArguments(
             image=DockerImage.DANESFIELD,
@@ -7,10 +7,8 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
 from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
     GirderUploadVolumePathToFolder,
     GirderFolderIdToVolume,
 )
@@ -20,6 +18,8 @@ from .common import (
     createDockerRunArguments,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
 from ..constants import DockerImage
 
@@ -73,7 +73,8 @@ def runMetrics(
         # We know that there's no reference data with this selection
         containerArgs = ["echo", "No ground truth selected for scoring"]
 
-        asyncResult = docker_run.delay(
+        asyncResult = dispatchDockerRun(
+            stepName,
             **createDockerRunArguments(
                 image=DockerImage.DANESFIELD,
                 containerArgs=containerArgs,
@@ -97,13 +98,13 @@ def runMetrics(
             "--ref-prefix",
             referencePrefix,
             "--dsm",
-            GirderFileIdToVolume(dsmFile["_id"], gc=gc),
+            stageFile(gc, dsmFile),
             "--cls",
-            GirderFileIdToVolume(clsFile["_id"], gc=gc),
+            stageFile(gc, clsFile),
             "--mtl",
-            GirderFileIdToVolume(mtlFile["_id"], gc=gc),
+            stageFile(gc, mtlFile),
             "--dtm",
-            GirderFileIdToVolume(dtmFile["_id"], gc=gc),
+            stageFile(gc, dtmFile),
         ]
 
         # Result hooks
@@ -119,7 +120,8 @@ def runMetrics(
             )
         ]
 
-        asyncResult = docker_run.delay(
+        asyncResult = dispatchDockerRun(
+            stepName,
             **createDockerRunArguments(
                 image=DockerImage.DANESFIELD,
                 containerArgs=containerArgs,
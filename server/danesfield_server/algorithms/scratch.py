@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+"""
+Scratch space of the tasks of worker hosts.
+
+Tasks that write large intermediate files get a workspace in the scratch
+directory of the host. Before a workspace is created, the task waits
+until the scratch directory has room for it: the free space must remain
+above a threshold, and the workspaces must remain within the global quota.
+While the task runs, containers that make the workspaces of a job exceed
+the per-job quota are stopped. Workspaces are removed when the task
+completes, whether it succeeded, failed or was canceled, and workspaces
+left by worker processes that died are removed by the next task.
+
+The scratch space is configured on the worker with environment variables:
+- DANESFIELD_SCRATCH_DIR: Scratch directory, preferably on a fast local
+  volume. Set TMPDIR to a directory on the same volume so that inputs
+  staged in temporary volumes also use it.
+- DANESFIELD_SCRATCH_JOB_QUOTA: Maximum size of the workspaces of a job,
+  in bytes. 0, the default, disables the quota.
+- DANESFIELD_SCRATCH_QUOTA: Maximum total size of the workspaces, in
+  bytes. 0, the default, disables the quota.
+- DANESFIELD_SCRATCH_MIN_FREE: Free space below which new workspaces
+  wait, in bytes.
+- DANESFIELD_SCRATCH_TIMEOUT: Time after which a task that waits for
+  scratch space fails, in seconds.
+"""
+
+import contextlib
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+from girder_worker_utils.transform import Transform
+from girder_worker_utils.transforms.girder_io import ResultTransform
+
+from .file_cache import _lock
+
+DEFAULT_MIN_FREE = 10 * 1024**3
+DEFAULT_TIMEOUT = 3600
+
+# Interval at which the usage of workspaces is measured, and at which
+# waiting tasks check for space, in seconds
+POLL_INTERVAL = 10
+
+# Quota monitors of the workspaces of this worker process, by workspace ID
+_monitors = {}
+_monitorsLock = threading.Lock()
+
+
+def _getSize(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            with contextlib.suppress(OSError):
+                total += os.lstat(os.path.join(root, name)).st_size
+    return total
+
+
+def _isAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _stopContainers(hostPath):
+    """
+    Stop the containers that mount a directory.
+    """
+    import docker
+
+    client = docker.from_env(version="auto")
+    for container in client.containers.list():
+        if any(mount.get("Source") == hostPath for mount in container.attrs["Mounts"]):
+            container.kill()
+
+
+class ScratchSpace:
+    """
+    Workspaces in the scratch directory of a worker host. A workspace has
+    a JSON file next to it that records its job and owner process.
+    """
+
+    def __init__(
+        self,
+        directory,
+        jobQuota=0,
+        quota=0,
+        minFree=DEFAULT_MIN_FREE,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        """
+        :param directory: Scratch directory.
+        :type directory: str
+        :param jobQuota: Maximum size of the workspaces of a job, or 0.
+        :type jobQuota: int
+        :param quota: Maximum total size of the workspaces, or 0.
+        :type quota: int
+        :param minFree: Free space below which new workspaces wait.
+        :type minFree: int
+        :param timeout: Time after which waiting for space fails.
+        :type timeout: float
+        """
+        self.directory = directory
+        self.jobQuota = jobQuota
+        self.quota = quota
+        self.minFree = minFree
+        self.timeout = timeout
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def fromEnvironment(cls):
+        """
+        Create the scratch space configured by the environment of the
+        worker.
+        """
+        return cls(
+            os.environ.get(
+                "DANESFIELD_SCRATCH_DIR",
+                os.path.join(tempfile.gettempdir(), "danesfield-scratch"),
+            ),
+            jobQuota=int(os.environ.get("DANESFIELD_SCRATCH_JOB_QUOTA", 0)),
+            quota=int(os.environ.get("DANESFIELD_SCRATCH_QUOTA", 0)),
+            minFree=int(
+                os.environ.get("DANESFIELD_SCRATCH_MIN_FREE", DEFAULT_MIN_FREE)
+            ),
+            timeout=float(
+                os.environ.get("DANESFIELD_SCRATCH_TIMEOUT", DEFAULT_TIMEOUT)
+            ),
+        )
+
+    def getPath(self, workspaceId):
+        return os.path.join(self.directory, workspaceId)
+
+    def _getInfoPath(self, workspaceId):
+        return self.getPath(workspaceId) + ".json"
+
+    def _workspaces(self):
+        """
+        List the workspaces as tuples of the form (workspace ID, info).
+        """
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield name[: -len(".json")], info
+
+    def getUsage(self, jobId=None):
+        """
+        Get the size of the workspaces, or of the workspaces of a job.
+        """
+        return sum(
+            _getSize(self.getPath(workspaceId))
+            for workspaceId, info in self._workspaces()
+            if jobId is None or info["jobId"] == jobId
+        )
+
+    def _removeWorkspace(self, workspaceId):
+        path = self.getPath(workspaceId)
+        if os.path.exists(path):
+            try:
+                shutil.rmtree(path)
+            except PermissionError:
+                # Files written by containers are owned by root
+                from girder_worker.docker.utils import chmod_writable
+
+                chmod_writable([path])
+                shutil.rmtree(path, ignore_errors=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._getInfoPath(workspaceId))
+
+    def collectGarbage(self):
+        """
+        Remove the workspaces of worker processes of this host that died.
+        """
+        hostname = socket.gethostname()
+        for workspaceId, info in list(self._workspaces()):
+            if info["hostname"] == hostname and not _isAlive(info["pid"]):
+                self._removeWorkspace(workspaceId)
+
+    def _hasRoom(self, expectedBytes):
+        free = shutil.disk_usage(self.directory).free
+        if free - expectedBytes < self.minFree:
+            return False
+        if self.quota and self.getUsage() + expectedBytes > self.quota:
+            return False
+        return True
+
+    def allocate(self, jobId, expectedBytes=0):
+        """
+        Create a workspace, waiting until there is room for it.
+
+        :param jobId: ID of the job of the workspace.
+        :type jobId: str
+        :param expectedBytes: Number of bytes the task is expected to
+            write.
+        :type expectedBytes: int
+        :returns: ID of the workspace.
+        """
+        start = time.time()
+        waiting = False
+        while True:
+            with _lock(self.directory, "scratch"):
+                self.collectGarbage()
+                if self._hasRoom(expectedBytes):
+                    workspaceId = "{}-{}".format(jobId, uuid.uuid4().hex)
+                    path = self.getPath(workspaceId)
+                    os.makedirs(path)
+                    # Containers may run as a different user
+                    os.chmod(path, 0o777)
+                    with open(self._getInfoPath(workspaceId), "w") as f:
+                        json.dump(
+                            {
+                                "jobId": jobId,
+                                "hostname": socket.gethostname(),
+                                "pid": os.getpid(),
+                            },
+                            f,
+                        )
+                    return workspaceId
+
+            if time.time() - start > self.timeout:
+                raise Exception(
+                    "Timed out waiting for {} bytes of scratch space".format(
+                        expectedBytes
+                    )
+                )
+            if not waiting:
+                waiting = True
+                # Logged to the job
+                print("Waiting for scratch space", flush=True)
+            time.sleep(POLL_INTERVAL)
+
+    def release(self, workspaceId):
+        """
+        Remove a workspace.
+        """
+        with _lock(self.directory, "scratch"):
+            self._removeWorkspace(workspaceId)
+
+
+class _QuotaMonitor(threading.Thread):
+    """
+    Stop the containers of a workspace when the workspaces of its job
+    exceed the per-job quota.
+    """
+
+    def __init__(self, space, jobId, workspaceId):
+        super(_QuotaMonitor, self).__init__(daemon=True)
+        self.space = space
+        self.jobId = jobId
+        self.workspaceId = workspaceId
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(POLL_INTERVAL):
+            usage = self.space.getUsage(self.jobId)
+            if usage > self.space.jobQuota:
+                # Logged to the job
+                print(
+                    "Scratch space of the job exceeds its quota ({} > {} "
+                    "bytes), stopping".format(usage, self.space.jobQuota),
+                    flush=True,
+                )
+                _stopContainers(self.space.getPath(self.workspaceId))
+                return
+
+
+class ScratchWorkspace(Transform):
+    """
+    Workspace of a task in the scratch space of the worker host, bind
+    mounted in the container (see ScratchSpace). Pass it in the volumes of
+    the task, and add the hook returned by release to the result hooks to
+    remove the workspace once the task completes. The workspace is
+    transformed to its path in the container.
+    """
+
+    def __init__(self, jobId, expectedBytes=0):
+        """
+        :param jobId: ID of the job of the task.
+        :type jobId: str
+        :param expectedBytes: Number of bytes the task is expected to
+            write, including its staged inputs.
+        :type expectedBytes: int
+        """
+        self.jobId = str(jobId)
+        self.expectedBytes = expectedBytes
+        self.key = uuid.uuid4().hex
+        self.workspaceId = None
+
+    def _repr_model_(self):
+        return "{}: {}".format(self.__class__.__name__, self.jobId)
+
+    @property
+    def host_path(self):
+        return ScratchSpace.fromEnvironment().getPath(self.workspaceId)
+
+    @property
+    def container_path(self):
+        return "/danesfield-scratch/{}".format(self.key)
+
+    def _repr_json_(self):
+        return {self.host_path: {"bind": self.container_path, "mode": "rw"}}
+
+    def transform(self, **kwargs):
+        # The workspace may be referenced by several arguments. They're
+        # transformed in the thread of the task, so the lock only guards the
+        # monitors, and tasks that wait for space don't block other tasks.
+        with _monitorsLock:
+            monitor = _monitors.get(self.key)
+        if monitor is None:
+            space = ScratchSpace.fromEnvironment()
+            workspaceId = space.allocate(self.jobId, self.expectedBytes)
+            monitor = _QuotaMonitor(space, self.jobId, workspaceId)
+            if space.jobQuota:
+                monitor.start()
+            with _monitorsLock:
+                _monitors[self.key] = monitor
+        self.workspaceId = monitor.workspaceId
+        return self.container_path
+
+    def release(self):
+        """
+        Get the result hook that removes the workspace.
+        """
+        return ReleaseScratchWorkspace(self.key)
+
+
+class ReleaseScratchWorkspace(ResultTransform):
+    """
+    Result hook that removes a ScratchWorkspace once the task completes,
+    including when it fails or is canceled. Put it last, after the hooks
+    that read the workspace.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def _repr_model_(self):
+        return "{}: {}".format(self.__class__.__name__, self.key)
+
+    def transform(self, data=None, **kwargs):
+        return data
+
+    def cleanup(self, **kwargs):
+        with _monitorsLock:
+            monitor = _monitors.pop(self.key, None)
+        if monitor is None:
+            return
+        monitor.stopped.set()
+        ScratchSpace.fromEnvironment().release(monitor.workspaceId)
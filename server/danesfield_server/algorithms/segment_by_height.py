@@ -7,18 +7,16 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 from .common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 
 
@@ -73,16 +71,16 @@ def segmentByHeight(
         "python",
         "danesfield/tools/segment_by_height.py",
         # DSM
-        GirderFileIdToVolume(dsmFile["_id"], gc=gc),
+        stageFile(gc, dsmFile),
         # DTM
-        GirderFileIdToVolume(dtmFile["_id"], gc=gc),
+        stageFile(gc, dtmFile),
         # Threshold output image
         thresholdOutputVolumePath,
         # Normalized Difference Vegetation Index image
         "--input-ndvi",
-        GirderFileIdToVolume(ndviFile["_id"], gc=gc),
+        stageFile(gc, ndviFile),
         "--road-vector",
-        GirderFileIdToVolume(roadVectorFile["_id"], gc=gc),
+        stageFile(gc, roadVectorFile),
         "--road-rasterized",
         roadRasterOutputVolumePath,
         "--road-rasterized-bridge",
@@ -94,7 +92,7 @@ def segmentByHeight(
     # - Provide upload metadata
     upload_kwargs = createUploadMetadata(jobId, stepName)
     resultHooks = [
-        GirderUploadVolumePathToFolder(
+        GirderUploadRasterVolumePathToFolder(
             thresholdOutputVolumePath,
             outputFolder["_id"],
             upload_kwargs=upload_kwargs,
@@ -102,7 +100,8 @@ def segmentByHeight(
         )
     ]
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         **createDockerRunArguments(
             image=DockerImage.DANESFIELD,
             containerArgs=containerArgs,
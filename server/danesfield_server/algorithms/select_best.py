@@ -9,10 +9,13 @@
 
 import itertools
 
-from girder_worker.docker.tasks import docker_run
-from girder_worker.docker.transforms.girder import GirderFileIdToVolume
-
-from .common import addJobInfo, createDockerRunArguments, createGirderClient
+from .common import (
+    addJobInfo,
+    createDockerRunArguments,
+    createGirderClient,
+    dispatchDockerRun,
+    stageFile,
+)
 from ..constants import DockerImage
 
 
@@ -49,13 +52,14 @@ def selectBest(
             [
                 "danesfield/tools/select_best.py",
                 "--dsm",
-                GirderFileIdToVolume(dsmFile["_id"], gc=gc),
+                stageFile(gc, dsmFile),
             ],
-            [GirderFileIdToVolume(imageFile["_id"], gc=gc) for imageFile in imageFiles],
+            [stageFile(gc, imageFile) for imageFile in imageFiles],
         )
     )
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         **createDockerRunArguments(
             image=DockerImage.DANESFIELD,
             containerArgs=containerArgs,
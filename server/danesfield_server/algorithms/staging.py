@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+"""
+Girder Worker transforms that stage the inputs of a step on the worker.
+
+The transforms only store the IDs and names of the inputs, so the Girder
+server doesn't transfer any data when it sends a task. The data is
+transferred when the worker runs the task.
+"""
+
+import os
+import shutil
+import string
+import uuid
+
+from girder_worker.docker.transforms import TemporaryVolume
+from girder_worker_utils.transform import Transform
+from girder_worker_utils.transforms.girder_io import GirderClientTransform
+
+from .file_cache import FileCache, ModelCache
+from .transfer import BulkDownloader
+
+# Default number of concurrent downloads per task
+MAX_DOWNLOAD_WORKERS = 4
+
+
+def _getJobProgress(task):
+    """
+    Get a function that reports progress to the Girder job of a task, or
+    None.
+    """
+    jobManager = getattr(task, "job_manager", None)
+    if jobManager is None:
+        return None
+
+    def progress(current, total, message):
+        jobManager.updateProgress(total=total, current=current, message=message)
+
+    return progress
+
+
+def downloadFiles(gc, files, directory, maxWorkers=MAX_DOWNLOAD_WORKERS, task=None):
+    """
+    Download files to a directory in parallel. Failed downloads are
+    retried and resumed, and files are verified against their checksum
+    (see BulkDownloader).
+
+    :param gc: Girder client.
+    :type gc: GirderClient
+    :param files: List of tuples of the form (file ID, relative path) or
+        (file ID, relative path, size, SHA-512 checksum).
+    :type files: list[tuple]
+    :param directory: Destination directory.
+    :type directory: str
+    :param maxWorkers: Maximum number of concurrent downloads.
+    :type maxWorkers: int
+    :param task: The task that downloads the files. Progress is reported
+        to its Girder job.
+    :type task: celery.Task
+    """
+    BulkDownloader(gc, maxWorkers, progress=_getJobProgress(task)).download(
+        files, directory
+    )
+
+
+class GirderFilesToVolume(GirderClientTransform):
+    """
+    Download Girder files into a directory of a volume. The files keep
+    their names. Returns the path of the directory in the container.
+    """
+
+    def __init__(
+        self,
+        files,
+        dirname,
+        volume=TemporaryVolume.default,
+        maxWorkers=MAX_DOWNLOAD_WORKERS,
+        **kwargs
+    ):
+        """
+        :param files: File documents.
+        :type files: list[dict]
+        :param dirname: Name of the directory in the volume.
+        :type dirname: str
+        :param volume: The volume in which to create the directory.
+        :param maxWorkers: Maximum number of concurrent downloads.
+        :type maxWorkers: int
+        """
+        super(GirderFilesToVolume, self).__init__(**kwargs)
+        self.files = [
+            (str(file["_id"]), file["name"], file.get("size"), file.get("sha512"))
+            for file in files
+        ]
+        self.dirname = dirname
+        self.volume = volume
+        self.maxWorkers = maxWorkers
+
+    def _repr_model_(self):
+        return "{}: {} files".format(self.__class__.__name__, len(self.files))
+
+    def _download(self, directory, task=None):
+        downloadFiles(self.gc, self.files, directory, self.maxWorkers, task=task)
+
+    def transform(self, **kwargs):
+        self.volume.transform(**kwargs)
+        self._download(
+            os.path.join(self.volume.host_path, self.dirname), kwargs.get("task")
+        )
+        return os.path.join(self.volume.container_path, self.dirname)
+
+
+class GirderFolderToVolume(GirderFilesToVolume):
+    """
+    Download a Girder folder recursively into a directory of a volume.
+    Returns the path of the directory in the container.
+    """
+
+    def __init__(self, folderId, dirname, **kwargs):
+        """
+        :param folderId: ID of the folder to download.
+        :type folderId: str
+        :param dirname: Name of the directory in the volume.
+        :type dirname: str
+        """
+        super(GirderFolderToVolume, self).__init__([], dirname, **kwargs)
+        self.folderId = str(folderId)
+
+    def _repr_model_(self):
+        return "{}: {}".format(self.__class__.__name__, self.folderId)
+
+    def _listFiles(self, folderId, path):
+        """
+        List the files in a folder and its subfolders, as tuples of the
+        form (file ID, relative path, size, checksum). Items that contain multiple files
+        are stored as directories, as with GirderClient.downloadFolderRecursive.
+        """
+        for item in self.gc.listItem(folderId):
+            files = list(self.gc.listFile(item["_id"]))
+            for file in files:
+                if len(files) == 1:
+                    filePath = os.path.join(path, file["name"])
+                else:
+                    filePath = os.path.join(path, item["name"], file["name"])
+                yield str(file["_id"]), filePath, file.get("size"), file.get("sha512")
+
+        for folder in self.gc.listFolder(folderId, parentFolderType="folder"):
+            for result in self._listFiles(
+                folder["_id"], os.path.join(path, folder["name"])
+            ):
+                yield result
+
+    def _download(self, directory, task=None):
+        self.files = list(self._listFiles(self.folderId, ""))
+        super(GirderFolderToVolume, self)._download(directory, task)
+
+
+def _getCacheStats(task):
+    """
+    Get the file cache statistics of a task run. Statistics are kept on
+    the request of the task, which is specific to each run.
+    """
+    request = getattr(task, "request", None)
+    if request is None:
+        return {"hits": 0, "misses": 0, "evictedBytes": 0}
+    if getattr(request, "danesfieldFileCacheStats", None) is None:
+        request.danesfieldFileCacheStats = {"hits": 0, "misses": 0, "evictedBytes": 0}
+    return request.danesfieldFileCacheStats
+
+
+class MountedInput(GirderClientTransform):
+    """
+    Base class of inputs that are bind mounted read-only in the container,
+    rather than staged in the temporary volume, so that containers can't
+    modify them. dispatchDockerRun adds the container arguments that are
+    mounted inputs to the volumes of the task. Subclasses define host_path
+    and container_path.
+    """
+
+    mode = "ro"
+
+    # Result of the transform
+    _result = None
+
+    def _repr_json_(self):
+        return {self.host_path: {"bind": self.container_path, "mode": self.mode}}
+
+    def transform(self, **kwargs):
+        # The input is transformed both as a volume and as a container
+        # argument, so only transform it once
+        if self._result is None:
+            self._result = self._transform(**kwargs)
+        return self._result
+
+    def _transform(self, **kwargs):
+        """
+        Stage the input on the worker host, and return its path in the
+        container.
+        """
+        raise NotImplementedError()
+
+
+class CachedGirderFileToVolume(MountedInput):
+    """
+    Stage a Girder file through the file cache of the worker host (see
+    FileCache), so that tasks on the same host that use the same file
+    download it once. The file is staged in a directory of its own, which
+    is mounted read-only, so that a container can't modify the cached file.
+    Returns the path of the file in the container.
+
+    Files without a checksum are downloaded directly.
+    """
+
+    def __init__(self, file, filename=None, **kwargs):
+        """
+        :param file: File document.
+        :type file: dict
+        :param filename: Name of the staged file. Defaults to the name of
+            the file.
+        :type filename: str
+        """
+        super(CachedGirderFileToVolume, self).__init__(**kwargs)
+        self.fileId = str(file["_id"])
+        self.filename = filename or file["name"]
+        self.checksum = file.get("sha512")
+        self.size = file.get("size", 0)
+        # ID of the staging directory of the input
+        self.stagingId = uuid.uuid4().hex
+
+    def _repr_model_(self):
+        return "{}: {}".format(self.__class__.__name__, self.fileId)
+
+    @property
+    def host_path(self):
+        return FileCache.fromEnvironment().getStagingPath(self.stagingId)
+
+    @property
+    def container_path(self):
+        return "/danesfield-inputs/{}".format(self.stagingId)
+
+    def _transform(self, **kwargs):
+        cache = FileCache.fromEnvironment()
+        directory = cache.getStagingPath(self.stagingId)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename)
+
+        if not self.checksum:
+            self.gc.downloadFile(self.fileId, path)
+            os.chmod(path, 0o444)
+        else:
+            hit, evicted = cache.fetch(
+                self.gc, self.fileId, self.checksum, self.size, path
+            )
+
+            # Count hits, misses and evicted bytes over the inputs of the
+            # task, and log them to the job
+            stats = _getCacheStats(kwargs.get("task"))
+            stats["hits" if hit else "misses"] += 1
+            stats["evictedBytes"] += evicted
+            print(
+                "File cache {}: {} ({} bytes) hits={hits} misses={misses} "
+                "evictedBytes={evictedBytes}".format(
+                    "hit" if hit else "miss", self.filename, self.size, **stats
+                ),
+                flush=True,
+            )
+
+        return os.path.join(self.container_path, self.filename)
+
+    def cleanup(self, **kwargs):
+        shutil.rmtree(self.host_path, ignore_errors=True)
+
+
+class AssetstoreFileToVolume(MountedInput):
+    """
+    Mount a Girder file directly from a filesystem assetstore, when the
+    assetstore is on the worker host, so that the file isn't copied.
+    Otherwise, the file is staged with CachedGirderFileToVolume. Returns
+    the path of the file in the container.
+
+    Set DANESFIELD_MOUNT_ASSETSTORE=0 on the worker to always stage files,
+    for example when the worker runs in a container that sees the
+    assetstore at a different path than the Docker daemon.
+    """
+
+    def __init__(self, file, assetstorePath, filename=None, **kwargs):
+        """
+        :param file: File document.
+        :type file: dict
+        :param assetstorePath: Absolute path of the file in the assetstore,
+            or None if the file isn't in a filesystem assetstore.
+        :type assetstorePath: str
+        :param filename: Name of the file in the container. Defaults to the
+            name of the file.
+        :type filename: str
+        """
+        super(AssetstoreFileToVolume, self).__init__(**kwargs)
+        self.fileId = str(file["_id"])
+        self.filename = filename or file["name"]
+        self.size = file.get("size")
+        self.assetstorePath = assetstorePath
+        self.fallback = CachedGirderFileToVolume(file, filename=filename, **kwargs)
+
+    def _repr_model_(self):
+        return "{}: {}".format(self.__class__.__name__, self.fileId)
+
+    def isMounted(self):
+        """
+        Whether the file is mounted from the assetstore, rather than
+        staged.
+        """
+        if os.environ.get("DANESFIELD_MOUNT_ASSETSTORE", "1") == "0":
+            return False
+        # Check that the file is the same as in the assetstore of the server
+        return (
+            self.assetstorePath is not None
+            and os.path.isfile(self.assetstorePath)
+            and os.path.getsize(self.assetstorePath) == self.size
+        )
+
+    def _repr_json_(self):
+        if not self.isMounted():
+            return self.fallback._repr_json_()
+        return super(AssetstoreFileToVolume, self)._repr_json_()
+
+    @property
+    def host_path(self):
+        return self.assetstorePath
+
+    @property
+    def container_path(self):
+        return "/danesfield-inputs/{}/{}".format(self.fileId, self.filename)
+
+    def _transform(self, **kwargs):
+        if self.isMounted():
+            return self.container_path
+        return self.fallback.transform(**kwargs)
+
+    def cleanup(self, **kwargs):
+        self.fallback.cleanup(**kwargs)
+
+
+class GirderModelVolume(MountedInput):
+    """
+    A version of a model folder, mounted read-only in the container. The
+    version is downloaded once per worker host into the model cache (see
+    ModelCache), and versions that are no longer referenced are removed.
+
+    Use the volume as a container argument to get the path of the folder
+    in the container. When it's only used in other inputs, such as a
+    configuration file, also pass it in the volumes of the task.
+    """
+
+    def __init__(self, model, referencedVersions=(), **kwargs):
+        """
+        :param model: The version of the folder and its files, as returned
+            by model_registry.getFolderModel.
+        :type model: dict
+        :param referencedVersions: Versions of model folders in use.
+        :type referencedVersions: list[str]
+        """
+        super(GirderModelVolume, self).__init__(**kwargs)
+        self.version = model["version"]
+        self.files = [tuple(file) for file in model["files"]]
+        self.referencedVersions = list(referencedVersions)
+
+    def _repr_model_(self):
+        return "{}: {}".format(self.__class__.__name__, self.version)
+
+    @property
+    def host_path(self):
+        return ModelCache.fromEnvironment().getPath(self.version)
+
+    @property
+    def container_path(self):
+        return "/danesfield-models/{}".format(self.version)
+
+    # Pin of the version in the model cache while the task runs
+    _pin = None
+
+    def _transform(self, **kwargs):
+        cache = ModelCache.fromEnvironment()
+        _, hit, self._pin = cache.materialize(
+            self.version,
+            lambda directory: downloadFiles(
+                self.gc, self.files, directory, task=kwargs.get("task")
+            ),
+        )
+        removed = cache.collectGarbage(self.referencedVersions + [self.version])
+        # Logged to the job
+        print(
+            "Model cache {}: {} ({} files), removed {} unreferenced "
+            "versions".format(
+                "hit" if hit else "miss", self.version, len(self.files), len(removed)
+            ),
+            flush=True,
+        )
+        return self.container_path
+
+    def cleanup(self, **kwargs):
+        if self._pin is not None:
+            self._pin.close()
+            self._pin = None
+
+
+class TemplateFileToVolume(Transform):
+    """
+    Write a text file, such as a configuration file, to a volume. The
+    content is a string.Template in which placeholders are substituted on
+    the worker. Substitutions may be transforms, for example to refer to
+    staged inputs; they're replaced by the result of the transform.
+    Returns the path of the file in the container.
+    """
+
+    def __init__(
+        self, template, filename, substitutions=None, volume=TemporaryVolume.default
+    ):
+        """
+        :param template: Template of the file content.
+        :type template: str
+        :param filename: Name of the file in the volume.
+        :type filename: str
+        :param substitutions: Values of the placeholders in the template.
+        :type substitutions: dict
+        :param volume: The volume in which to write the file.
+        """
+        self.template = template
+        self.filename = filename
+        self.substitutions = substitutions or {}
+        self.volume = volume
+
+    def _repr_model_(self):
+        return "{}: {}".format(self.__class__.__name__, self.filename)
+
+    def transform(self, **kwargs):
+        self.volume.transform(**kwargs)
+
+        substitutions = {
+            key: value.transform(**kwargs) if hasattr(value, "transform") else value
+            for key, value in self.substitutions.items()
+        }
+        content = string.Template(self.template).substitute(substitutions)
+
+        with open(os.path.join(self.volume.host_path, self.filename), "w") as f:
+            f.write(content)
+
+        return os.path.join(self.volume.container_path, self.filename)
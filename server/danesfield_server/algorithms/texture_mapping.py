@@ -7,18 +7,16 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
+from girder_worker.docker.transforms.girder import GirderUploadVolumePathToFolder
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
 
 from ..constants import DockerImage
@@ -72,16 +70,16 @@ def textureMapping(
 
     containerArgs = [
         "danesfield/tools/texture_mapping.py",
-        GirderFileIdToVolume(dsmFile["_id"], gc=gc),
-        GirderFileIdToVolume(dtmFile["_id"], gc=gc),
+        stageFile(gc, dsmFile),
+        stageFile(gc, dtmFile),
         outputVolumePath,
         occlusionMeshVolumePath,
         "--crops",
     ]
-    containerArgs.extend([GirderFileIdToVolume(f["_id"], gc=gc) for f in imageFiles])
+    containerArgs.extend([stageFile(gc, f) for f in imageFiles])
 
     containerArgs.append("--buildings")
-    containerArgs.extend([GirderFileIdToVolume(f["_id"], gc=gc) for f in objFiles])
+    containerArgs.extend([stageFile(gc, f) for f in objFiles])
 
     # Result hooks
     # - Upload output files to output folder
@@ -99,7 +97,8 @@ def textureMapping(
         ),
     ]
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         **createDockerRunArguments(
             image=DockerImage.DANESFIELD,
             containerArgs=containerArgs,
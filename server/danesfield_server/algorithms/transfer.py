@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+"""
+Download of Girder files on the worker, with retries, resume of partial
+downloads using HTTP range requests, and checksum verification.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import threading
+import time
+
+import requests
+from girder_client import HttpError
+
+# Size of the chunks in which files are downloaded and hashed
+CHUNK_SIZE = 1024 * 1024
+
+# Number of times a failed download is retried
+MAX_RETRIES = 5
+
+# Delay before the first retry, in seconds. The delay doubles on each retry.
+RETRY_DELAY = 2
+
+
+class ChecksumError(Exception):
+    """
+    A downloaded file doesn't match the checksum of the Girder file.
+    """
+
+    pass
+
+
+def _sha512(path):
+    sha512 = hashlib.sha512()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha512.update(chunk)
+    return sha512.hexdigest()
+
+
+def _resumeDownload(gc, fileId, path, size, onProgress):
+    """
+    Download the part of a file that isn't in path yet.
+    """
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    if size is not None and offset >= size:
+        return
+
+    headers = {"Range": "bytes={}-".format(offset)} if offset else None
+    response = gc.sendRestRequest(
+        "GET",
+        "file/{}/download".format(fileId),
+        headers=headers,
+        stream=True,
+        jsonResp=False,
+    )
+    if offset and response.status_code != 206:
+        # The server sent the whole file
+        onProgress(-offset)
+        offset = 0
+
+    with open(path, "ab" if offset else "wb") as f:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            f.write(chunk)
+            onProgress(len(chunk))
+
+
+def downloadFile(
+    gc, fileId, path, size=None, checksum=None, retries=MAX_RETRIES, onProgress=None
+):
+    """
+    Download a Girder file. The file is written to path + ".partial" and
+    renamed once complete, so an interrupted download resumes where it
+    stopped, including after a restart of the worker.
+
+    :param gc: Girder client.
+    :type gc: GirderClient
+    :param fileId: ID of the file.
+    :type fileId: str
+    :param path: Destination path.
+    :type path: str
+    :param size: Size of the file, if known.
+    :type size: int
+    :param checksum: SHA-512 checksum of the file, if known. A download
+        that doesn't match is started over.
+    :type checksum: str
+    :param retries: Number of times to retry a failed download.
+    :type retries: int
+    :param onProgress: Function called with the number of bytes received.
+    :type onProgress: callable
+    """
+    onProgress = onProgress or (lambda bytesReceived: None)
+    partialPath = path + ".partial"
+
+    for attempt in range(retries + 1):
+        try:
+            _resumeDownload(gc, fileId, partialPath, size, onProgress)
+            if size is not None and os.path.getsize(partialPath) != size:
+                raise ChecksumError(
+                    "Downloaded {} bytes of file {} instead of {}".format(
+                        os.path.getsize(partialPath), fileId, size
+                    )
+                )
+            if checksum and _sha512(partialPath) != checksum:
+                raise ChecksumError("Checksum of file {} doesn't match".format(fileId))
+            os.rename(partialPath, path)
+            return
+        except (HttpError, requests.RequestException, ChecksumError) as e:
+            if isinstance(e, ChecksumError) and os.path.exists(partialPath):
+                # Start over
+                onProgress(-os.path.getsize(partialPath))
+                os.remove(partialPath)
+            if attempt == retries:
+                raise
+            time.sleep(RETRY_DELAY * 2**attempt)
+
+
+class BulkDownloader:
+    """
+    Download many Girder files with bounded concurrency, reporting the
+    overall progress.
+    """
+
+    def __init__(self, gc, maxWorkers, retries=MAX_RETRIES, progress=None):
+        """
+        :param gc: Girder client.
+        :type gc: GirderClient
+        :param maxWorkers: Maximum number of concurrent downloads.
+        :type maxWorkers: int
+        :param retries: Number of times to retry a failed download.
+        :type retries: int
+        :param progress: Function called with the number of bytes
+            downloaded, the total number of bytes, and a message.
+        :type progress: callable
+        """
+        self.gc = gc
+        self.maxWorkers = maxWorkers
+        self.retries = retries
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._current = 0
+        self._total = 0
+        self._remainingFiles = 0
+        self._lastReport = 0
+
+    def _onProgress(self, bytesReceived):
+        with self._lock:
+            self._current += bytesReceived
+            # Limit the rate of progress updates
+            if self.progress is None or time.time() - self._lastReport < 1:
+                return
+            self._lastReport = time.time()
+            current, total, remaining = self._current, self._total, self._remainingFiles
+        self.progress(current, total, "Downloading {} files".format(remaining))
+
+    def _download(self, fileId, path, size, checksum):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        downloadFile(
+            self.gc,
+            fileId,
+            path,
+            size=size,
+            checksum=checksum,
+            retries=self.retries,
+            onProgress=self._onProgress,
+        )
+        with self._lock:
+            self._remainingFiles -= 1
+
+    def download(self, files, directory):
+        """
+        Download files to a directory.
+
+        :param files: List of tuples of the form (file ID, relative path)
+            or (file ID, relative path, size, SHA-512 checksum).
+        :type files: list[tuple]
+        :param directory: Destination directory.
+        :type directory: str
+        """
+        os.makedirs(directory, exist_ok=True)
+        files = [tuple(file) + (None,) * (4 - len(file)) for file in files]
+        self._total = sum(size or 0 for _, _, size, _ in files)
+        self._remainingFiles = len(files)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.maxWorkers
+        ) as executor:
+            futures = [
+                executor.submit(
+                    self._download,
+                    fileId,
+                    os.path.join(directory, path),
+                    size,
+                    checksum,
+                )
+                for fileId, path, size, checksum in files
+            ]
+            # Raise the first error, if any
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+
+        if self.progress is not None:
+            self.progress(
+                self._current, self._total, "Downloaded {} files".format(len(files))
+            )
@@ -7,19 +7,17 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-from girder_worker.docker.tasks import docker_run
 from girder_worker.docker.transforms import VolumePath
-from girder_worker.docker.transforms.girder import (
-    GirderFileIdToVolume,
-    GirderUploadVolumePathToFolder,
-)
 
 from .common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
     createUploadMetadata,
+    dispatchDockerRun,
+    stageFile,
 )
+from .raster import GirderUploadRasterVolumePathToFolder
 from ..constants import DockerImage
 
 
@@ -76,17 +74,17 @@ def unetSemanticSegmentation(
     containerArgs = [
         "danesfield/tools/kwsemantic_segment.py",
         # Configuration file
-        GirderFileIdToVolume(configFile["_id"], gc=gc),
+        stageFile(gc, configFile),
         # Model file
-        GirderFileIdToVolume(modelFile["_id"], gc=gc),
+        stageFile(gc, modelFile),
         # RGB image
-        GirderFileIdToVolume(rgbImageFile["_id"], gc=gc),
+        stageFile(gc, rgbImageFile),
         # DSM
-        GirderFileIdToVolume(dsmFile["_id"], gc=gc),
+        stageFile(gc, dsmFile),
         # DTM
-        GirderFileIdToVolume(dtmFile["_id"], gc=gc),
+        stageFile(gc, dtmFile),
         # MSI image
-        GirderFileIdToVolume(msiImageFile["_id"], gc=gc),
+        stageFile(gc, msiImageFile),
         # Output directory
         outputVolumePath,
         # Output file prefix
@@ -98,12 +96,13 @@ def unetSemanticSegmentation(
     # - Provide upload metadata
     upload_kwargs = createUploadMetadata(jobId, stepName)
     resultHooks = [
-        GirderUploadVolumePathToFolder(
+        GirderUploadRasterVolumePathToFolder(
             outputVolumePath, outputFolder["_id"], upload_kwargs=upload_kwargs, gc=gc
         )
     ]
 
-    asyncResult = docker_run.delay(
+    asyncResult = dispatchDockerRun(
+        stepName,
         **createDockerRunArguments(
             image=DockerImage.DANESFIELD,
             containerArgs=containerArgs,
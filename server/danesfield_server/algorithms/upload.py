@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+"""
+Upload of the output of a step to Girder while its container runs.
+
+The output directory is watched on the worker, and files that haven't
+changed for QUIET_PERIOD are uploaded in parallel, in chunks. Once the
+container exits, a final pass uploads the remaining files, uploads again
+the files that changed after they were uploaded, and removes the items of
+files that were deleted, such as temporary files. When rasters are cloud
+optimized, GeoTIFF files are converted to COGs and uploaded by the final
+pass only (see raster.cloudOptimizeGeoTiffs), so that they're uploaded
+once.
+
+Files replace the content of items of the same name in the destination
+folder rather than creating new items, so running a task again doesn't
+duplicate its output. The upload reference is sent with every upload, so
+each file is attributed to the job and step that created it.
+"""
+
+import concurrent.futures
+import os
+import threading
+import time
+import uuid
+
+import requests
+from girder_client import HttpError
+from girder_worker_utils.transforms.girder_io import (
+    GirderClientTransform,
+    ResultTransform,
+)
+
+from .raster import cloudOptimizeGeoTiffs, isGeoTiff
+from .transfer import MAX_RETRIES, RETRY_DELAY
+
+# Default number of concurrent uploads per task
+MAX_UPLOAD_WORKERS = 4
+
+# Interval at which the output directory is scanned, in seconds
+POLL_INTERVAL = 5
+
+# Time for which a file must not change before it's uploaded while the
+# container runs, in seconds
+QUIET_PERIOD = 30
+
+# Uploaders of the tasks running in this worker process, by ID
+_uploaders = {}
+_uploadersLock = threading.Lock()
+
+
+class StreamingUploader:
+    """
+    Upload the files of a directory to a Girder folder as they're
+    written.
+    """
+
+    def __init__(
+        self,
+        gc,
+        directory,
+        folderId,
+        reference=None,
+        maxWorkers=MAX_UPLOAD_WORKERS,
+        pollInterval=POLL_INTERVAL,
+        quietPeriod=QUIET_PERIOD,
+        cloudOptimize=False,
+    ):
+        """
+        :param gc: Girder client.
+        :type gc: GirderClient
+        :param directory: Directory to upload.
+        :type directory: str
+        :param folderId: ID of the destination folder.
+        :type folderId: str
+        :param reference: Reference to send with the uploads.
+        :type reference: str
+        :param maxWorkers: Maximum number of concurrent uploads.
+        :type maxWorkers: int
+        :param pollInterval: Interval at which the directory is scanned.
+        :type pollInterval: float
+        :param quietPeriod: Time for which a file must not change before
+            it's uploaded while the directory is watched.
+        :type quietPeriod: float
+        :param cloudOptimize: Whether to convert GeoTIFF files to COGs
+            before they're uploaded by the final pass.
+        :type cloudOptimize: bool
+        """
+        self.gc = gc
+        self.directory = directory
+        self.folderId = str(folderId)
+        self.reference = reference
+        self.pollInterval = pollInterval
+        self.quietPeriod = quietPeriod
+        self.cloudOptimize = cloudOptimize
+        # Layouts of the files converted to COGs, by path
+        self._layouts = {}
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._folderLock = threading.RLock()
+        self._folderIds = {"": self.folderId}
+        # Pending uploads, by relative path
+        self._pending = {}
+        # Uploaded files as tuples of the form (size, modification time,
+        # file document), by relative path
+        self._uploaded = {}
+
+        # Statistics
+        self.streamedFiles = 0
+        self.finalFiles = 0
+        self.uploadedBytes = 0
+        self.removedFiles = 0
+
+    def _scan(self):
+        """
+        List the regular files of the directory as tuples of the form
+        (relative path, stat result).
+        """
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.islink(path):
+                        continue
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(path, self.directory), stat
+
+    def _getFolderId(self, relativeDir):
+        """
+        Get the ID of the folder of a subdirectory, creating it if
+        necessary.
+        """
+        with self._folderLock:
+            if relativeDir not in self._folderIds:
+                parentId = self._getFolderId(os.path.dirname(relativeDir))
+                folder = self.gc.createFolder(
+                    parentId, os.path.basename(relativeDir), reuseExisting=True
+                )
+                self._folderIds[relativeDir] = folder["_id"]
+            return self._folderIds[relativeDir]
+
+    def _findExisting(self, folderId, name):
+        """
+        Find the file of an item of the given name in a folder, from a
+        previous run of the task or an interrupted upload.
+        """
+        for item in self.gc.listItem(folderId, name=name):
+            files = list(self.gc.listFile(item["_id"]))
+            if len(files) == 1:
+                return files[0]
+        return None
+
+    def _sendFile(self, relativePath, path, size):
+        with self._lock:
+            uploaded = self._uploaded.get(relativePath)
+        if uploaded is not None:
+            existing = uploaded[2]
+        else:
+            folderId = self._getFolderId(os.path.dirname(relativePath))
+            existing = self._findExisting(folderId, os.path.basename(path))
+
+        with open(path, "rb") as f:
+            if existing is not None:
+                self.gc.uploadFileContents(
+                    existing["_id"], f, size, reference=self.reference
+                )
+                return existing
+            return self.gc.uploadFile(
+                folderId,
+                f,
+                os.path.basename(path),
+                size,
+                parentType="folder",
+                reference=self.reference,
+            )
+
+    def _upload(self, relativePath, final):
+        path = os.path.join(self.directory, relativePath)
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                # Only the content up to the size at this time is sent. A
+                # file that changes afterward is uploaded again.
+                stat = os.stat(path)
+                file = self._sendFile(relativePath, path, stat.st_size)
+                break
+            except FileNotFoundError:
+                # Removed since the directory was scanned
+                return
+            except (HttpError, requests.RequestException):
+                if attempt == MAX_RETRIES:
+                    raise
+                time.sleep(RETRY_DELAY * 2**attempt)
+
+        layout = self._layouts.get(path)
+        if layout is not None:
+            self.gc.addMetadataToItem(file["itemId"], {"rasterLayout": layout})
+
+        with self._lock:
+            self._uploaded[relativePath] = (stat.st_size, stat.st_mtime_ns, file)
+            self.uploadedBytes += stat.st_size
+            if final:
+                self.finalFiles += 1
+            else:
+                self.streamedFiles += 1
+
+    def _poll(self, final=False):
+        """
+        Start uploading the files that are new or changed since they were
+        uploaded. Unless final is set, only files that haven't changed for
+        the quiet period are uploaded.
+        """
+        now = time.time()
+        for relativePath, stat in self._scan():
+            pending = self._pending.get(relativePath)
+            if pending is not None and not pending.done():
+                continue
+            with self._lock:
+                uploaded = self._uploaded.get(relativePath)
+            if uploaded is not None and uploaded[:2] == (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                continue
+            if not final and (
+                now - stat.st_mtime < self.quietPeriod
+                or (self.cloudOptimize and isGeoTiff(relativePath))
+            ):
+                continue
+            self._pending[relativePath] = self._executor.submit(
+                self._upload, relativePath, final
+            )
+
+    def _wait(self):
+        """
+        Wait for the pending uploads, and return their errors.
+        """
+        futures = list(self._pending.values())
+        self._pending = {}
+        concurrent.futures.wait(futures)
+        return [future.exception() for future in futures if future.exception()]
+
+    def _watch(self):
+        while not self._stop.wait(self.pollInterval):
+            try:
+                self._poll()
+            except Exception as e:
+                # Files are uploaded by the final pass instead
+                print("Failed to scan output directory: {}".format(e), flush=True)
+
+    def start(self):
+        """
+        Start watching the directory.
+        """
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def _stopWatching(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def finish(self):
+        """
+        Stop watching the directory, and upload the files that haven't
+        been uploaded or that changed. Items of files that were removed
+        are removed.
+        """
+        self._stopWatching()
+        # Failed uploads are retried by the final pass
+        for error in self._wait():
+            print("Upload failed, retrying: {}".format(error), flush=True)
+        if self.cloudOptimize:
+            self._layouts = cloudOptimizeGeoTiffs(self.directory)
+        self._poll(final=True)
+        errors = self._wait()
+        self._executor.shutdown()
+        if errors:
+            raise errors[0]
+
+        existing = {relativePath for relativePath, _ in self._scan()}
+        for relativePath, (_, _, file) in list(self._uploaded.items()):
+            if relativePath not in existing:
+                self.gc.delete("item/%s" % file["itemId"])
+                del self._uploaded[relativePath]
+                self.removedFiles += 1
+
+    def cancel(self):
+        """
+        Stop watching the directory and uploading files.
+        """
+        self._stopWatching()
+        for future in self._pending.values():
+            future.cancel()
+        self._executor.shutdown()
+
+
+class StreamingUploadVolume(GirderClientTransform):
+    """
+    Output volume of a step whose files are uploaded to a Girder folder
+    while the container runs (see StreamingUploader). Pass it in the
+    volumes of the task instead of the volume it wraps, and add the hook
+    returned by finish to the result hooks to complete the upload. The
+    volume is transformed to the path of the directory in the container.
+    """
+
+    def __init__(
+        self,
+        volume,
+        folderId,
+        upload_kwargs=None,
+        maxWorkers=MAX_UPLOAD_WORKERS,
+        cloudOptimize=False,
+        **kwargs
+    ):
+        """
+        :param volume: The output volume, such as a BindMountVolume or a
+            ScratchWorkspace.
+        :type volume: Transform
+        :param folderId: ID of the destination folder.
+        :type folderId: str
+        :param upload_kwargs: Upload metadata (see createUploadMetadata).
+        :type upload_kwargs: dict
+        :param maxWorkers: Maximum number of concurrent uploads.
+        :type maxWorkers: int
+        :param cloudOptimize: Whether to convert GeoTIFF files to COGs
+            before they're uploaded.
+        :type cloudOptimize: bool
+        """
+        super(StreamingUploadVolume, self).__init__(**kwargs)
+        self.volume = volume
+        self.folderId = str(folderId)
+        self.reference = (upload_kwargs or {}).get("reference")
+        self.maxWorkers = maxWorkers
+        self.cloudOptimize = cloudOptimize
+        self.uploaderId = uuid.uuid4().hex
+
+    def _repr_model_(self):
+        return "{}: {}".format(self.__class__.__name__, self.folderId)
+
+    def _repr_json_(self):
+        return self.volume._repr_json_()
+
+    def transform(self, **kwargs):
+        self.volume.transform(**kwargs)
+        with _uploadersLock:
+            if self.uploaderId not in _uploaders:
+                uploader = StreamingUploader(
+                    self.gc,
+                    self.volume.host_path,
+                    self.folderId,
+                    reference=self.reference,
+                    maxWorkers=self.maxWorkers,
+                    cloudOptimize=self.cloudOptimize,
+                )
+                uploader.start()
+                _uploaders[self.uploaderId] = uploader
+        return self.volume.container_path
+
+    def finish(self):
+        """
+        Get the result hook that completes the upload.
+        """
+        return FinishStreamingUpload(self.uploaderId)
+
+
+class FinishStreamingUpload(ResultTransform):
+    """
+    Result hook that completes the upload of a StreamingUploadVolume.
+    Returns the ID of the destination folder.
+    """
+
+    def __init__(self, uploaderId):
+        self.uploaderId = uploaderId
+
+    def _repr_model_(self):
+        return "{}: {}".format(self.__class__.__name__, self.uploaderId)
+
+    def _popUploader(self):
+        with _uploadersLock:
+            return _uploaders.pop(self.uploaderId, None)
+
+    def exception(self):
+        uploader = self._popUploader()
+        if uploader is not None:
+            uploader.cancel()
+
+    def transform(self, *args, **kwargs):
+        uploader = self._popUploader()
+        if uploader is None:
+            raise Exception("Output volume of the task was not uploaded")
+        uploader.finish()
+        # Logged to the job
+        print(
+            "Uploaded {} files while the container ran and {} files after "
+            "it exited ({} bytes), removed {} deleted files".format(
+                uploader.streamedFiles,
+                uploader.finalFiles,
+                uploader.uploadedBytes,
+                uploader.removedFiles,
+            ),
+            flush=True,
+        )
+        return uploader.folderId
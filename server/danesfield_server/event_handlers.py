@@ -9,27 +9,26 @@
 
 import datetime
 import json
-import threading
 
-from girder import events, logprint
+from girder import logprint
 from girder.models.folder import Folder
+from girder.models.item import Item
 from girder.models.notification import Notification
 from girder.models.user import User
-from girder_jobs.models.job import Job
 from girder_jobs.constants import JobStatus
 
 from .constants import DanesfieldJobKey
+from .models.dataset import Dataset
+from .models.tileCache import TileCache
 from .models.workingSet import WorkingSet
 from .workflow import DanesfieldWorkflowException
-from .workflow_manager import DanesfieldWorkflowManager
-
-
-# Lock for onJobUpdate()
-_onJobUpdateLock = threading.RLock()
+from .workflow_manager import DanesfieldWorkflowManager, advanceExecutor
 
 
 def cleanWorkingSetOutputFolder(job):
     """Clean a working set's existing output folder."""
+    if job.get(DanesfieldJobKey.WORKINGSETID) is None:
+        return
     adminUser = User().getAdmins().next()
     workingSet = WorkingSet().load(job[DanesfieldJobKey.WORKINGSETID])
     output_folder = Folder().load(workingSet["output_folder_id"], user=adminUser)
@@ -38,6 +37,8 @@ def cleanWorkingSetOutputFolder(job):
 
 def setWorkflowResultWorkingSets(job):
     """Create working sets from a workflow's output."""
+    if job.get(DanesfieldJobKey.WORKINGSETID) is None:
+        return
     adminUser = User().getAdmins().next()
     workingSet = WorkingSet().load(job[DanesfieldJobKey.WORKINGSETID])
     output_folder = Folder().load(workingSet["output_folder_id"], user=adminUser)
@@ -49,15 +50,20 @@ def setWorkflowResultWorkingSets(job):
         if "generate-point-cloud" not in ws["name"]
     ]
     for ws in childWorkingSets:
+        TileCache().invalidateItems(ws["datasetIds"])
         WorkingSet().remove(ws)
 
     # For each folder in the output directory, create a working set
     for folder in Folder().childFolders(output_folder, "folder", user=adminUser):
+        datasetIds = [item["_id"] for item in Folder().childItems(folder)]
+        TileCache().invalidateItems(datasetIds)
         WorkingSet().createWorkingSet(
             name=f"{workingSet['name']}: {folder['name']}",
             parentWorkingSet=workingSet,
-            datasetIds=[item["_id"] for item in Folder().childItems(folder)],
+            datasetIds=datasetIds,
         )
+        # Render the map tiles of the output in the background
+        TileCache().prefillItems(datasetIds)
 
 
 def onFinalizeUpload(event):
@@ -89,6 +95,39 @@ def onFinalizeUpload(event):
     )
 
 
+def onDatasetUpload(event):
+    """
+    Event handler for finalize upload event.
+
+    Update the dataset catalog entry of the item of the uploaded file.
+    """
+    itemId = event.info["file"].get("itemId")
+    if itemId is None:
+        return
+    item = Item().load(itemId, force=True)
+    if item is not None:
+        Dataset().updateItem(item)
+
+
+def onItemSave(event):
+    """
+    Event handler for item save event.
+
+    Update the dataset catalog entry of the item, for example when its
+    geospatial metadata is set.
+    """
+    Dataset().updateItem(event.info)
+
+
+def onItemRemove(event):
+    """
+    Event handler for item remove event.
+
+    Remove the dataset catalog entry of the item.
+    """
+    Dataset().removeItem(event.info)
+
+
 def onJobUpdate(event):
     """
     Event handler for job update event.
@@ -106,20 +145,41 @@ def onJobUpdate(event):
     except KeyError:
         return
 
+    workflowManager = DanesfieldWorkflowManager.instance()
+
+    # Parse new output as it's logged, rather than loading the full log
+    # once the job completes
+    if params.get("log") and not params.get("overwrite"):
+        workflowManager.addStandardOutput(
+            jobId=jobId, stepName=stepName, girderJobId=job["_id"], log=params["log"]
+        )
+
     try:
         # FIXME: Sometimes status is unicode, not int
         status = int(params["status"])
     except (TypeError, KeyError, ValueError):
         return
 
-    workflowManager = DanesfieldWorkflowManager.instance()
+    # Parse the last line of output of a completed job
+    if status == JobStatus.SUCCESS:
+        workflowManager.addStandardOutput(
+            jobId=jobId, stepName=stepName, girderJobId=job["_id"], log="", final=True
+        )
+
+    if status == JobStatus.RUNNING:
+        workflowManager.stepRunning(jobId, stepName)
 
-    with _onJobUpdateLock:
+    with workflowManager.jobLock(jobId):
         # Handle composite steps
         if workflowManager.isCompositeStep(jobId, stepName):
             # Notify workflow manager when a job in a composite step completes
             if status in (JobStatus.SUCCESS, JobStatus.ERROR, JobStatus.CANCELED):
-                workflowManager.compositeStepJobCompleted(jobId, stepName)
+                workflowManager.compositeStepJobCompleted(
+                    jobId, stepName, successful=status == JobStatus.SUCCESS
+                )
+                # Pass the output of the job to steps in streaming mode
+                if status == JobStatus.SUCCESS:
+                    advanceExecutor.submit(streamWorkflowItems, jobId, stepName)
             # Skip processing until all jobs in a composite step have completed
             if not workflowManager.isCompositeStepComplete(jobId, stepName):
                 return
@@ -132,40 +192,26 @@ def onJobUpdate(event):
             cleanWorkingSetOutputFolder(job)
 
         if status == JobStatus.SUCCESS:
-            # Add standard output from job
-            # TODO: Alternatively, could record job model ID and defer
-            # log lookup
-            # TODO: This currently doesn't support composite steps;
-            # only the output
-            # from the last job is saved
-            job = Job().load(job["_id"], includeLog=True, force=True)
-            workflowManager.addStandardOutput(
-                jobId=jobId, stepName=stepName, output=job.get("log")
-            )
-
-            workflowManager.stepSucceeded(jobId=jobId, stepName=stepName)
+            # Another Girder process may have handled the step already
+            if not workflowManager.stepSucceeded(jobId=jobId, stepName=stepName):
+                return
 
             # For one-step imageless workflow results
             setWorkflowResultWorkingSets(job)
 
             # Advance workflow asynchronously to avoid affecting
             # finished job in case of error
-            events.daemon.trigger(
-                info={"jobId": jobId, "stepName": stepName, "userId": job["userId"]},
-                callback=advanceWorkflow,
+            advanceExecutor.submit(
+                advanceWorkflow, jobId=jobId, stepName=stepName, userId=job["userId"]
             )
         elif status in (JobStatus.CANCELED, JobStatus.ERROR):
             workflowManager.stepFailed(jobId=jobId, stepName=stepName)
 
 
-def advanceWorkflow(event):
+def advanceWorkflow(jobId, stepName, userId):
     """
     Advance to next step in workflow. Send a notification on error.
     """
-    jobId = event.info["jobId"]
-    stepName = event.info["stepName"]
-    userId = event.info["userId"]
-
     user = User().load(userId, force=True, exc=True)
 
     try:
@@ -185,3 +231,21 @@ def advanceWorkflow(event):
             user=user,
             expires=datetime.datetime.utcnow() + datetime.timedelta(seconds=30),
         )
+    except Exception:
+        logprint.exception(
+            "advanceWorkflow: Error advancing workflow "
+            "Job={} PreviousStep={}".format(jobId, stepName)
+        )
+
+
+def streamWorkflowItems(jobId, stepName):
+    """
+    Run steps in streaming mode on the new output of a step.
+    """
+    try:
+        DanesfieldWorkflowManager.instance().streamItems(jobId, stepName)
+    except Exception:
+        logprint.exception(
+            "streamWorkflowItems: Error streaming items "
+            "Job={} Step={}".format(jobId, stepName)
+        )
@@ -25,8 +25,8 @@ class JobInfo:
         :param workingSets: The initial working set and working sets
             created during the workflow.  Indexed by step name.
         :type workingSets: dict
-        :param standardOutput: The standard output of each step. Lists
-            of strings, indexed by step name.
+        :param standardOutput: The standard output of each step, as
+            parsed by the output parser of the step, indexed by step name.
         :type standardOutput: dict
         :param outputFolder: Output folder document.
         :type outputFolder: dict
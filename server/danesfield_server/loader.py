@@ -7,12 +7,24 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
+import threading
+
 from girder import events
 from girder.utility.config import getServerMode
+from girder_worker.app import app as workerApp
 
+from .algorithms.common import configureTaskPriorities
+from .constants import DanesfieldStep
 from .rest import dataset, workingSet, processing, filter
 
-from .event_handlers import onFinalizeUpload, onJobUpdate
+from .event_handlers import (
+    onDatasetUpload,
+    onFinalizeUpload,
+    onItemRemove,
+    onItemSave,
+    onJobUpdate,
+)
+from .models.dataset import Dataset
 from .workflow import DanesfieldWorkflow
 from .workflow_manager import DanesfieldWorkflowManager
 from .client_webroot import ClientWebroot
@@ -26,11 +38,16 @@ def createWorkflow():
     """
     workflow = DanesfieldWorkflow()
 
+    # The point cloud is provided by the user (see /processing/setPointCloud)
+    workflow.addInput(DanesfieldStep.GENERATE_POINT_CLOUD)
+
     for step in [
         RunDanesfieldImageless,
     ]:
         workflow.addStep(step())
 
+    workflow.compile()
+
     return workflow
 
 
@@ -41,6 +58,19 @@ def load(info):
     )
     events.bind("jobs.job.update", "danesfield-job-update", onJobUpdate)
 
+    # Keep the dataset catalog up to date
+    events.bind(
+        "model.file.finalizeUpload.after", "danesfield-dataset-upload", onDatasetUpload
+    )
+    events.bind("model.item.save.after", "danesfield-dataset-save", onItemSave)
+    events.bind("model.item.remove", "danesfield-dataset-remove", onItemRemove)
+    if Dataset().findOne() is None:
+        # Add the existing datasets in the background
+        threading.Thread(target=Dataset().rebuild, daemon=True).start()
+
+    # Send the tasks of the steps to queues with priorities
+    configureTaskPriorities(workerApp)
+
     # Set workflow on workflow manager
     # TODO: On each request to /process, set this to either the normal or point-cloud starting workflow?
     DanesfieldWorkflowManager.instance().workflow = createWorkflow()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+"""
+Versions of the model folders used by workflow steps.
+
+A version is a hash of the relative paths and checksums of the files of a
+folder, so it changes whenever a model file changes. Worker hosts keep
+each version they use in a persistent cache (see ModelCache) and remove
+the versions that are no longer referenced.
+"""
+
+import hashlib
+import json
+import os
+
+from girder.models.collection import Collection
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.setting import Setting
+
+from .settings import PluginSettings
+
+# Settings that refer to model folders
+MODEL_FOLDER_SETTINGS = [
+    PluginSettings.BUILDING_SEGMENTATION_MODEL_FOLDER_ID,
+    PluginSettings.MATERIAL_CLASSIFIER_MODEL_FOLDER_ID,
+    PluginSettings.ROOF_SEGMENTATION_MODEL_FOLDER_ID,
+]
+
+
+def _listFiles(folder, path=""):
+    """
+    List the files in a folder and its subfolders as tuples of the form
+    (relative path, file document). Items that contain multiple files are
+    stored as directories, as with GirderClient.downloadFolderRecursive.
+    """
+    for item in Item().find({"folderId": folder["_id"]}):
+        files = list(File().find({"itemId": item["_id"]}))
+        for file in files:
+            if len(files) == 1:
+                yield os.path.join(path, file["name"]), file
+            else:
+                yield os.path.join(path, item["name"], file["name"]), file
+
+    for subfolder in Folder().find(
+        {"parentId": folder["_id"], "parentCollection": "folder"}
+    ):
+        for result in _listFiles(subfolder, os.path.join(path, subfolder["name"])):
+            yield result
+
+
+def getFolderModel(folder):
+    """
+    Get the version of a model folder and its files.
+
+    :param folder: The model folder.
+    :type folder: dict
+    :returns: dict with the keys version and files, a list of tuples of
+        the form (file ID, relative path, size, checksum).
+    """
+    files = sorted(_listFiles(folder), key=lambda entry: entry[0])
+    content = [
+        # Files without a checksum are identified by ID and size
+        (path, file.get("sha512") or "{}:{}".format(file["_id"], file["size"]))
+        for path, file in files
+    ]
+    return {
+        "version": hashlib.sha512(json.dumps(content).encode()).hexdigest(),
+        "files": [
+            (str(file["_id"]), path, file["size"], file.get("sha512"))
+            for path, file in files
+        ],
+    }
+
+
+def getModelsFolder():
+    """
+    Get the models folder of the core3d collection used by the imageless
+    workflow, or None.
+    """
+    core3dCollection = Collection().findOne({"name": "core3d"})
+    if core3dCollection is None:
+        return None
+    return Folder().findOne(
+        {
+            "parentId": core3dCollection["_id"],
+            "parentCollection": "collection",
+            "name": "models",
+        }
+    )
+
+
+def getReferencedModelVersions():
+    """
+    Get the versions of the model folders referenced by plugin settings
+    and of the core3d models folder.
+
+    :returns: list[str]
+    """
+    folders = [
+        Folder().load(folderId, force=True)
+        for folderId in (Setting().get(setting) for setting in MODEL_FOLDER_SETTINGS)
+        if folderId
+    ]
+    folders.append(getModelsFolder())
+    return sorted(
+        {getFolderModel(folder)["version"] for folder in folders if folder is not None}
+    )
@@ -0,0 +1,136 @@
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import datetime
+
+from pymongo import ReturnDocument
+
+from girder.models.model_base import Model
+
+
+class Batch(Model):
+    """
+    Workflow jobs submitted together. At most maxRunningJobs jobs of a
+    batch run at a time; the other jobs wait until a running job
+    finishes.
+    """
+
+    def initialize(self):
+        self.name = "batch"
+        self.ensureIndex("userId")
+
+    def validate(self, doc):
+        return doc
+
+    def createBatch(self, batchId, user, jobs, maxRunningJobs):
+        """
+        Create a batch. All jobs are pending.
+
+        :param batchId: ID of the batch.
+        :type batchId: ObjectId
+        :param user: The user that submitted the batch.
+        :type user: dict
+        :param jobs: The jobs of the batch, as dicts with the keys jobId,
+            workingSetId and options.
+        :type jobs: list[dict]
+        :param maxRunningJobs: Maximum number of jobs running at a time.
+        :type maxRunningJobs: int
+        """
+        now = datetime.datetime.utcnow()
+        doc = {
+            "_id": batchId,
+            "userId": user["_id"],
+            "jobs": jobs,
+            # IDs of jobs that haven't started, in submission order
+            "pendingJobIds": [job["jobId"] for job in jobs],
+            # Number of jobs that started and haven't finished
+            "runningCount": 0,
+            "runningJobIds": [],
+            "completedJobIds": [],
+            "failedJobIds": [],
+            "maxRunningJobs": maxRunningJobs,
+            "created": now,
+            "updated": now,
+        }
+        return self.save(doc)
+
+    def _update(self, batchId, update, query=None, returnDocument=ReturnDocument.AFTER):
+        update.setdefault("$set", {})["updated"] = datetime.datetime.utcnow()
+        return self.collection.find_one_and_update(
+            dict(query or {}, _id=batchId), update, return_document=returnDocument
+        )
+
+    def startJob(self, batchId):
+        """
+        Start the next pending job if fewer than maxRunningJobs jobs are
+        running. Returns the ID of the job, or None.
+        """
+        # The job moves from the pending to the running jobs in a single
+        # update, so that it can't be lost between them
+        doc = self.collection.find_one_and_update(
+            {
+                "_id": batchId,
+                "pendingJobIds.0": {"$exists": True},
+                "$expr": {"$lt": ["$runningCount", "$maxRunningJobs"]},
+            },
+            [
+                {
+                    "$set": {
+                        "pendingJobIds": {
+                            "$slice": [
+                                "$pendingJobIds",
+                                1,
+                                {"$size": "$pendingJobIds"},
+                            ]
+                        },
+                        "runningJobIds": {
+                            "$concatArrays": [
+                                "$runningJobIds",
+                                [{"$arrayElemAt": ["$pendingJobIds", 0]}],
+                            ]
+                        },
+                        "runningCount": {"$add": ["$runningCount", 1]},
+                        "updated": datetime.datetime.utcnow(),
+                    }
+                }
+            ],
+            return_document=ReturnDocument.BEFORE,
+        )
+        if doc is None:
+            return None
+        return doc["pendingJobIds"][0]
+
+    def finishJob(self, batchId, jobId, successful):
+        """
+        Record that a running job finished. Returns None if the job isn't
+        running.
+        """
+        return self._update(
+            batchId,
+            {
+                "$pull": {"runningJobIds": jobId},
+                "$addToSet": {
+                    ("completedJobIds" if successful else "failedJobIds"): jobId
+                },
+                "$inc": {"runningCount": -1},
+            },
+            query={"runningJobIds": jobId},
+        )
+
+    def resumeJob(self, batchId, jobId):
+        """
+        Record that a failed job was resumed. Resumed jobs run regardless
+        of maxRunningJobs, since they were already admitted once.
+        """
+        return self._update(
+            batchId,
+            {
+                "$pull": {"failedJobIds": jobId},
+                "$addToSet": {"runningJobIds": jobId},
+                "$inc": {"runningCount": 1},
+            },
+            query={"failedJobIds": jobId},
+        )
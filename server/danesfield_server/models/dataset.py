@@ -0,0 +1,338 @@
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import datetime
+import re
+import uuid
+
+from pymongo.errors import WriteError
+
+from girder import logprint
+from girder.constants import AccessType, SortDir
+from girder.models.item import Item
+from girder.models.model_base import Model
+
+# Drivers of the geospatial metadata of source images
+SOURCE_IMAGE_DRIVERS = [
+    "GeoJSON",
+    "GeoTIFF",
+    "OBJ",
+    "National Imagery Transmission Format",
+]
+
+# Collection of the generation of the catalog
+GENERATION_COLLECTION = "danesfield_dataset_generation"
+
+# Modalities of source images, by the product type in their name
+MODALITIES = {"M1BS": "MSI", "P1BS": "PAN"}
+
+# Name of a source image, for example
+# 15FEB11165027-P1BS-500648061010_01_P001_________AAE_0AAAAABPABR0.NTF
+SOURCE_IMAGE_NAME_REGEX = re.compile(
+    r".*?(?P<date>[0-9]{2}[A-Z]{3}[0-9]{8})-(?P<productType>P1BS|M1BS)-",
+    flags=re.IGNORECASE,
+)
+
+# Satellite sensors that may appear in the name of a source image
+SENSOR_REGEX = re.compile(r"WV0[1-4]|GE01|QB02|IK02", flags=re.IGNORECASE)
+
+
+def isSourceImage(item):
+    """
+    Return true if the item is a source image with geospatial metadata,
+    which is listed in the catalog.
+
+    :param item: Item document.
+    :type item: dict
+    """
+    name = item["name"]
+    if not name.endswith(".NTF") or not ("M1BS" in name or "P1BS" in name):
+        return False
+    geometa = item.get("geometa")
+    if not geometa:
+        return False
+    return geometa.get("driver") in SOURCE_IMAGE_DRIVERS or any(
+        subDataset.get("driver") == "National Imagery Transmission Format"
+        for subDataset in geometa.get("subDatasets", [])
+    )
+
+
+def parseSourceImageName(name):
+    """
+    Parse the fields of the name of a source image.
+
+    :param name: Name of the image.
+    :type name: str
+    :returns: dict with the modality ("MSI" or "PAN"), scene prefix,
+        acquisition date and sensor of the image. Fields that can't be
+        parsed are None.
+    """
+    fields = {
+        "modality": "MSI" if "M1BS" in name else "PAN" if "P1BS" in name else None,
+        # Part of the name shared by the MSI and PAN images of a scene
+        "scenePrefix": name.split("-")[0],
+        "acquisitionDate": None,
+        "sensor": None,
+    }
+
+    match = SOURCE_IMAGE_NAME_REGEX.match(name)
+    if match:
+        fields["modality"] = MODALITIES[match.group("productType").upper()]
+        try:
+            fields["acquisitionDate"] = datetime.datetime.strptime(
+                match.group("date").upper(), "%y%b%d%H%M%S"
+            )
+        except ValueError:
+            pass
+
+    match = SENSOR_REGEX.search(name)
+    if match:
+        fields["sensor"] = match.group(0).upper()
+
+    return fields
+
+
+def _getVertices(coordinates):
+    """
+    List the distinct positions of GeoJSON coordinates.
+    """
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return [tuple(coordinates)]
+    vertices = []
+    for child in coordinates:
+        for vertex in _getVertices(child):
+            if vertex not in vertices:
+                vertices.append(vertex)
+    return vertices
+
+
+def _getGeometryVertices(geometry):
+    if geometry.get("type") == "GeometryCollection":
+        return [
+            vertex
+            for child in geometry.get("geometries", [])
+            for vertex in _getGeometryVertices(child)
+        ]
+    return _getVertices(geometry.get("coordinates", []))
+
+
+def _containsQuery(geometry):
+    """
+    Query the footprints that contain a geometry. Footprints are convex,
+    so a footprint contains the geometry when it contains its vertices;
+    the index narrows the search to the footprints that intersect it.
+    """
+    return [{"footprint": {"$geoIntersects": {"$geometry": geometry}}}] + [
+        {
+            "footprint": {
+                "$geoIntersects": {
+                    "$geometry": {"type": "Point", "coordinates": list(vertex)}
+                }
+            }
+        }
+        for vertex in _getGeometryVertices(geometry)
+    ]
+
+
+# Queries of the footprints that have a relation to a GeoJSON geometry, by
+# relation
+SEARCH_RELATIONS = {
+    "intersects": lambda geometry: [
+        {"footprint": {"$geoIntersects": {"$geometry": geometry}}}
+    ],
+    "contains": _containsQuery,
+    "within": lambda geometry: [{"footprint": {"$geoWithin": {"$geometry": geometry}}}],
+}
+
+
+class Dataset(Model):
+    """
+    Catalog of the source images of the dataset views, with the fields
+    they're queried by. An entry is kept up to date with its item when the
+    item is saved or a file is uploaded to it (see isSourceImage), so that
+    listing and searching the source images doesn't scan the items.
+    """
+
+    def initialize(self):
+        self.name = "danesfield_dataset"
+        self.ensureIndex(("itemId", {"unique": True}))
+        self.ensureIndex("modality")
+        self.ensureIndex("scenePrefix")
+        self.ensureIndex("acquisitionDate")
+        self.ensureIndex("sensor")
+        self.ensureIndex(([("footprint", "2dsphere")], {}))
+
+    def validate(self, doc):
+        return doc
+
+    def updateItem(self, item):
+        """
+        Add, update or remove the entry of an item, depending on whether
+        it's a source image.
+
+        :param item: Item document.
+        :type item: dict
+        """
+        if not isSourceImage(item):
+            self.removeItem(item)
+            return None
+
+        doc = {
+            "itemId": item["_id"],
+            "name": item["name"],
+            "folderId": item["folderId"],
+            "driver": item["geometa"].get("driver"),
+            "footprint": item["geometa"].get("bounds"),
+        }
+        doc.update(parseSourceImageName(item["name"]))
+        try:
+            result = self._saveEntry(doc)
+        except WriteError:
+            # The footprint isn't valid GeoJSON, so the image can't be
+            # found by location
+            logprint.warning(
+                "Dataset: Invalid footprint for item {}".format(item["_id"])
+            )
+            doc["footprint"] = None
+            result = self._saveEntry(doc)
+        if result.upserted_id is not None or result.modified_count:
+            self._incrementGeneration()
+        return doc
+
+    def _saveEntry(self, doc):
+        return self.collection.update_one(
+            {"itemId": doc["itemId"]},
+            {"$set": doc, "$setOnInsert": {"created": datetime.datetime.utcnow()}},
+            upsert=True,
+        )
+
+    def removeItem(self, item):
+        """
+        Remove the entry of an item, if any.
+
+        :param item: Item document.
+        :type item: dict
+        """
+        if self.collection.delete_one({"itemId": item["_id"]}).deleted_count:
+            self._incrementGeneration()
+
+    def _incrementGeneration(self):
+        self.database[GENERATION_COLLECTION].update_one(
+            {"_id": "catalog"},
+            {"$inc": {"counter": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex}},
+            upsert=True,
+        )
+
+    def getGeneration(self):
+        """
+        Get the generation of the catalog, which changes whenever an entry
+        is added, changed or removed.
+
+        :returns: str
+        """
+        generation = self.database[GENERATION_COLLECTION].find_one({"_id": "catalog"})
+        if generation is None:
+            return "0"
+        return "{}-{}".format(generation["epoch"], generation["counter"])
+
+    def rebuild(self):
+        """
+        Add the existing source images to the catalog. This scans the
+        items, so it's only run when the catalog is empty.
+
+        :returns: The number of entries.
+        """
+        count = 0
+        for item in Item().find({"name": {"$regex": r"\.NTF$"}}):
+            if self.updateItem(item) is not None:
+                count += 1
+        return count
+
+    def search(
+        self,
+        geometry=None,
+        relation="intersects",
+        start=None,
+        end=None,
+        modalities=None,
+        cursor=None,
+        limit=0,
+    ):
+        """
+        Find the entries that match search conditions, in the order in
+        which they were added.
+
+        :param geometry: GeoJSON geometry that the footprints of the entries
+            must be related to.
+        :type geometry: dict
+        :param relation: Relation of the footprints to the geometry (see
+            SEARCH_RELATIONS).
+        :type relation: str
+        :param start: Earliest acquisition date.
+        :type start: datetime.datetime
+        :param end: Acquisition date before which the images were acquired.
+        :type end: datetime.datetime
+        :param modalities: Modalities of the images, such as "MSI".
+        :type modalities: list[str]
+        :param cursor: ID of the last entry of the previous page.
+        :type cursor: ObjectId
+        :param limit: Maximum number of entries, or 0.
+        :type limit: int
+        :returns: Cursor of the entries.
+        """
+        conditions = []
+        if geometry is not None:
+            conditions.extend(SEARCH_RELATIONS[relation](geometry))
+        if start is not None:
+            conditions.append({"acquisitionDate": {"$gte": start}})
+        if end is not None:
+            conditions.append({"acquisitionDate": {"$lt": end}})
+        if modalities:
+            conditions.append({"modality": {"$in": modalities}})
+        if cursor is not None:
+            conditions.append({"_id": {"$gt": cursor}})
+
+        query = {"$and": conditions} if conditions else {}
+        return self.find(query, sort=[("_id", SortDir.ASCENDING)], limit=limit)
+
+    def getItems(self, entries, user, fields=None):
+        """
+        Get the items of entries that a user can read.
+
+        :param entries: Entries of the catalog.
+        :type entries: iterable[dict]
+        :param user: The user, or None for anonymous access.
+        :type user: dict
+        :param fields: Fields of the items to return, or None for all.
+        :type fields: list[str]
+        :returns: list of item documents, in the order of the entries.
+        """
+        itemIds = [entry["itemId"] for entry in entries]
+        if fields is not None:
+            # Access to an item is determined by its folder
+            fields = list(set(fields) | {"folderId"})
+        items = {
+            item["_id"]: item
+            for item in Item().filterResultsByPermission(
+                Item().find({"_id": {"$in": itemIds}}, fields=fields),
+                user,
+                AccessType.READ,
+            )
+        }
+        return [items[itemId] for itemId in itemIds if itemId in items]
+
+    def findItems(self, user, query=None, **kwargs):
+        """
+        Find the items of the entries that match a query, that a user can
+        read.
+
+        :param user: The user, or None for anonymous access.
+        :type user: dict
+        :param query: Query on the entries.
+        :type query: dict
+        :returns: list of item documents.
+        """
+        return self.getItems(self.find(query or {}, fields=["itemId"], **kwargs), user)
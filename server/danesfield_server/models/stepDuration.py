@@ -0,0 +1,66 @@
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import datetime
+
+from girder.models.model_base import Model
+
+
+class StepDuration(Model):
+    """
+    Wall time of each workflow step run, used to estimate the duration
+    of future runs.
+    """
+
+    # Number of most recent runs of a step used to estimate its duration
+    HISTORY_LENGTH = 20
+
+    def initialize(self):
+        self.name = "stepDuration"
+        self.ensureIndex(([("stepName", 1), ("created", -1)], {}))
+
+    def validate(self, doc):
+        return doc
+
+    def recordDuration(self, stepName, jobId, seconds):
+        """
+        Record the wall time of a step run.
+
+        :param stepName: The name of the step.
+        :type stepName: str (DanesfieldStep)
+        :param jobId: Identifier of the job that ran the step.
+        :type jobId: str
+        :param seconds: Wall time of the step, in seconds.
+        :type seconds: float
+        """
+        return self.save(
+            {
+                "stepName": stepName,
+                "jobId": jobId,
+                "duration": seconds,
+                "created": datetime.datetime.utcnow(),
+            }
+        )
+
+    def getAverageDurations(self):
+        """
+        Return the average wall time of the most recent runs of each step,
+        in seconds, indexed by step name.
+        """
+        results = self.collection.aggregate(
+            [
+                {"$sort": {"stepName": 1, "created": -1}},
+                {"$group": {"_id": "$stepName", "durations": {"$push": "$duration"}}},
+                {
+                    "$project": {
+                        "duration": {
+                            "$avg": {"$slice": ["$durations", self.HISTORY_LENGTH]}
+                        }
+                    }
+                },
+            ]
+        )
+        return {result["_id"]: result["duration"] for result in results}
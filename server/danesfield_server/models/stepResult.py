@@ -0,0 +1,79 @@
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import datetime
+
+from girder.models.item import Item
+from girder.models.model_base import Model
+
+
+class StepResult(Model):
+    """
+    Output items of workflow step runs, indexed by a hash of the inputs
+    of the run (see DanesfieldWorkflowStep.getCacheKey). A step whose
+    inputs match a previous run reuses its output instead of running
+    again, even for a different working set.
+    """
+
+    def initialize(self):
+        self.name = "stepResult"
+        self.ensureIndex(("key", {"unique": True}))
+
+    def validate(self, doc):
+        return doc
+
+    def recordResult(self, key, stepName, itemIds, outputPrefix=None):
+        """
+        Record the output of a step run. Replaces any previous result with
+        the same key.
+
+        :param key: Cache key of the run.
+        :type key: str
+        :param stepName: The name of the step.
+        :type stepName: str (DanesfieldStep)
+        :param itemIds: IDs of the items created by the run.
+        :type itemIds: list[ObjectId]
+        :param outputPrefix: Prefix of the names of the items, which is
+            replaced when the items are reused.
+        :type outputPrefix: str
+        """
+        now = datetime.datetime.utcnow()
+        self.collection.update_one(
+            {"key": key},
+            {
+                "$set": {
+                    "stepName": stepName,
+                    "itemIds": list(itemIds),
+                    "outputPrefix": outputPrefix,
+                    "created": now,
+                    "used": now,
+                }
+            },
+            upsert=True,
+        )
+
+    def getResult(self, key):
+        """
+        Get the result of a previous run with the same key, or None. A
+        result whose items have been removed since is removed.
+
+        :param key: Cache key of the run.
+        :type key: str
+        """
+        result = self.findOne({"key": key})
+        if result is None:
+            return None
+
+        items = list(Item().find({"_id": {"$in": result["itemIds"]}}))
+        if len(items) != len(result["itemIds"]):
+            self.remove(result)
+            return None
+
+        self.collection.update_one(
+            {"_id": result["_id"]}, {"$set": {"used": datetime.datetime.utcnow()}}
+        )
+        result["items"] = items
+        return result
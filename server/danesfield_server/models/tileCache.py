@@ -0,0 +1,282 @@
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import concurrent.futures
+import datetime
+import json
+import math
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+
+from girder import logprint
+from girder.constants import SortDir
+from girder.models.item import Item
+from girder.models.model_base import Model
+from girder.models.setting import Setting
+from girder_large_image.models.image_item import ImageItem
+
+from ..settings import PluginSettings
+
+# Parameters of the large_image tile endpoints that affect the rendering of
+# a tile, and their types
+TILE_PARAMS = {
+    "encoding": str,
+    "projection": str,
+    "style": str,
+    "edge": str,
+    "frame": int,
+    "jpegQuality": int,
+    "jpegSubsampling": int,
+    "tiffCompression": str,
+}
+
+# Parameters of the tiles of the map views of the client, which are
+# rendered when a step completes
+PREFILL_PARAMS = {"encoding": "PNG", "projection": "EPSG:3857"}
+
+# Maximum number of tiles rendered per item when a step completes
+MAX_PREFILL_TILES = 2048
+
+# Fraction of the size of the cache that remains after eviction, so that
+# eviction doesn't run on every new tile
+EVICTION_TARGET = 0.9
+
+# Threads that render tiles in the background, so that rendering doesn't
+# delay the workflow
+_prefillExecutor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix="danesfield-tile-prefill"
+)
+
+
+def _getTileRange(bounds, z):
+    """
+    Get the range of the Web Mercator tiles at a zoom level that cover a
+    bounding box, as a tuple of the form (minX, minY, maxX, maxY).
+
+    :param bounds: Bounding box of the form (west, south, east, north),
+        in degrees.
+    :type bounds: tuple[float]
+    :param z: Zoom level.
+    :type z: int
+    """
+    n = 2**z
+
+    def tileX(lon):
+        return min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+
+    def tileY(lat):
+        lat = math.radians(max(-85.0511, min(85.0511, lat)))
+        y = (1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n
+        return min(n - 1, max(0, int(y)))
+
+    west, south, east, north = bounds
+    return tileX(west), tileY(north), tileX(east), tileY(south)
+
+
+def _getBounds(item):
+    """
+    Get the bounding box of an item from its geospatial metadata, or None.
+    """
+    try:
+        coordinates = [
+            point for ring in item["geometa"]["bounds"]["coordinates"] for point in ring
+        ]
+    except (KeyError, TypeError):
+        return None
+    lons = [point[0] for point in coordinates]
+    lats = [point[1] for point in coordinates]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+class TileCache(Model):
+    """
+    Rendered map tiles of raster items, indexed by file, tile position and
+    rendering parameters such as the style. The least recently used tiles
+    are evicted when the cache exceeds its size (see
+    PluginSettings.TILE_CACHE_SIZE). The tiles of an item must be
+    invalidated when its content is replaced.
+    """
+
+    def initialize(self):
+        self.name = "tileCache"
+        self.ensureIndex(
+            (
+                [("fileId", 1), ("z", 1), ("x", 1), ("y", 1), ("params", 1)],
+                {"unique": True},
+            )
+        )
+        self.ensureIndex("itemId")
+        self.ensureIndex("used")
+        # Bytes added by this process since the cache was last evicted
+        self._addedSize = 0
+
+    def validate(self, doc):
+        return doc
+
+    def getImageArgs(self, params):
+        """
+        Get the rendering parameters from the parameters of a tile request.
+        Other parameters, such as the token, are ignored.
+
+        :param params: Request parameters.
+        :type params: dict
+        """
+        imageArgs = {}
+        for name, paramType in TILE_PARAMS.items():
+            if params.get(name) is not None:
+                imageArgs[name] = paramType(params[name])
+        return imageArgs
+
+    def _getFileId(self, item):
+        fileId = item.get("largeImage", {}).get("fileId")
+        return ObjectId(fileId) if fileId is not None else None
+
+    def getTile(self, item, z, x, y, imageArgs):
+        """
+        Get a tile of an item, rendering it if it isn't in the cache.
+
+        :param item: The item, which must be a large image.
+        :type item: dict
+        :param z: Zoom level of the tile.
+        :type z: int
+        :param x: Column of the tile.
+        :type x: int
+        :param y: Row of the tile.
+        :type y: int
+        :param imageArgs: Rendering parameters (see getImageArgs).
+        :type imageArgs: dict
+        :returns: Tuple of the form (data, MIME type).
+        """
+        fileId = self._getFileId(item)
+        key = json.dumps(imageArgs, sort_keys=True)
+        tile = self.collection.find_one_and_update(
+            {"fileId": fileId, "z": z, "x": x, "y": y, "params": key},
+            {"$set": {"used": datetime.datetime.utcnow()}},
+        )
+        if tile is not None:
+            return bytes(tile["data"]), tile["mimeType"]
+
+        data, mimeType = ImageItem().getTile(
+            item, x, y, z, mayRedirect=False, **imageArgs
+        )
+        self._addTile(item, fileId, z, x, y, key, data, mimeType)
+        return data, mimeType
+
+    def _addTile(self, item, fileId, z, x, y, key, data, mimeType):
+        maxSize = Setting().get(PluginSettings.TILE_CACHE_SIZE)
+        if not maxSize or len(data) > maxSize:
+            return
+        self.collection.update_one(
+            {"fileId": fileId, "z": z, "x": x, "y": y, "params": key},
+            {
+                "$set": {
+                    "itemId": item["_id"],
+                    "data": Binary(data),
+                    "mimeType": mimeType,
+                    "size": len(data),
+                    "used": datetime.datetime.utcnow(),
+                }
+            },
+            upsert=True,
+        )
+        self._addedSize += len(data)
+        if self._addedSize > maxSize * (1 - EVICTION_TARGET):
+            self._addedSize = 0
+            self.evict(maxSize)
+
+    def evict(self, maxSize):
+        """
+        Remove the least recently used tiles until the cache is below a
+        fraction of its size.
+
+        :param maxSize: Size of the cache, in bytes.
+        :type maxSize: int
+        :returns: The number of tiles removed.
+        """
+        result = list(
+            self.collection.aggregate(
+                [{"$group": {"_id": None, "size": {"$sum": "$size"}}}]
+            )
+        )
+        totalSize = result[0]["size"] if result else 0
+        if totalSize <= maxSize:
+            return 0
+
+        excess = totalSize - maxSize * EVICTION_TARGET
+        tileIds = []
+        for tile in self.find({}, sort=[("used", SortDir.ASCENDING)], fields=["size"]):
+            if excess <= 0:
+                break
+            tileIds.append(tile["_id"])
+            excess -= tile["size"]
+        return self.collection.delete_many({"_id": {"$in": tileIds}}).deleted_count
+
+    def invalidateItems(self, itemIds):
+        """
+        Remove the tiles of items, when their content is replaced.
+
+        :param itemIds: IDs of the items.
+        :type itemIds: list[ObjectId]
+        """
+        itemIds = [ObjectId(itemId) for itemId in itemIds]
+        if itemIds:
+            self.collection.delete_many({"itemId": {"$in": itemIds}})
+
+    def _prefillItem(self, item):
+        """
+        Render the tiles of the map views of the client that cover an item,
+        from the zoom level at which the item fits in a tile.
+        """
+        if self._getFileId(item) is None:
+            return 0
+        bounds = _getBounds(item)
+        if bounds is None:
+            return 0
+
+        levels = ImageItem().getMetadata(item, **PREFILL_PARAMS)["levels"]
+        tileRanges = [(z, _getTileRange(bounds, z)) for z in range(levels)]
+        # Skip the zoom levels below the one at which the item fits in a tile
+        while len(tileRanges) > 1 and tileRanges[1][1][:2] == tileRanges[1][1][2:]:
+            tileRanges.pop(0)
+
+        count = 0
+        for z, (minX, minY, maxX, maxY) in tileRanges:
+            levelCount = (maxX - minX + 1) * (maxY - minY + 1)
+            if count + levelCount > MAX_PREFILL_TILES:
+                break
+            for x in range(minX, maxX + 1):
+                for y in range(minY, maxY + 1):
+                    self.getTile(item, z, x, y, PREFILL_PARAMS)
+            count += levelCount
+        return count
+
+    def _prefillItems(self, itemIds):
+        for item in Item().find({"_id": {"$in": list(itemIds)}}):
+            try:
+                count = self._prefillItem(item)
+            except Exception:
+                logprint.exception(
+                    "TileCache: Error rendering tiles of item {}".format(item["_id"])
+                )
+                continue
+            if count:
+                logprint.info(
+                    "TileCache: Rendered {} tiles of item {}".format(count, item["_id"])
+                )
+
+    def prefillItems(self, itemIds):
+        """
+        Render the tiles of raster items in the background. Items that
+        aren't large images are skipped.
+
+        :param itemIds: IDs of the items.
+        :type itemIds: list[ObjectId]
+        """
+        if Setting().get(PluginSettings.TILE_CACHE_SIZE):
+            _prefillExecutor.submit(
+                self._prefillItems, [ObjectId(itemId) for itemId in itemIds]
+            )
@@ -0,0 +1,380 @@
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import datetime
+
+from pymongo import ReturnDocument
+
+from girder.models.model_base import Model
+
+from ..constants import DanesfieldStep
+
+
+class WorkflowJob(Model):
+    """
+    Shared state of running Danesfield workflow jobs.
+
+    Keeping the state in the database, rather than in the memory of the
+    Girder process that started the job, allows any Girder process to
+    handle job events and advance the workflow. All state transitions
+    use atomic updates so that concurrent processes can't lose updates.
+    """
+
+    def initialize(self):
+        self.name = "workflowJob"
+        # Look up the jobs of a working set
+        self.ensureIndex("workingSetIds.%s" % DanesfieldStep.INIT)
+        # Remove finalized jobs once they can no longer be resumed
+        self.ensureIndex(("expires", {"expireAfterSeconds": 0}))
+
+    def validate(self, doc):
+        return doc
+
+    def createWorkflowJob(
+        self,
+        jobId,
+        requestInfo,
+        workingSets,
+        outputFolder,
+        options,
+        completedSteps,
+        remainingDependencies,
+        readySteps,
+        batchId=None,
+    ):
+        """
+        Create the state of a new job.
+
+        :param jobId: Identifier of Danesfield job.
+        :type jobId: str
+        :param requestInfo: HTTP request and authorization info.
+        :type requestInfo: RequestInfo
+        :param workingSets: Working sets indexed by step name.
+        :type workingSets: dict
+        :param outputFolder: Output folder document.
+        :type outputFolder: dict
+        :param options: Processing options.
+        :type options: dict
+        :param completedSteps: Names of steps that don't need to run.
+        :type completedSteps: iterable of str
+        :param remainingDependencies: Number of dependencies that haven't
+            completed, indexed by step name.
+        :type remainingDependencies: dict
+        :param readySteps: Names of steps that are ready to run.
+        :type readySteps: iterable of str
+        :param batchId: ID of the batch of the job, if any.
+        :type batchId: ObjectId
+        """
+        now = datetime.datetime.utcnow()
+        doc = {
+            "_id": jobId,
+            # Running steps
+            "runningSteps": [],
+            # Completed steps
+            "completedSteps": list(completedSteps),
+            # Failed steps
+            "failedSteps": [],
+            # Steps that are ready to run but haven't started
+            "readySteps": list(readySteps),
+            # Number of incomplete dependencies indexed by step name
+            "remainingDependencies": remainingDependencies,
+            # Time at which the first job of each step started to run on a
+            # worker, indexed by step name
+            "stepStartTimes": {},
+            # Request info
+            "requestInfo": {
+                "userId": requestInfo.user["_id"],
+                "apiUrl": requestInfo.apiUrl,
+                "token": requestInfo.token,
+            },
+            # Working set IDs indexed by step name
+            "workingSetIds": {
+                stepName: workingSet["_id"]
+                for stepName, workingSet in workingSets.items()
+            },
+            # IDs of items containing files created by each step,
+            # indexed by step name
+            "files": {},
+            # Parsed standard output indexed by step name
+            "standardOutput": {},
+            # Incomplete last line of the standard output of each Girder
+            # job, indexed by Girder job ID
+            "outputBuffers": {},
+            # Output folder
+            "outputFolderId": outputFolder["_id"],
+            # Options
+            "options": options,
+            # For composite steps, number of jobs remaining and number
+            # of jobs that failed, indexed by step name
+            "groupResult": {},
+            # For steps running in streaming mode, the streaming
+            # dependency, the IDs of the items already processed, and
+            # whether the dependency has finished, indexed by step name
+            "streaming": {},
+            # Cache keys of the steps that run, and the prefix of the
+            # names of their output, indexed by step name
+            "cacheKeys": {},
+            # Batch to which the job belongs
+            "batchId": batchId,
+            # Whether the workflow has finished. Only jobs in which steps
+            # failed are kept once finished, until they expire.
+            "finalized": False,
+            "created": now,
+            "updated": now,
+        }
+        return self.save(doc)
+
+    def _update(self, jobId, update, query=None, returnDocument=ReturnDocument.AFTER):
+        """
+        Atomically update the state of a job and return the updated
+        document, or None if no job matches.
+        """
+        update.setdefault("$set", {})["updated"] = datetime.datetime.utcnow()
+        return self.collection.find_one_and_update(
+            dict(query or {}, _id=jobId), update, return_document=returnDocument
+        )
+
+    def addFile(self, jobId, stepName, file):
+        return self._update(
+            jobId, {"$addToSet": {"files.%s" % stepName: file["itemId"]}}
+        )
+
+    def setStandardOutput(self, jobId, stepName, output, girderJobId, partialLine):
+        """
+        Set the parsed standard output of a step, and the incomplete last
+        line of the output of a Girder job. The line is removed when it's
+        None.
+        """
+        update = {"$set": {"standardOutput.%s" % stepName: output}}
+        bufferKey = "outputBuffers.%s" % girderJobId
+        if partialLine is None:
+            update["$unset"] = {bufferKey: ""}
+        else:
+            update["$set"][bufferKey] = partialLine
+        return self._update(jobId, update)
+
+    def setCacheKey(self, jobId, stepName, key, outputPrefix):
+        cacheKey = {"key": key, "outputPrefix": outputPrefix}
+        return self._update(jobId, {"$set": {"cacheKeys.%s" % stepName: cacheKey}})
+
+    def setGroupResult(self, jobId, stepName, numJobs):
+        return self._update(
+            jobId,
+            {
+                "$set": {
+                    "groupResult.%s" % stepName: {"remaining": numJobs, "failed": 0}
+                }
+            },
+        )
+
+    def groupJobCompleted(self, jobId, stepName, successful):
+        """
+        Record that a job in a composite step completed. Returns the
+        updated job state.
+        """
+        key = "groupResult.%s" % stepName
+        return self._update(
+            jobId,
+            {
+                "$inc": {
+                    key + ".remaining": -1,
+                    key + ".failed": 0 if successful else 1,
+                }
+            },
+        )
+
+    def addReadySteps(self, jobId, stepNames):
+        return self._update(
+            jobId, {"$addToSet": {"readySteps": {"$each": list(stepNames)}}}
+        )
+
+    def startStep(self, jobId, stepName):
+        """
+        Mark a ready step as running. Returns None if the step isn't
+        ready, for example because it was already started, so that only
+        one process runs it.
+        """
+        return self._update(
+            jobId,
+            {
+                "$pull": {"readySteps": stepName},
+                "$addToSet": {"runningSteps": stepName},
+            },
+            query={"readySteps": stepName},
+        )
+
+    def setStepStartTime(self, jobId, stepName):
+        """
+        Record the time at which a running step started to run on a
+        worker, rather than when it was sent to the queue, unless it's
+        already recorded, for example by another job of a composite step.
+        """
+        return self._update(
+            jobId,
+            {"$set": {"stepStartTimes.%s" % stepName: datetime.datetime.utcnow()}},
+            query={
+                "runningSteps": stepName,
+                "stepStartTimes.%s" % stepName: {"$exists": False},
+            },
+        )
+
+    def finishStep(self, jobId, stepName, successful, successors=(), workingSet=None):
+        """
+        Mark a running step as completed or failed, and remove data
+        applicable only while the step is running. When the step
+        succeeds, record its working set, if any, and decrement the number
+        of remaining dependencies of its successors in the same update.
+
+        Returns the job state from before the update, or None if the
+        step isn't running, so that only one process handles its
+        completion. Successors whose number of remaining dependencies was
+        one in the returned state have become ready.
+        """
+        update = {
+            "$pull": {"runningSteps": stepName},
+            "$addToSet": {
+                ("completedSteps" if successful else "failedSteps"): stepName
+            },
+            "$unset": {
+                "files.%s" % stepName: "",
+                "groupResult.%s" % stepName: "",
+                "streaming.%s" % stepName: "",
+            },
+        }
+        if successful and workingSet is not None:
+            update["$set"] = {"workingSetIds.%s" % stepName: workingSet["_id"]}
+        if successful and successors:
+            update["$inc"] = {
+                "remainingDependencies.%s" % successor: -1 for successor in successors
+            }
+        return self._update(
+            jobId,
+            update,
+            query={"runningSteps": stepName},
+            returnDocument=ReturnDocument.BEFORE,
+        )
+
+    def startStreamingStep(self, jobId, stepName, dependency):
+        """
+        Mark a step as running in streaming mode. Returns None if the
+        dependency isn't running, or if the step was already started,
+        finished or made ready.
+        """
+        return self._update(
+            jobId,
+            {
+                "$addToSet": {"runningSteps": stepName},
+                "$set": {
+                    "streaming.%s"
+                    % stepName: {
+                        "dependency": dependency,
+                        "consumedItems": [],
+                        "done": False,
+                    },
+                    "groupResult.%s" % stepName: {"remaining": 0, "failed": 0},
+                },
+            },
+            query={
+                "runningSteps": {"$eq": dependency, "$ne": stepName},
+                "readySteps": {"$ne": stepName},
+                "completedSteps": {"$ne": stepName},
+                "failedSteps": {"$ne": stepName},
+            },
+        )
+
+    def claimStreamingItems(self, jobId, stepName, itemIds):
+        """
+        Record that a step in streaming mode starts a job to process a
+        group of items. Returns None if any of the items was already
+        processed, or if the streaming dependency has finished, so that
+        only one process starts the job.
+        """
+        key = "streaming.%s" % stepName
+        return self._update(
+            jobId,
+            {
+                "$addToSet": {key + ".consumedItems": {"$each": list(itemIds)}},
+                "$inc": {"groupResult.%s.remaining" % stepName: 1},
+            },
+            query={
+                key + ".consumedItems": {"$nin": list(itemIds)},
+                key + ".done": False,
+            },
+        )
+
+    def finishStreaming(self, jobId, stepName, successful):
+        """
+        Record that the streaming dependency of a step has finished. When
+        the dependency failed, the step fails once its jobs complete.
+        Returns None if this was already recorded.
+        """
+        key = "streaming.%s" % stepName
+        return self._update(
+            jobId,
+            {
+                "$set": {key + ".done": True},
+                "$inc": {"groupResult.%s.failed" % stepName: 0 if successful else 1},
+            },
+            query={key + ".done": False},
+        )
+
+    def setFinalized(self, jobId, expires):
+        """
+        Mark a job as finished, and set the time after which it's removed.
+        """
+        return self._update(jobId, {"$set": {"finalized": True, "expires": expires}})
+
+    def resumeJob(
+        self, jobId, stepNames, requestInfo, remainingDependencies, readySteps
+    ):
+        """
+        Reset the state of steps of a finalized job, so that they run
+        again. Returns None if the job isn't finalized, for example
+        because it was already resumed.
+
+        :param stepNames: Names of the steps to reset.
+        :type stepNames: iterable of str
+        :param requestInfo: HTTP request and authorization info used by
+            the resumed steps.
+        :type requestInfo: RequestInfo
+        :param remainingDependencies: Number of dependencies that haven't
+            completed, indexed by step name.
+        :type remainingDependencies: dict
+        :param readySteps: Names of steps that are ready to run.
+        :type readySteps: iterable of str
+        """
+        unset = {"expires": ""}
+        for stepName in stepNames:
+            for field in (
+                "cacheKeys",
+                "files",
+                "groupResult",
+                "streaming",
+                "standardOutput",
+                "stepStartTimes",
+            ):
+                unset["%s.%s" % (field, stepName)] = ""
+
+        return self._update(
+            jobId,
+            {
+                "$set": {
+                    "finalized": False,
+                    "runningSteps": [],
+                    "failedSteps": [],
+                    "readySteps": list(readySteps),
+                    "remainingDependencies": remainingDependencies,
+                    "requestInfo": {
+                        "userId": requestInfo.user["_id"],
+                        "apiUrl": requestInfo.apiUrl,
+                        "token": requestInfo.token,
+                    },
+                    "outputBuffers": {},
+                },
+                "$unset": unset,
+            },
+            query={"finalized": True},
+        )
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import re
+
+
+class OutputParser:
+    """
+    Class to extract a compact result from the standard output of a step.
+
+    The output is parsed line by line as the jobs of the step log it, so
+    that the full log is never loaded. The result is stored with the job
+    data, so it must be small and JSON-compatible.
+    """
+
+    def parse(self, lines, result):
+        """
+        Parse lines of output. Subclasses must implement this method.
+
+        :param lines: Complete lines of output.
+        :type lines: list[str]
+        :param result: The result of parsing the previous lines, or None.
+        :returns: The updated result.
+        """
+        raise NotImplementedError("Implement in subclass")
+
+
+class RegexOutputParser(OutputParser):
+    """
+    Output parser that extracts a list of regular expression matches,
+    at most one per line.
+    """
+
+    def __init__(self, pattern, group=0, maxMatches=None):
+        """
+        :param pattern: Regular expression to search for in each line.
+        :type pattern: str
+        :param group: The group of the match to extract.
+        :type group: int or str
+        :param maxMatches: Maximum number of matches to keep. Matches in
+        later lines are ignored.
+        :type maxMatches: int
+        """
+        self.pattern = re.compile(pattern)
+        self.group = group
+        self.maxMatches = maxMatches
+
+    def parse(self, lines, result):
+        result = list(result or [])
+        for line in lines:
+            if self.maxMatches is not None and len(result) >= self.maxMatches:
+                break
+            match = self.pattern.search(line)
+            if match:
+                result.append(match.group(self.group))
+        return result
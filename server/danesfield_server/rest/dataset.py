@@ -4,15 +4,38 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
+import collections
+import datetime
+import json
+import threading
+
+import cherrypy
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import OperationFailure
 
 from girder.api import access
 from girder.api.describe import autoDescribeRoute, Description
-from girder.constants import AccessType
-from girder.api.rest import Resource
+from girder.constants import AccessType, TokenScope
+from girder.api.rest import Resource, setRawResponse, setResponseHeader
+from girder.exceptions import RestException
 from girder.models.item import Item
-from geometa import geometa_search_handler
+from large_image.exceptions import TileSourceException
+from ..models.dataset import Dataset, SEARCH_RELATIONS
+from ..models.tileCache import TileCache
 from ..models.workingSet import WorkingSet
+from ..utilities import simplifyGeometry
+
+# Number of datasets per page of search results
+DEFAULT_SEARCH_LIMIT = 100
+MAX_SEARCH_LIMIT = 1000
+
+# Encoded responses of the bounds endpoint, by ETag. The ETag includes the
+# generation of the dataset catalog, so responses for previous generations
+# are never served.
+BOUNDS_CACHE_SIZE = 8
+_boundsCache = collections.OrderedDict()
+_boundsCacheLock = threading.Lock()
 
 
 class DatasetResource(Resource):
@@ -24,6 +47,7 @@ class DatasetResource(Resource):
         self.route("GET", ("search",), self.search)
         self.route("GET", (":id",), self.get)
         self.route("GET", ("bounds",), self.getAllBounds)
+        self.route("GET", (":id", "tiles", "zxy", ":z", ":x", ":y"), self.getTile)
         self.route(
             "GET",
             (
@@ -40,36 +64,7 @@ class DatasetResource(Resource):
     )
     @access.user
     def getAll(self, params):
-        return self._getAll()
-
-    def _getAll(self):
-        datasetItems = list(
-            Item().find(
-                {
-                    "$and": [
-                        {"name": {"$regex": ".NTF$"}},
-                        {
-                            "$or": [
-                                {
-                                    "geometa.driver": {
-                                        "$in": [
-                                            "GeoJSON",
-                                            "GeoTIFF",
-                                            "OBJ",
-                                            "National Imagery Transmission Format",
-                                        ]
-                                    }
-                                },
-                                {
-                                    "geometa.subDatasets.driver": "National Imagery Transmission Format"
-                                },
-                            ]
-                        },
-                    ]
-                }
-            )
-        )
-        return self.filterInputNTF(datasetItems)
+        return Dataset().findItems(self.getCurrentUser())
 
     @autoDescribeRoute(
         Description("")
@@ -82,18 +77,95 @@ class DatasetResource(Resource):
         return item
 
     @autoDescribeRoute(
-        Description("")
+        Description("Get the names and footprints of the datasets.")
+        .notes(
+            "The response has an ETag that changes when the datasets change. "
+            "Send it in the If-None-Match header to get a 304 response when "
+            "they haven't changed."
+        )
+        .param(
+            "tolerance",
+            "Tolerance of the simplification of the footprints, in degrees. "
+            "Footprints aren't simplified by default.",
+            required=False,
+            dataType="number",
+            default=0,
+        )
         .errorResponse()
         .errorResponse("Read access was denied on the item.", 403)
     )
     @access.user
-    def getAllBounds(self, params):
-        datasetItems = self._getAll()
-        datasetBounds = [
-            {"name": item["name"], "bounds": item["geometa"]["bounds"]}
-            for item in datasetItems
-        ]
-        return datasetBounds
+    def getAllBounds(self, tolerance, params):
+        if tolerance < 0:
+            raise RestException("Tolerance must not be negative.")
+        generation = Dataset().getGeneration()
+        etag = '"{}-{}"'.format(generation, tolerance)
+        setResponseHeader("ETag", etag)
+        setResponseHeader("Cache-Control", "no-cache")
+        setRawResponse()
+
+        if etag in (
+            tag.strip()
+            for tag in cherrypy.request.headers.get("If-None-Match", "").split(",")
+        ):
+            cherrypy.response.status = 304
+            return b""
+
+        with _boundsCacheLock:
+            body = _boundsCache.get(etag)
+        if body is None:
+            datasetBounds = [
+                {
+                    "name": entry["name"],
+                    "bounds": (
+                        simplifyGeometry(entry["footprint"], tolerance)
+                        if tolerance and entry["footprint"]
+                        else entry["footprint"]
+                    ),
+                }
+                for entry in Dataset().find({}, fields=["name", "footprint"])
+            ]
+            body = json.dumps(datasetBounds).encode()
+            with _boundsCacheLock:
+                _boundsCache[etag] = body
+                while len(_boundsCache) > BOUNDS_CACHE_SIZE:
+                    _boundsCache.popitem(last=False)
+
+        setResponseHeader("Content-Type", "application/json")
+        return body
+
+    @access.public(cookie=True, scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description("Get a map tile of a raster dataset.")
+        .notes(
+            "Takes the parameters of the large_image tile endpoints, such as "
+            "encoding, projection and style. Tiles are served from the tile "
+            "cache when they have already been rendered."
+        )
+        .modelParam("id", model=Item, level=AccessType.READ)
+        .param("z", "The zoom level of the tile.", paramType="path", dataType="integer")
+        .param("x", "The column of the tile.", paramType="path", dataType="integer")
+        .param("y", "The row of the tile.", paramType="path", dataType="integer")
+        .produces(["image/png", "image/jpeg", "image/tiff"])
+        .errorResponse("The dataset isn't a tiled image.", 404)
+        .errorResponse("Read access was denied on the item.", 403)
+    )
+    def getTile(self, item, z, x, y, params):
+        if "largeImage" not in item:
+            raise RestException("The dataset isn't a tiled image.", code=404)
+        if x < 0 or y < 0 or z < 0:
+            raise RestException("x, y, and z must be positive integers.")
+        try:
+            imageArgs = TileCache().getImageArgs(params)
+        except ValueError:
+            raise RestException("Invalid tile parameters.")
+        try:
+            data, mimeType = TileCache().getTile(item, z, x, y, imageArgs)
+        except TileSourceException as e:
+            raise RestException(str(e), code=404)
+        setResponseHeader("Content-Type", mimeType)
+        setRawResponse()
+        return data
 
     @autoDescribeRoute(
         Description("")
@@ -112,22 +184,116 @@ class DatasetResource(Resource):
 
     @access.public
     @autoDescribeRoute(
-        Description("")
-        .param("geojson", "", required=True)
-        .param("relation", "", required=True)
+        Description("Search the source imagery datasets.")
+        .notes(
+            "Results are paginated: pass the cursor of a page to get the next "
+            "page. The cursor is null on the last page. Only the datasets that "
+            "the user can read are returned, so a page may have fewer datasets "
+            "than the limit."
+        )
+        .jsonParam(
+            "geojson",
+            "GeoJSON geometry, feature or feature collection that the "
+            "footprints of the datasets are related to.",
+            required=False,
+            requireObject=True,
+        )
+        .param(
+            "relation",
+            "Relation of the footprints of the datasets to the geometry.",
+            required=False,
+            default="intersects",
+            enum=sorted(SEARCH_RELATIONS),
+        )
+        .param("start", "Earliest acquisition date (YYYY-MM-DD).", required=False)
+        .param("end", "Latest acquisition date (YYYY-MM-DD).", required=False)
+        .jsonParam(
+            "modalities",
+            'Modalities of the datasets, such as ["MSI", "PAN"].',
+            required=False,
+            requireArray=True,
+        )
+        .param("cursor", "Cursor of the page.", required=False)
+        .param(
+            "limit",
+            "Maximum number of datasets per page.",
+            required=False,
+            dataType="integer",
+            default=DEFAULT_SEARCH_LIMIT,
+        )
+        .jsonParam(
+            "fields",
+            "Fields of the datasets to return. Defaults to all fields.",
+            required=False,
+            requireArray=True,
+        )
         .errorResponse()
-        .errorResponse("Read access was denied on the item.", 403)
     )
-    def search(self, geojson, relation):
-        return self.filterInputNTF(
-            geometa_search_handler({"geojson": geojson, "relation": relation})
-        )
+    def search(self, geojson, relation, start, end, modalities, cursor, limit, fields):
+        geometry = self._getGeometry(geojson) if geojson is not None else None
+        if (
+            geometry is not None
+            and relation == "within"
+            and geometry.get("type") not in ("Polygon", "MultiPolygon")
+        ):
+            raise RestException("Only polygons can contain datasets.")
+        if not 0 < limit <= MAX_SEARCH_LIMIT:
+            raise RestException(
+                "Limit must be between 1 and {}.".format(MAX_SEARCH_LIMIT)
+            )
+        if cursor is not None:
+            try:
+                cursor = ObjectId(cursor)
+            except InvalidId:
+                raise RestException("Invalid cursor.")
+        start = self._parseDate(start, "start")
+        end = self._parseDate(end, "end")
+        if end is not None:
+            # The end date is included
+            end += datetime.timedelta(days=1)
+
+        try:
+            # Get an extra entry to find whether there's a next page
+            entries = list(
+                Dataset().search(
+                    geometry=geometry,
+                    relation=relation,
+                    start=start,
+                    end=end,
+                    modalities=modalities,
+                    cursor=cursor,
+                    limit=limit + 1,
+                )
+            )
+        except OperationFailure as e:
+            raise RestException("Invalid geometry: {}".format(e))
+
+        return {
+            "datasets": Dataset().getItems(
+                entries[:limit], self.getCurrentUser(), fields=fields
+            ),
+            "cursor": str(entries[limit - 1]["_id"]) if len(entries) > limit else None,
+        }
+
+    def _parseDate(self, value, name):
+        if value is None:
+            return None
+        try:
+            return datetime.datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise RestException("Invalid {} date: {}".format(name, value))
 
-    def filterInputNTF(self, datasets):
-        filteredDatasets = []
-        for dataset in datasets:
-            if not dataset["name"].endswith(".NTF"):
-                continue
-            if "M1BS" in dataset["name"] or "P1BS" in dataset["name"]:
-                filteredDatasets.append(dataset)
-        return filteredDatasets
+    def _getGeometry(self, geojson):
+        """
+        Get the geometry of a GeoJSON object, such as a feature.
+        """
+        if geojson.get("type") == "Feature":
+            return geojson.get("geometry") or {}
+        if geojson.get("type") == "FeatureCollection":
+            return {
+                "type": "GeometryCollection",
+                "geometries": [
+                    feature.get("geometry") for feature in geojson.get("features", [])
+                ],
+            }
+        return geojson
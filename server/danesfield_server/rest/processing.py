@@ -10,15 +10,22 @@
 from danesfield_server.constants import DanesfieldStep
 import time
 
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
 from girder.api import access
 from girder.api.describe import autoDescribeRoute, Description
 from girder.api.rest import Resource, getApiUrl, getCurrentToken
+from girder.exceptions import AccessException, RestException
 from girder.models.collection import Collection
 from girder.models.folder import Folder
 from girder.models.user import User
 
+from ..models.batch import Batch
+from ..models.workflowJob import WorkflowJob
 from ..models.workingSet import WorkingSet
 from ..request_info import RequestInfo
+from ..workflow import DanesfieldWorkflowException
 from ..workflow_manager import DanesfieldWorkflowManager
 
 
@@ -32,7 +39,11 @@ class ProcessingResource(Resource):
 
         self.resourceName = "processing"
 
+        self.route("GET", ("plan",), self.plan)
         self.route("POST", ("process",), self.process)
+        self.route("POST", ("resume",), self.resume)
+        self.route("POST", ("batch",), self.processBatch)
+        self.route("GET", ("batch", ":id"), self.getBatch)
         self.route("POST", ("setPointCloud",), self.setPointCloud)
 
     def _outputFolder(self, workingSet):
@@ -41,6 +52,14 @@ class ProcessingResource(Resource):
         necessary. Creates a folder named by the initial working set
         and a timestamp.
         """
+        return self._outputFolders([workingSet])[0]
+
+    def _outputFolders(self, workingSets):
+        """
+        Return output folder documents for several working sets, as
+        _outputFolder() does. Folders of working sets with the same name
+        are numbered.
+        """
         # FIXME: Folder is accessible only to admin
         adminUser = User().getAdmins().next()
         collection = Collection().createCollection(
@@ -52,15 +71,63 @@ class ProcessingResource(Resource):
         )
 
         timestamp = str(time.time()).split(".")[0]
-        folderName = "{}-{}".format(workingSet["name"], timestamp)
-        folder = Folder().createFolder(
-            parent=collection,
-            name=folderName,
-            parentType="collection",
-            public=False,
-            creator=adminUser,
+        folderNames = []
+        counts = {}
+        for workingSet in workingSets:
+            folderName = "{}-{}".format(workingSet["name"], timestamp).strip()
+            # Working sets may have the same name
+            counts[folderName] = counts.get(folderName, 0) + 1
+            if counts[folderName] > 1:
+                folderName = "{}-{}".format(folderName, counts[folderName])
+            folderNames.append(folderName)
+
+        return [
+            Folder().createFolder(
+                parent=collection,
+                name=folderName,
+                parentType="collection",
+                public=False,
+                creator=adminUser,
+                reuseExisting=True,
+            )
+            for folderName in folderNames
+        ]
+
+    @access.user
+    @autoDescribeRoute(
+        Description("Plan the processing workflow without running it.")
+        .notes(
+            """
+Returns, for each step, whether it would run or be skipped because its
+working set already exists, the estimated number of jobs, the size of
+its input files in bytes and its estimated duration in seconds, from the
+most recent runs of the step. Input sizes of steps that consume the
+output of other steps aren't known before the workflow runs and are
+null. Nothing is created or run.
+"""
+        )
+        .modelParam(
+            "workingSet",
+            "The ID of the working set.",
+            model=WorkingSet,
+            paramType="query",
+        )
+        .jsonParam(
+            "options",
+            "Processing options keyed by step name.",
+            requireObject=True,
+            required=False,
         )
-        return folder
+        .errorResponse()
+    )
+    def plan(self, workingSet, options, params):
+        """
+        Plan the processing workflow without running it.
+        """
+        try:
+            return DanesfieldWorkflowManager.instance().planJob(workingSet, options)
+        except DanesfieldWorkflowException as e:
+            raise RestException(str(e))
 
     @access.user
     @autoDescribeRoute(
@@ -120,6 +187,172 @@ in the **options** parameter. For example:\n
         jobId = workflowManager.initJob(requestInfo, workingSet, outputFolder, options)
         workflowManager.advance(jobId=jobId)
 
+    @access.user
+    @autoDescribeRoute(
+        Description("Resume the processing workflow after a failure.")
+        .notes(
+            """
+Runs the steps that failed in a job, and the steps that depend on them,
+again. Steps that completed aren't run again. Failed jobs can be resumed
+for 30 days.
+"""
+        )
+        .param("jobId", "The ID of the job.", paramType="query")
+        .errorResponse()
+        .errorResponse("No failed job to resume.", 400)
+        .errorResponse("Access was denied on the job.", 403)
+    )
+    def resume(self, jobId, params):
+        """
+        Resume the processing workflow after a failure.
+        """
+        user = self.getCurrentUser()
+        jobData = WorkflowJob().load(jobId, force=True, objectId=False)
+        if jobData is None:
+            raise RestException("Invalid job ID: {}".format(jobId))
+        if jobData["requestInfo"]["userId"] != user["_id"] and not user["admin"]:
+            raise AccessException("Access was denied on the job.")
+
+        requestInfo = RequestInfo(
+            user=user, apiUrl=getApiUrl(), token=getCurrentToken()
+        )
+
+        workflowManager = DanesfieldWorkflowManager.instance()
+        try:
+            workflowManager.resumeJob(requestInfo, jobId)
+        except DanesfieldWorkflowException as e:
+            raise RestException(str(e))
+        workflowManager.advance(jobId=jobId)
+
+        return {"jobId": jobId}
+
+    @access.user
+    @autoDescribeRoute(
+        Description("Run the processing workflow on several working sets.")
+        .notes(
+            """
+Each element of **jobs** is an object with the ID of a working set and
+optional options, which override the options in **options** step by
+step. For example:\n
+```
+[
+    {"workingSet": "5b2d1c...", "options": {"fit-dtm": {"iterations": 50}}},
+    {"workingSet": "5b2d1d..."}
+]
+```
+Identical submissions, with the same working set and options, run once.
+A working set can't be submitted with different options.
+At most **maxRunningJobs** jobs of the batch run at a time.
+"""
+        )
+        .jsonParam("jobs", "The working sets to process.", requireArray=True)
+        .jsonParam(
+            "options",
+            "Processing options keyed by step name, used by all jobs.",
+            requireObject=True,
+            required=False,
+        )
+        .param(
+            "maxRunningJobs",
+            "Maximum number of jobs running at a time.",
+            dataType="integer",
+            required=False,
+            default=4,
+        )
+        .errorResponse()
+    )
+    def processBatch(self, jobs, options, maxRunningJobs, params):
+        """
+        Run the processing workflow on several working sets.
+        """
+        if maxRunningJobs < 1:
+            raise RestException("maxRunningJobs must be positive.")
+
+        workingSetIds = []
+        for job in jobs:
+            if not isinstance(job, dict) or "workingSet" not in job:
+                raise RestException("Each job must have a working set.")
+            if not isinstance(job.get("options", {}), dict):
+                raise RestException("Job options must be an object.")
+            try:
+                workingSetIds.append(ObjectId(job["workingSet"]))
+            except (InvalidId, TypeError):
+                raise RestException(
+                    "Invalid working set ID: {}".format(job["workingSet"])
+                )
+
+        # Load all working sets at once
+        workingSets = {
+            str(workingSet["_id"]): workingSet
+            for workingSet in WorkingSet().find({"_id": {"$in": workingSetIds}})
+        }
+
+        # Merge options and remove duplicate submissions. Jobs of the same
+        # working set would share their output, so a working set may only
+        # be submitted once.
+        submissions = {}
+        for job in jobs:
+            workingSet = workingSets.get(str(job["workingSet"]))
+            if workingSet is None:
+                raise RestException(
+                    "Invalid working set ID: {}".format(job["workingSet"])
+                )
+            jobOptions = dict(options or {})
+            for stepName, stepOptions in job.get("options", {}).items():
+                if isinstance(stepOptions, dict) and isinstance(
+                    jobOptions.get(stepName), dict
+                ):
+                    stepOptions = dict(jobOptions[stepName], **stepOptions)
+                jobOptions[stepName] = stepOptions
+            submission = submissions.setdefault(
+                str(workingSet["_id"]), (workingSet, jobOptions)
+            )
+            if submission[1] != jobOptions:
+                raise RestException(
+                    "Working set {} is submitted more than once with "
+                    "different options.".format(workingSet["_id"])
+                )
+
+        outputFolders = self._outputFolders(
+            [workingSet for workingSet, _ in submissions.values()]
+        )
+
+        requestInfo = RequestInfo(
+            user=self.getCurrentUser(), apiUrl=getApiUrl(), token=getCurrentToken()
+        )
+
+        workflowManager = DanesfieldWorkflowManager.instance()
+        try:
+            batch = workflowManager.initBatch(
+                requestInfo,
+                [
+                    (workingSet, outputFolder, jobOptions)
+                    for (workingSet, jobOptions), outputFolder in zip(
+                        submissions.values(), outputFolders
+                    )
+                ],
+                maxRunningJobs,
+            )
+        except DanesfieldWorkflowException as e:
+            raise RestException(str(e))
+        workflowManager.startBatchJobs(batch["_id"])
+
+        return workflowManager.getBatchProgress(Batch().load(batch["_id"], force=True))
+
+    @access.user
+    @autoDescribeRoute(
+        Description("Get the progress of a batch of processing jobs.")
+        .modelParam("id", "The ID of the batch.", model=Batch, force=True)
+        .errorResponse()
+        .errorResponse("Access was denied on the batch.", 403)
+    )
+    def getBatch(self, batch, params):
+        user = self.getCurrentUser()
+        if batch["userId"] != user["_id"] and not user["admin"]:
+            raise AccessException("Access was denied on the batch.")
+
+        return DanesfieldWorkflowManager.instance().getBatchProgress(batch)
+
     @access.user
     @autoDescribeRoute(
         Description(
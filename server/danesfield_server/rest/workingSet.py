@@ -7,12 +7,15 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
+import collections
+
 from bson.objectid import ObjectId
 from girder.api import access
 from girder.api.describe import autoDescribeRoute, Description
 from girder.api.rest import Resource
 from girder.models.item import Item
 from girder.models.folder import Folder
+from ..models.dataset import Dataset, parseSourceImageName
 from ..models.workingSet import WorkingSet
 
 
@@ -108,47 +111,73 @@ class WorkingSetResource(Resource):
         return
 
     def normalizeworkingSetDatasets(self, datasetIds):
-        datasetIdsSet = set(datasetIds)
-        for datasetId in datasetIds:
-            datasetItem = Item().findOne({"_id": ObjectId(datasetId)})
-            # first remove all tar items
-            if datasetItem["name"].endswith(".tar"):
-                datasetIdsSet.remove(datasetId)
-            elif datasetItem["name"].endswith(".NTF"):
-                # Try to include coresponding MSI or PAN item
-                msiOrPans = list(
-                    Item().find(
-                        {
-                            "$and": [
-                                {"_id": {"$ne": ObjectId(datasetId)}},
-                                {
-                                    "name": {
-                                        "$regex": "^"
-                                        + datasetItem["name"].split("-")[0]
-                                        + ".*.NTF$"
-                                    }
-                                },
-                            ]
-                        }
-                    )
-                )
-                if len(msiOrPans) == 1:
-                    datasetIdsSet.add(str(msiOrPans[0]["_id"]))
-
-        for datasetId in list(datasetIdsSet):
-            datasetItem = Item().findOne({"_id": ObjectId(datasetId)})
-            if datasetItem["name"].endswith(".NTF"):
-                # Include conresponding TAR items
-                tarItem = Item().findOne(
-                    {
-                        "name": datasetItem["name"].replace(".NTF", ".tar"),
-                        "folderId": datasetItem["folderId"],
-                    }
-                )
-                if tarItem:
-                    datasetIdsSet.add(str(tarItem["_id"]))
-
-        return list(datasetIdsSet)
+        """
+        Remove the tar items of a list of datasets, then add the MSI or PAN
+        image of the scene of each image when there's exactly one, and the
+        tar item of each image. Items that don't exist are removed.
+
+        :param datasetIds: IDs of the datasets.
+        :type datasetIds: list[str]
+        :returns: list of dataset IDs.
+        """
+        items = {
+            str(item["_id"]): item
+            for item in Item().find(
+                {"_id": {"$in": [ObjectId(datasetId) for datasetId in datasetIds]}},
+                fields=["name", "folderId"],
+            )
+        }
+        images = [item for item in items.values() if item["name"].endswith(".NTF")]
+        scenePrefixes = {
+            image["_id"]: parseSourceImageName(image["name"])["scenePrefix"]
+            for image in images
+        }
+
+        # Images of the scenes of the images, by scene prefix
+        sceneImages = collections.defaultdict(list)
+        if scenePrefixes:
+            for entry in Dataset().find(
+                {"scenePrefix": {"$in": list(set(scenePrefixes.values()))}},
+                fields=["itemId", "name", "folderId", "scenePrefix"],
+            ):
+                sceneImages[entry["scenePrefix"]].append(entry)
+
+        datasets = {
+            datasetId: item
+            for datasetId, item in items.items()
+            if not item["name"].endswith(".tar")
+        }
+        for image in images:
+            companions = [
+                entry
+                for entry in sceneImages[scenePrefixes[image["_id"]]]
+                if entry["itemId"] != image["_id"]
+            ]
+            if len(companions) == 1:
+                datasets[str(companions[0]["itemId"])] = {
+                    "_id": companions[0]["itemId"],
+                    "name": companions[0]["name"],
+                    "folderId": companions[0]["folderId"],
+                }
+
+        # Include the tar items of the images
+        tarKeys = {
+            (item["folderId"], item["name"].replace(".NTF", ".tar"))
+            for item in datasets.values()
+            if item["name"].endswith(".NTF")
+        }
+        if tarKeys:
+            for tarItem in Item().find(
+                {
+                    "folderId": {"$in": list({folderId for folderId, _ in tarKeys})},
+                    "name": {"$in": list({name for _, name in tarKeys})},
+                },
+                fields=["name", "folderId"],
+            ):
+                if (tarItem["folderId"], tarItem["name"]) in tarKeys:
+                    datasets[str(tarItem["_id"])] = tarItem
+
+        return list(datasets)
 
     @autoDescribeRoute(
         Description("")
@@ -158,53 +187,105 @@ class WorkingSetResource(Resource):
     )
     @access.user
     def getEvaluationItems(self, workingSet, params):
-        user = self.getCurrentUser()
+        evaluationItems, childrenEvaluationItems = self._aggregateEvaluationItems(
+            workingSet
+        )
         return {
-            "childrenWorkingSetEvaluationItems": self.getChildrenWorkingSetEvaluationItems(
-                user, workingSet
-            ),
-            "evaluationItems": self.getWorkingSetEvaluationItems(user, workingSet),
+            "childrenWorkingSetEvaluationItems": childrenEvaluationItems,
+            "evaluationItems": evaluationItems,
         }
 
-    def getChildrenWorkingSetEvaluationItems(self, user, workingSet):
-        childrenWorkingSets = list(
-            WorkingSet().find({"parentWorkingSetId": workingSet["_id"]})
-        )
-        if not len(childrenWorkingSets):
-            return []
-        childrenWorkingSetevaluationItems = []
-        for childWorkingSet in childrenWorkingSets:
-            childWorkingSetEvaluationItems = self.getWorkingSetEvaluationItems(
-                user, childWorkingSet
-            )
-            for resultItem in list(childWorkingSetEvaluationItems):
-                existingSameNameItems = filter(
-                    lambda item: item["name"] == resultItem["name"],
-                    childrenWorkingSetevaluationItems,
-                )
-                if existingSameNameItems:
-                    childrenWorkingSetevaluationItems.remove(existingSameNameItems[0])
-                childrenWorkingSetevaluationItems.append(resultItem)
-        return childrenWorkingSetevaluationItems
-
-    def getWorkingSetEvaluationItems(self, user, workingSet):
-        datasetItem = Item().findOne({"_id": ObjectId(workingSet["datasetIds"][0])})
-        if not datasetItem:
-            return []
-        stepResultFolder = Folder().findOne({"_id": datasetItem["folderId"]})
-        if stepResultFolder["name"] in evaluationMapping:
-            regexes = evaluationMapping[stepResultFolder["name"]]
-            return list(
-                Item().find(
-                    {
-                        "$and": [
-                            {"folderId": stepResultFolder["_id"]},
-                            {"$or": [{"name": {"$regex": regex}} for regex in regexes]},
-                        ]
-                    }
-                )
-            )
-        return []
+    def _aggregateEvaluationItems(self, workingSet):
+        """
+        Get the evaluation items of a working set and of its children, in
+        one aggregation. The evaluation items of a working set are the
+        items of the output folder of its first dataset that match
+        evaluationMapping. The items of the children are de-duplicated by
+        name, keeping the item of the last child.
+
+        :returns: Tuple of the form (items of the working set, items of
+            the children).
+        """
+        pipeline = [
+            {
+                "$match": {
+                    "$or": [
+                        {"_id": workingSet["_id"]},
+                        {"parentWorkingSetId": workingSet["_id"]},
+                    ]
+                }
+            },
+            {"$sort": {"_id": 1}},
+            {
+                "$project": {
+                    # Dataset IDs are stored as strings by the REST API
+                    "datasetId": {
+                        "$convert": {
+                            "input": {"$arrayElemAt": ["$datasetIds", 0]},
+                            "to": "objectId",
+                            "onError": None,
+                            "onNull": None,
+                        }
+                    },
+                    "isChild": {"$ne": ["$_id", workingSet["_id"]]},
+                }
+            },
+            {
+                "$lookup": {
+                    "from": Item().name,
+                    "localField": "datasetId",
+                    "foreignField": "_id",
+                    "as": "dataset",
+                }
+            },
+            {"$unwind": "$dataset"},
+            {
+                "$lookup": {
+                    "from": Folder().name,
+                    "localField": "dataset.folderId",
+                    "foreignField": "_id",
+                    "as": "folder",
+                }
+            },
+            {"$unwind": "$folder"},
+            {"$match": {"folder.name": {"$in": list(evaluationMapping)}}},
+            {
+                "$lookup": {
+                    "from": Item().name,
+                    "localField": "folder._id",
+                    "foreignField": "folderId",
+                    "as": "item",
+                }
+            },
+            {"$unwind": {"path": "$item", "includeArrayIndex": "itemIndex"}},
+            {
+                "$match": {
+                    "$or": [
+                        {"folder.name": folderName, "item.name": {"$regex": regex}}
+                        for folderName, regexes in evaluationMapping.items()
+                        for regex in regexes
+                    ]
+                }
+            },
+            {"$sort": {"_id": 1, "itemIndex": 1}},
+            {
+                "$group": {
+                    "_id": {"isChild": "$isChild", "name": "$item.name"},
+                    "item": {"$last": "$item"},
+                    "workingSetId": {"$last": "$_id"},
+                    "itemIndex": {"$last": "$itemIndex"},
+                }
+            },
+            {"$sort": {"workingSetId": 1, "itemIndex": 1}},
+        ]
+        evaluationItems = []
+        childrenEvaluationItems = []
+        for result in WorkingSet().collection.aggregate(pipeline):
+            if result["_id"]["isChild"]:
+                childrenEvaluationItems.append(result["item"])
+            else:
+                evaluationItems.append(result["item"])
+        return evaluationItems, childrenEvaluationItems
 
 
 evaluationMapping = {
@@ -31,6 +31,8 @@ class PluginSettings:
         "danesfield.segment_by_height_shapefiles_folder_id"
     )
     REFERENCE_DATA_FOLDER_ID = "danesfield.reference_data_folder_id"
+    DOCKER_IMAGE_DIGEST = "danesfield.docker_image_digest"
+    TILE_CACHE_SIZE = "danesfield.tile_cache_size"
 
 
 @setting_utilities.validator(PluginSettings.BUILDING_SEGMENTATION_MODEL_FOLDER_ID)
@@ -118,3 +120,31 @@ def _validateReferenceDataFolderId(doc):
 @setting_utilities.default(PluginSettings.REFERENCE_DATA_FOLDER_ID)
 def _defaultReferenceDataFolderId():
     return ""
+
+
+@setting_utilities.validator(PluginSettings.DOCKER_IMAGE_DIGEST)
+def _validateDockerImageDigest(doc):
+    if not isinstance(doc["value"], six.string_types):
+        raise ValidationException("Docker image digest must be a string.")
+
+
+@setting_utilities.default(PluginSettings.DOCKER_IMAGE_DIGEST)
+def _defaultDockerImageDigest():
+    return ""
+
+
+@setting_utilities.validator(PluginSettings.TILE_CACHE_SIZE)
+def _validateTileCacheSize(doc):
+    if (
+        not isinstance(doc["value"], six.integer_types)
+        or isinstance(doc["value"], bool)
+        or doc["value"] < 0
+    ):
+        raise ValidationException(
+            "Tile cache size must be a non-negative number of bytes."
+        )
+
+
+@setting_utilities.default(PluginSettings.TILE_CACHE_SIZE)
+def _defaultTileCacheSize():
+    return 1024**3
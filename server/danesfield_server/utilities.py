@@ -7,6 +7,7 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
+import math
 import re
 
 
@@ -37,3 +38,87 @@ def hasExtension(item, extension):
     :type extension: str
     """
     return removeDuplicateCount(item["name"]).lower().endswith(extension)
+
+
+def _simplifyLine(points, tolerance):
+    """
+    Simplify a line with the Douglas-Peucker algorithm.
+    """
+    if len(points) < 3:
+        return points
+    (x1, y1), (x2, y2) = points[0][:2], points[-1][:2]
+    length = math.hypot(x2 - x1, y2 - y1)
+
+    maxDistance = -1
+    maxIndex = 0
+    for index in range(1, len(points) - 1):
+        x, y = points[index][:2]
+        if length:
+            distance = abs((x2 - x1) * (y1 - y) - (x1 - x) * (y2 - y1)) / length
+        else:
+            distance = math.hypot(x - x1, y - y1)
+        if distance > maxDistance:
+            maxDistance = distance
+            maxIndex = index
+
+    if maxDistance <= tolerance:
+        return [points[0], points[-1]]
+    return _simplifyLine(points[: maxIndex + 1], tolerance)[:-1] + _simplifyLine(
+        points[maxIndex:], tolerance
+    )
+
+
+def _simplifyRing(ring, tolerance):
+    # Split the ring at its farthest point from its start, so that both
+    # parts are lines with distinct ends
+    start = ring[0]
+    farthest = max(
+        range(len(ring)),
+        key=lambda index: math.hypot(
+            ring[index][0] - start[0], ring[index][1] - start[1]
+        ),
+    )
+    if farthest == 0:
+        return ring
+    simplified = _simplifyLine(ring[: farthest + 1], tolerance)[:-1] + _simplifyLine(
+        ring[farthest:], tolerance
+    )
+    # A ring needs at least 3 distinct positions
+    return simplified if len(simplified) >= 4 else ring
+
+
+def simplifyGeometry(geometry, tolerance):
+    """
+    Simplify the lines and polygons of a GeoJSON geometry.
+
+    :param geometry: GeoJSON geometry.
+    :type geometry: dict
+    :param tolerance: Maximum distance between the original and the
+        simplified geometry, in the units of the coordinates.
+    :type tolerance: float
+    :returns: The simplified geometry.
+    """
+    geometryType = geometry.get("type")
+    coordinates = geometry.get("coordinates")
+    if geometryType == "GeometryCollection":
+        return dict(
+            geometry,
+            geometries=[
+                simplifyGeometry(child, tolerance)
+                for child in geometry.get("geometries", [])
+            ],
+        )
+    elif geometryType == "LineString":
+        coordinates = _simplifyLine(coordinates, tolerance)
+    elif geometryType == "MultiLineString":
+        coordinates = [_simplifyLine(line, tolerance) for line in coordinates]
+    elif geometryType == "Polygon":
+        coordinates = [_simplifyRing(ring, tolerance) for ring in coordinates]
+    elif geometryType == "MultiPolygon":
+        coordinates = [
+            [_simplifyRing(ring, tolerance) for ring in polygon]
+            for polygon in coordinates
+        ]
+    else:
+        return geometry
+    return dict(geometry, coordinates=coordinates)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+from girder_worker import GirderWorkerPluginABC
+
+from .algorithms.common import configureTaskPriorities
+
+
+class DanesfieldWorkerPlugin(GirderWorkerPluginABC):
+    """
+    Girder Worker plugin that registers the tasks of Danesfield. The
+    tasks are in the danesfield_server package, so the worker imports
+    Girder and requires the same installation as the server.
+    """
+
+    def __init__(self, app, *args, **kwargs):
+        self.app = app
+        configureTaskPriorities(app)
+
+    def task_imports(self):
+        return ["danesfield_server.algorithms.container_pool"]
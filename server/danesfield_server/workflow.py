@@ -7,6 +7,11 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
+import collections
+import itertools
+
+from .constants import DanesfieldStep
+
 
 class DanesfieldWorkflowException(RuntimeError):
     """
@@ -22,10 +27,25 @@ class DanesfieldWorkflowException(RuntimeError):
 class DanesfieldWorkflow:
     """
     Class to define the Danesfield workflow.
+
+    Once all steps are added, call compile() to validate the workflow
+    and index its dependency graph.
     """
 
     def __init__(self):
         self.steps = []
+        # Names of steps whose output is provided by an existing working
+        # set rather than by a step of the workflow
+        self.inputs = {DanesfieldStep.INIT}
+
+        # Indexes created by compile()
+        # Steps indexed by name
+        self.stepsByName = None
+        # Steps in topological order
+        self.order = None
+        # Names of the steps that depend on each step, indexed by name.
+        # Includes inputs.
+        self.successors = None
 
     def addStep(self, step):
         """
@@ -35,3 +55,101 @@ class DanesfieldWorkflow:
         :type step: DanesfieldWorkflowStep
         """
         self.steps.append(step)
+
+    def addInput(self, name):
+        """
+        Declare that steps may depend on the output of a step that isn't
+        part of the workflow. The output must be available as an existing
+        working set when a job starts.
+
+        :param name: The name of the step.
+        :type name: str (DanesfieldStep)
+        """
+        self.inputs.add(name)
+
+    def compile(self):
+        """
+        Validate the workflow and index its dependency graph. Raises an
+        exception if a step is added twice, if a step depends on an
+        unknown step, or if the dependencies contain a cycle.
+        """
+        stepsByName = {}
+        for step in self.steps:
+            if step.name in stepsByName or step.name in self.inputs:
+                raise DanesfieldWorkflowException(
+                    "Duplicate step '{}'".format(step.name), step=step.name
+                )
+            stepsByName[step.name] = step
+
+        successors = {name: [] for name in itertools.chain(stepsByName, self.inputs)}
+        remainingDependencies = {}
+        for step in self.steps:
+            for dependency in step.dependencies:
+                if dependency not in successors:
+                    raise DanesfieldWorkflowException(
+                        "Step '{}' depends on unknown step '{}'".format(
+                            step.name, dependency
+                        ),
+                        step=step.name,
+                    )
+                successors[dependency].append(step.name)
+            remainingDependencies[step.name] = len(step.dependencies - self.inputs)
+
+        # Sort topologically, preserving declaration order where possible
+        readyNames = collections.deque(
+            step.name for step in self.steps if not remainingDependencies[step.name]
+        )
+        order = []
+        while readyNames:
+            name = readyNames.popleft()
+            order.append(stepsByName[name])
+            for successor in successors[name]:
+                remainingDependencies[successor] -= 1
+                if not remainingDependencies[successor]:
+                    readyNames.append(successor)
+
+        if len(order) != len(self.steps):
+            cycle = [name for name, count in remainingDependencies.items() if count]
+            raise DanesfieldWorkflowException(
+                "Dependency cycle between steps {}".format(cycle)
+            )
+
+        self.stepsByName = stepsByName
+        self.order = order
+        self.successors = successors
+
+    def getStep(self, name):
+        """
+        Get a step by name. Raise an exception if the step is unknown.
+
+        :param name: The name of the step.
+        :type name: str (DanesfieldStep)
+        """
+        if self.stepsByName is None:
+            raise DanesfieldWorkflowException("Workflow not compiled")
+        step = self.stepsByName.get(name)
+        if step is None:
+            raise DanesfieldWorkflowException("Unknown step '{}'".format(name))
+        return step
+
+    def getCriticalPathLengths(self, durations, defaultDuration=1.0):
+        """
+        Return the length of the longest path from each step to the end of
+        the workflow, including the step itself, indexed by step name.
+        Steps on the critical path of the workflow have the longest paths.
+
+        :param durations: Estimated duration of steps, indexed by name.
+        :type durations: dict
+        :param defaultDuration: Duration of steps without an estimate.
+        :type defaultDuration: float
+        """
+        if self.order is None:
+            raise DanesfieldWorkflowException("Workflow not compiled")
+
+        lengths = {}
+        for step in reversed(self.order):
+            lengths[step.name] = durations.get(step.name, defaultDuration) + max(
+                (lengths[successor] for successor in self.successors[step.name]),
+                default=0,
+            )
+        return lengths
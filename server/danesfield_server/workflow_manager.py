@@ -7,18 +7,37 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
+import concurrent.futures
+import contextlib
+import datetime
 import threading
+import time
 import uuid
-import re
+
+from bson.objectid import ObjectId
 
 from girder import logprint
 from girder.models.folder import Folder
+from girder.models.item import Item
 from girder.models.user import User
 
 from .constants import DanesfieldStep
 from .job_info import JobInfo
+from .models.batch import Batch
+from .models.stepDuration import StepDuration
+from .models.stepResult import StepResult
+from .models.tileCache import TileCache
+from .models.workflowJob import WorkflowJob
 from .models.workingSet import WorkingSet
+from .request_info import RequestInfo
 from .workflow import DanesfieldWorkflowException
+from .workflow_utilities import getStepWorkingSets
+
+# Threads that advance workflows, so that running the steps of one job
+# doesn't delay other jobs
+advanceExecutor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="danesfield-advance"
+)
 
 
 class DanesfieldWorkflowManager:
@@ -30,9 +49,17 @@ class DanesfieldWorkflowManager:
     instance. The singleton should be initialized by configuring a
     DanesfieldWorkflow and setting it as the workflow property.
 
+    Job data is stored in the database (see WorkflowJob) rather than in
+    memory, so that several Girder processes can share the work of
+    advancing jobs.
+
     Call initJob() to start a new job, then advance the workflow to
     run the steps that are ready using advance().
 
+    Methods that update a job hold a lock for that job only, so that
+    events of unrelated jobs are handled concurrently. Steps are run
+    outside the lock because running a step may take a long time.
+
     Handlers for workflow steps receive information about the original
     HTTP request and authorization, the job identifier, the initial
     working set and any working sets created during the workflow, the
@@ -42,14 +69,33 @@ class DanesfieldWorkflowManager:
 
     _instance = None
 
+    # Highest priority of Celery tasks
+    MAX_PRIORITY = 9
+
+    # Interval at which to refresh step priorities, in seconds
+    PRIORITY_REFRESH_INTERVAL = 600
+
+    # Time for which jobs in which steps failed can be resumed
+    FAILED_JOB_LIFETIME = datetime.timedelta(days=30)
+
+    # Maximum length of the incomplete last line of a job's output kept
+    # between log updates
+    MAX_PARTIAL_LINE = 65536
+
     def __init__(self):
         # The workflow to run
         self.workflow = None
 
-        # Data indexed by job ID
-        self._jobData = {}
+        # Length of the longest path from each step to the end of the
+        # workflow, estimated from previous runs, and the time at which it
+        # was computed
+        self._criticalPathLengths = None
+        self._criticalPathTime = None
 
-        # Lock
+        # Locks indexed by job ID, as lists of [lock, number of users]
+        self._jobLocks = {}
+
+        # Lock for the attributes of the manager
         self._lock = threading.RLock()
 
     @classmethod
@@ -59,6 +105,28 @@ class DanesfieldWorkflowManager:
             cls._instance = DanesfieldWorkflowManager()
         return cls._instance
 
+    @contextlib.contextmanager
+    def jobLock(self, jobId):
+        """
+        Context manager that holds the lock of a job. The lock only
+        serializes updates within this process; updates of the stored job
+        data are atomic across processes.
+
+        :param jobId: Job identifier.
+        :type jobId: str
+        """
+        with self._lock:
+            jobLock = self._jobLocks.setdefault(jobId, [threading.RLock(), 0])
+            jobLock[1] += 1
+        try:
+            with jobLock[0]:
+                yield
+        finally:
+            with self._lock:
+                jobLock[1] -= 1
+                if not jobLock[1]:
+                    del self._jobLocks[jobId]
+
     def _createJobId(self):
         """Return new job identifier."""
         return uuid.uuid4().hex
@@ -70,13 +138,86 @@ class DanesfieldWorkflowManager:
         :param jobId: Job identifier.
         :type jobId: str
         """
-        jobData = self._jobData.get(jobId)
+        jobData = WorkflowJob().load(jobId, force=True, objectId=False)
         if jobData is None:
             raise DanesfieldWorkflowException("Invalid job ID: '{}'".format(jobId))
         return jobData
 
+    def _checkJobData(self, jobId, jobData):
+        """
+        Raise an exception if an update of the job data didn't match a job.
+        """
+        if jobData is None:
+            # Distinguish an invalid job ID from a rejected update
+            self._getJobData(jobId)
+        return jobData
+
+    def _createJobInfo(self, jobId, jobData):
+        """
+        Create the job context passed to workflow steps from the stored
+        job data.
+
+        :param jobId: Job identifier.
+        :type jobId: str
+        :param jobData: Job data document.
+        :type jobData: dict
+        """
+        requestInfo = jobData["requestInfo"]
+        workingSets = {}
+        for stepName, workingSetId in jobData["workingSetIds"].items():
+            workingSet = WorkingSet().load(workingSetId, force=True)
+            if workingSet is not None:
+                workingSets[stepName] = workingSet
+
+        return JobInfo(
+            jobId=jobId,
+            requestInfo=RequestInfo(
+                user=User().load(requestInfo["userId"], force=True, exc=True),
+                apiUrl=requestInfo["apiUrl"],
+                token=requestInfo["token"],
+            ),
+            workingSets=workingSets,
+            standardOutput=jobData["standardOutput"],
+            outputFolder=Folder().load(jobData["outputFolderId"], force=True, exc=True),
+            options=jobData["options"],
+        )
+
+    def getStepPriority(self, stepName):
+        """
+        Get the Celery priority of the tasks of a step. Steps with a
+        longer path to the end of the workflow, estimated from the
+        duration of previous runs, get a higher priority so that steps on
+        the critical path run first when workers are busy.
+
+        :param stepName: The name of the step.
+        :type stepName: str (DanesfieldStep)
+        :returns: Priority between 0 and MAX_PRIORITY.
+        """
+        with self._lock:
+            if (
+                self._criticalPathLengths is None
+                or time.time() - self._criticalPathTime > self.PRIORITY_REFRESH_INTERVAL
+            ):
+                self._criticalPathLengths = self.workflow.getCriticalPathLengths(
+                    StepDuration().getAverageDurations()
+                )
+                self._criticalPathTime = time.time()
+
+            lengths = self._criticalPathLengths
+
+        maxLength = max(lengths.values(), default=0)
+        if stepName not in lengths or not maxLength:
+            return 0
+        return int(round(self.MAX_PRIORITY * lengths[stepName] / maxLength))
+
     def initJob(
-        self, requestInfo, workingSet, outputFolder, options, previousWorkingSet=None
+        self,
+        requestInfo,
+        workingSet,
+        outputFolder,
+        options,
+        previousWorkingSet=None,
+        batchId=None,
     ):
         """
         Initialize a new job to run the workflow.
@@ -90,81 +231,375 @@ class DanesfieldWorkflowManager:
         :returns: Job identifier.
         :param options: Processing options.
         :type options: dict
+        :param batchId: ID of the batch of the job, if any.
+        :type batchId: ObjectId
         """
-        with self._lock:
-            if not self.workflow:
-                raise DanesfieldWorkflowException("Workflow not configured")
-
-            jobId = self._createJobId()
-
-            # TODO: Improve job data storage
-            jobData = {
-                # Running steps
-                "runningSteps": set(),
-                # Completed steps
-                "completedSteps": set(),
-                # Failed steps:
-                "failedSteps": set(),
-                # Request info
-                "requestInfo": requestInfo,
-                # Working sets indexed by step name
-                "workingSets": {DanesfieldStep.INIT: workingSet},
-                # Files indexed by step name
-                "files": {},
-                # Standard output indexed by step name
-                "standardOutput": {},
-                # Output folder
-                "outputFolder": outputFolder,
-                # Options
-                "options": options if options is not None else {},
-                # For composite steps, list of [Celery GroupResult,
-                # number of jobs remaining], indexed by step name
-                "groupResult": {},
+        if not self.workflow:
+            raise DanesfieldWorkflowException("Workflow not configured")
+
+        jobId = self._createJobId()
+
+        logprint.info(
+            "DanesfieldWorkflowManager.initJob Job={} WorkingSet={}".format(
+                jobId, workingSet["_id"]
+            )
+        )
+
+        workingSets = {DanesfieldStep.INIT: workingSet}
+        completedSteps = set()
+
+        # If a workingSet exists for a given step, we include that
+        # working set in the current jobData and flag it as being
+        # complete (the step will not be re-run)
+        for stepName, ws in getStepWorkingSets(workingSet).items():
+            workingSets[stepName] = ws
+
+            # Set the skipped job as completed
+            completedSteps.add(stepName)
+            logprint.info(
+                "DanesfieldWorkflowManager.skippingStep Job={} "
+                "StepName={}".format(jobId, stepName)
+            )
+
+        # Count the dependencies of each step that haven't completed
+        remainingDependencies = {}
+        readySteps = []
+        for step in self.workflow.order:
+            missingInputs = (step.dependencies & self.workflow.inputs) - set(
+                workingSets
+            )
+            if missingInputs:
+                raise DanesfieldWorkflowException(
+                    "Missing working sets for steps {}".format(sorted(missingInputs)),
+                    step=step.name,
+                )
+            remainingDependencies[step.name] = len(step.dependencies - completedSteps)
+            if not remainingDependencies[step.name] and step.name not in completedSteps:
+                readySteps.append(step.name)
+
+        WorkflowJob().createWorkflowJob(
+            jobId=jobId,
+            requestInfo=requestInfo,
+            workingSets=workingSets,
+            outputFolder=outputFolder,
+            options=options if options is not None else {},
+            completedSteps=completedSteps,
+            remainingDependencies=remainingDependencies,
+            readySteps=readySteps,
+            batchId=batchId,
+        )
+
+        return jobId
+
+    def planJob(self, workingSet, options):
+        """
+        Plan a run of the workflow without running it. Returns, for each
+        step in execution order, whether the step would be skipped because
+        its working set already exists, the estimated number of Girder
+        Worker jobs, the bytes of input files and the estimated duration
+        from previous runs. The estimated duration of the workflow is the
+        length of its critical path.
+
+        :param workingSet: Source image working set.
+        :type workingSet: dict
+        :param options: Processing options.
+        :type options: dict
+        :returns: dict
+        """
+        if not self.workflow:
+            raise DanesfieldWorkflowException("Workflow not configured")
+
+        options = options if options is not None else {}
+        workingSets = {DanesfieldStep.INIT: workingSet}
+        workingSets.update(getStepWorkingSets(workingSet))
+        durations = StepDuration().getAverageDurations()
+
+        steps = []
+        plannedDurations = {}
+        totalInputBytes = 0
+        for step in self.workflow.order:
+            existingWorkingSet = workingSets.get(step.name)
+            stepPlan = {
+                "name": step.name,
+                "action": "run" if existingWorkingSet is None else "skip",
+                "existingWorkingSetId": (
+                    existingWorkingSet["_id"]
+                    if existingWorkingSet is not None
+                    else None
+                ),
+                "dependencies": sorted(step.dependencies),
+                "missingInputs": sorted(
+                    (step.dependencies & self.workflow.inputs) - set(workingSets)
+                ),
+                "validOptions": isinstance(options.get(step.name, {}), dict),
+                "jobs": 0,
+                "inputBytes": 0,
+                "estimatedDuration": None,
             }
+            if existingWorkingSet is None:
+                stepPlan["jobs"] = step.estimateJobCount(workingSets)
+                stepPlan["inputBytes"] = step.estimateInputBytes(workingSets)
+                stepPlan["estimatedDuration"] = durations.get(step.name)
+                plannedDurations[step.name] = stepPlan["estimatedDuration"] or 0
+                totalInputBytes += stepPlan["inputBytes"] or 0
+            else:
+                plannedDurations[step.name] = 0
+            steps.append(stepPlan)
+
+        criticalPathLengths = self.workflow.getCriticalPathLengths(
+            plannedDurations, defaultDuration=0
+        )
+
+        return {
+            "workingSetId": workingSet["_id"],
+            "steps": steps,
+            "runnable": not any(
+                stepPlan["missingInputs"] or not stepPlan["validOptions"]
+                for stepPlan in steps
+            ),
+            "jobs": sum(stepPlan["jobs"] for stepPlan in steps),
+            # Bytes of steps whose inputs are produced by the workflow
+            # itself are unknown and not included
+            "inputBytes": totalInputBytes,
+            "estimatedDuration": max(criticalPathLengths.values(), default=0),
+            "stepsWithoutHistory": sorted(
+                stepPlan["name"]
+                for stepPlan in steps
+                if stepPlan["action"] == "run" and stepPlan["estimatedDuration"] is None
+            ),
+        }
+
+    def initBatch(self, requestInfo, jobs, maxRunningJobs):
+        """
+        Initialize jobs to run the workflow on several working sets. The
+        jobs share a budget of maxRunningJobs running jobs; call
+        startBatchJobs() to start as many as the budget allows. Other jobs
+        start as running jobs finish.
+
+        :param requestInfo: HTTP request and authorization info.
+        :type requestInfo: RequestInfo
+        :param jobs: Tuples of the form (workingSet, outputFolder, options).
+        :type jobs: list[tuple[dict, dict, dict]]
+        :param maxRunningJobs: Maximum number of jobs running at a time.
+        :type maxRunningJobs: int
+        :returns: Batch document.
+        """
+        batchId = ObjectId()
+        batchJobs = []
+        try:
+            for workingSet, outputFolder, options in jobs:
+                jobId = self.initJob(
+                    requestInfo, workingSet, outputFolder, options, batchId=batchId
+                )
+                batchJobs.append(
+                    {
+                        "jobId": jobId,
+                        "workingSetId": workingSet["_id"],
+                        "options": options,
+                    }
+                )
+        except Exception:
+            # Don't leave jobs of an incomplete batch behind
+            WorkflowJob().removeWithQuery({"batchId": batchId})
+            raise
+
+        logprint.info(
+            "DanesfieldWorkflowManager.initBatch Batch={} Jobs={}".format(
+                batchId, len(batchJobs)
+            )
+        )
+
+        return Batch().createBatch(batchId, requestInfo.user, batchJobs, maxRunningJobs)
+
+    def startBatchJobs(self, batchId):
+        """
+        Start pending jobs of a batch while the batch has a budget for them.
+
+        :param batchId: ID of the batch.
+        :type batchId: ObjectId
+        """
+        while True:
+            jobId = Batch().startJob(batchId)
+            if jobId is None:
+                return
 
             logprint.info(
-                "DanesfieldWorkflowManager.initJob Job={} WorkingSet={}".format(
-                    jobId, workingSet["_id"]
+                "DanesfieldWorkflowManager.startBatchJobs Batch={} Job={}".format(
+                    batchId, jobId
                 )
             )
+            try:
+                self.advance(jobId)
+            except Exception:
+                # The job is finalized when its steps fail; keep starting
+                # the other jobs
+                logprint.exception(
+                    "DanesfieldWorkflowManager.startBatchJobs Error starting "
+                    "Job={}".format(jobId)
+                )
 
-            # If a workingSet exists for a given step, we include that
-            # working set in the current jobData and flag it as being
-            # complete (the step will not be re-run)
-            step_name_re = re.compile(".*:\\s(.*)")
-            for ws in WorkingSet().find({"parentWorkingSetId": workingSet["_id"]}):
-                match = re.match(step_name_re, ws["name"])
-                if match:
-                    stepName = match.group(1)
-                    jobData["workingSets"][stepName] = ws
-
-                    # Set the skipped job as completed
-                    jobData["completedSteps"].add(stepName)
-                    logprint.info(
-                        "DanesfieldWorkflowManager.skippingStep Job={} "
-                        "StepName={}".format(jobId, stepName)
-                    )
-                else:
-                    logprint.warning(
-                        "DanesfieldWorkflowManager.unableToParseStepName "
-                        "Job={} WorkingSetName={}".format(jobId, ws["name"])
-                    )
+    def getBatchProgress(self, batch):
+        """
+        Return the progress of the jobs of a batch.
 
-            self._jobData[jobId] = jobData
+        :param batch: Batch document.
+        :type batch: dict
+        :returns: dict
+        """
+        jobData = {
+            doc["_id"]: doc
+            for doc in WorkflowJob().find(
+                {"batchId": batch["_id"]},
+                fields=["completedSteps", "failedSteps", "runningSteps"],
+            )
+        }
+        numSteps = len(self.workflow.stepsByName) if self.workflow else 0
+
+        statuses = {}
+        for status, key in (
+            ("pending", "pendingJobIds"),
+            ("running", "runningJobIds"),
+            ("completed", "completedJobIds"),
+            ("failed", "failedJobIds"),
+        ):
+            for jobId in batch[key]:
+                statuses[jobId] = status
+
+        jobs = []
+        progress = 0.0
+        for job in batch["jobs"]:
+            jobId = job["jobId"]
+            status = statuses.get(jobId, "pending")
+            data = jobData.get(jobId, {})
+            completedSteps = data.get("completedSteps", [])
+            if status == "completed":
+                progress += 1
+            elif numSteps:
+                progress += min(len(completedSteps) / numSteps, 1)
+            jobs.append(
+                {
+                    "jobId": jobId,
+                    "workingSetId": job["workingSetId"],
+                    "status": status,
+                    "completedSteps": completedSteps,
+                    "runningSteps": data.get("runningSteps", []),
+                    "failedSteps": data.get("failedSteps", []),
+                }
+            )
 
-            return jobId
+        return {
+            "_id": batch["_id"],
+            "created": batch["created"],
+            "maxRunningJobs": batch["maxRunningJobs"],
+            "total": len(jobs),
+            "pending": len(batch["pendingJobIds"]),
+            "running": len(batch["runningJobIds"]),
+            "completed": len(batch["completedJobIds"]),
+            "failed": len(batch["failedJobIds"]),
+            "progress": progress / len(jobs) if jobs else 1.0,
+            "jobs": jobs,
+        }
 
     def finalizeJob(self, jobId):
         """
-        Finalize a job after completing the workflow.
+        Finalize a job after completing the workflow. Jobs in which steps
+        failed are kept for FAILED_JOB_LIFETIME so that they can be
+        resumed.
 
         :param jobId: Job identifier.
         :type jobId: str
         """
-        with self._lock:
+        with self.jobLock(jobId):
             logprint.info("DanesfieldWorkflowManager.finalizeJob Job={}".format(jobId))
 
-            self._jobData.pop(jobId, None)
+            jobData = WorkflowJob().load(
+                jobId, force=True, objectId=False, fields=["failedSteps", "batchId"]
+            )
+            if jobData is None:
+                return
+
+            if jobData["failedSteps"]:
+                WorkflowJob().setFinalized(
+                    jobId, datetime.datetime.utcnow() + self.FAILED_JOB_LIFETIME
+                )
+            else:
+                WorkflowJob().removeWithQuery({"_id": jobId})
+
+        # Let the next job of the batch run. Callers may still hold the lock
+        # of the finished job, so start the next jobs in another thread.
+        batchId = jobData.get("batchId")
+        if batchId is not None:
+            if Batch().finishJob(batchId, jobId, not jobData["failedSteps"]):
+                advanceExecutor.submit(self.startBatchJobs, batchId)
+
+    def resumeJob(self, requestInfo, jobId):
+        """
+        Resume a job in which steps failed. The failed steps and the steps
+        that depend on them run again; steps that completed aren't run
+        again. Call advance() to run the steps.
+
+        :param requestInfo: HTTP request and authorization info.
+        :type requestInfo: RequestInfo
+        :param jobId: Job identifier.
+        :type jobId: str
+        :returns: Job identifier.
+        """
+        if not self.workflow:
+            raise DanesfieldWorkflowException("Workflow not configured")
+
+        jobData = self._getJobData(jobId)
+        if not jobData["finalized"] or not jobData["failedSteps"]:
+            raise DanesfieldWorkflowException(
+                "Job {} has no failed steps to resume".format(jobId)
+            )
+
+        with self.jobLock(jobId):
+            logprint.info(
+                "DanesfieldWorkflowManager.resumeJob Job={} FailedSteps={}".format(
+                    jobId, sorted(jobData["failedSteps"])
+                )
+            )
+
+            # The failed steps, the steps that depend on them and the steps
+            # that didn't run for another reason
+            completedSteps = set(jobData["completedSteps"])
+            stepNames = set(self.workflow.stepsByName) - completedSteps
+
+            # Remove output of the previous attempt
+            for stepName in stepNames:
+                outputFolder = Folder().findOne(
+                    {"parentId": jobData["outputFolderId"], "name": stepName}
+                )
+                if outputFolder is not None:
+                    Folder().clean(outputFolder)
+
+            remainingDependencies = {}
+            readySteps = []
+            for step in self.workflow.order:
+                remainingDependencies[step.name] = len(
+                    step.dependencies - completedSteps
+                )
+                if not remainingDependencies[step.name] and step.name in stepNames:
+                    readySteps.append(step.name)
+
+            if (
+                WorkflowJob().resumeJob(
+                    jobId,
+                    stepNames,
+                    requestInfo,
+                    remainingDependencies,
+                    readySteps,
+                )
+                is None
+            ):
+                raise DanesfieldWorkflowException(
+                    "Job {} was already resumed".format(jobId)
+                )
+
+            if jobData.get("batchId") is not None:
+                Batch().resumeJob(jobData["batchId"], jobId)
+
+        return jobId
 
     def addFile(self, jobId, stepName, file):
         """
@@ -177,35 +612,77 @@ class DanesfieldWorkflowManager:
         :param file: File document.
         :type file: dict
         """
-        with self._lock:
-            logprint.info(
-                "DanesfieldWorkflowManager.addFile Job={} StepName={} File={}".format(
-                    jobId, stepName, file["_id"]
-                )
+        logprint.info(
+            "DanesfieldWorkflowManager.addFile Job={} StepName={} File={}".format(
+                jobId, stepName, file["_id"]
             )
+        )
 
-            jobData = self._getJobData(jobId)
-            jobData["files"].setdefault(stepName, []).append(file)
+        self._checkJobData(jobId, WorkflowJob().addFile(jobId, stepName, file))
+
+    def stepRunning(self, jobId, stepName):
+        """
+        Record that a job of a step started to run on a worker. The
+        duration of the step is measured from then, so that it doesn't
+        include the time spent waiting in the task queue.
+
+        :param jobId: Identifier of the job.
+        :type jobId: str
+        :param stepName: The name of the step.
+        :type stepName: str (DanesfieldStep)
+        """
+        WorkflowJob().setStepStartTime(jobId, stepName)
 
-    def addStandardOutput(self, jobId, stepName, output):
+    def addStandardOutput(self, jobId, stepName, girderJobId, log, final=False):
         """
-        Record standard output from a step.
+        Parse standard output logged by a job of a step, using the output
+        parser of the step. Only the parsed result and the incomplete last
+        line of the output are stored, so the full log is never loaded.
+
+        Output of steps without a parser, or of jobs that have been
+        finalized, is ignored.
 
         :param jobId: Identifier of the job.
         :type jobId: str
         :param stepName: The name of the step to which the output belongs.
         :type stepName: str (DanesfieldStep)
-        :param output: Standard output
-        :type output: list[str]
+        :param girderJobId: ID of the Girder job that logged the output.
+        :type girderJobId: str
+        :param log: New output.
+        :type log: str
+        :param final: Whether the Girder job has completed, in which case
+        the last line is complete.
+        :type final: bool
         """
-        with self._lock:
-            logprint.info(
-                "DanesfieldWorkflowManager.addStandardOutput Job={} "
-                "StepName={}".format(jobId, stepName)
+        step = self.workflow.stepsByName.get(stepName) if self.workflow else None
+        if step is None or step.outputParser is None:
+            return
+
+        girderJobId = str(girderJobId)
+        bufferKey = "outputBuffers.%s" % girderJobId
+        outputKey = "standardOutput.%s" % stepName
+
+        with self.jobLock(jobId):
+            jobData = WorkflowJob().load(
+                jobId, force=True, objectId=False, fields=[bufferKey, outputKey]
             )
+            if jobData is None:
+                return
 
-            jobData = self._getJobData(jobId)
-            jobData["standardOutput"][stepName] = output
+            lines = (
+                jobData.get("outputBuffers", {}).get(girderJobId, "") + (log or "")
+            ).split("\n")
+            partialLine = None if final else lines.pop()[-self.MAX_PARTIAL_LINE :]
+            if not lines and not final:
+                output = jobData.get("standardOutput", {}).get(stepName)
+            else:
+                output = step.outputParser.parse(
+                    lines, jobData.get("standardOutput", {}).get(stepName)
+                )
+
+            WorkflowJob().setStandardOutput(
+                jobId, stepName, output, girderJobId, partialLine
+            )
 
     def setGroupResult(self, jobId, stepName, groupResult):
         """
@@ -221,6 +698,9 @@ class DanesfieldWorkflowManager:
         the group have completed. If so, the isCompositeStepSuccessful() method
         returns true if all the jobs in the group were successful.
 
+        Only the number of jobs in the group is stored, so that any
+        Girder process can track the progress of the group.
+
         :param jobId: Identifier of job that created the file.
         :type jobId: str
         :param stepName: The name of the step that created the file.
@@ -228,48 +708,94 @@ class DanesfieldWorkflowManager:
         :param groupResult: Celery GroupResult.
         :type groupResult: celery.result.GroupResult
         """
-        with self._lock:
-            jobData = self._getJobData(jobId)
-            # Store GroupResult and number of jobs
-            jobData["groupResult"][stepName] = [groupResult, len(groupResult.children)]
+        self._checkJobData(
+            jobId,
+            WorkflowJob().setGroupResult(jobId, stepName, len(groupResult.children)),
+        )
 
     def isCompositeStep(self, jobId, stepName):
         """
         Query whether a step is a composite step.
         """
-        with self._lock:
-            jobData = self._getJobData(jobId)
-            return jobData["groupResult"].get(stepName) is not None
+        jobData = self._getJobData(jobId)
+        return jobData["groupResult"].get(stepName) is not None
 
     def isCompositeStepComplete(self, jobId, stepName):
         """
         Query whether a composite step is complete. A composite step
         is complete when all its jobs have completed and
         compositeStepJobCompleted() has been called for each job.
+        A step in streaming mode also waits for its streaming dependency
+        to finish, since the dependency may create more items.
         """
-        with self._lock:
-            jobData = self._getJobData(jobId)
-            groupResult, remainingJobs = jobData["groupResult"].get(stepName)
-            return groupResult.ready() and not remainingJobs
+        jobData = self._getJobData(jobId)
+        return self._isCompositeStepComplete(jobData, stepName)
+
+    def _isCompositeStepComplete(self, jobData, stepName):
+        streaming = jobData.get("streaming", {}).get(stepName)
+        return jobData["groupResult"][stepName]["remaining"] <= 0 and (
+            streaming is None or streaming["done"]
+        )
 
     def isCompositeStepSuccessful(self, jobId, stepName):
         """
         Query whether a composite step is successful. A composite step is
         successful if all its jobs are succesful.
         """
-        with self._lock:
-            jobData = self._getJobData(jobId)
-            groupResult, _ = jobData["groupResult"].get(stepName)
-            return groupResult.successful()
+        jobData = self._getJobData(jobId)
+        return not jobData["groupResult"][stepName]["failed"]
 
-    def compositeStepJobCompleted(self, jobId, stepName):
+    def compositeStepJobCompleted(self, jobId, stepName, successful=True):
         """
         Indicate that a job in a composite step has completed.
         """
-        with self._lock:
-            jobData = self._getJobData(jobId)
-            # Update number of jobs remaining
-            jobData["groupResult"][stepName][1] -= 1
+        self._checkJobData(
+            jobId, WorkflowJob().groupJobCompleted(jobId, stepName, successful)
+        )
+
+    def _createStepOutputFolder(self, jobInfo, stepName):
+        """Create the output folder of a step."""
+        return Folder().createFolder(
+            parent=jobInfo.outputFolder,
+            name=stepName,
+            parentType="folder",
+            public=False,
+            creator=User().getAdmins().next(),
+            reuseExisting=True,
+        )
+
+    def _startStreamingSteps(self, jobId, jobData):
+        """
+        Start steps in streaming mode when their only incomplete dependency
+        is a running streaming dependency.
+
+        Returns the updated job data and the names of the dependencies of
+        the started steps.
+        """
+        dependencies = set()
+        for step in self.workflow.order:
+            incompleteDependencies = step.dependencies - set(jobData["completedSteps"])
+            if len(incompleteDependencies) != 1:
+                continue
+            dependency = next(iter(incompleteDependencies))
+            if (
+                dependency not in step.streamingDependencies
+                or dependency not in jobData["runningSteps"]
+            ):
+                continue
+
+            result = WorkflowJob().startStreamingStep(jobId, step.name, dependency)
+            if result is None:
+                continue
+            jobData = result
+            dependencies.add(dependency)
+
+            logprint.info(
+                "DanesfieldWorkflowManager.startStreamingStep Job={} "
+                "StepName={} Dependency={}".format(jobId, step.name, dependency)
+            )
+
+        return jobData, dependencies
 
     def advance(self, jobId):
         """
@@ -277,112 +803,280 @@ class DanesfieldWorkflowManager:
         Runs all remaining steps that have their dependencies met.
         Finalizes the job if all steps are complete.
 
+        Also starts steps in streaming mode, and passes the remaining
+        items of streaming dependencies that have completed.
+
+        The steps to run are selected while holding the lock of the job,
+        and then run after releasing it.
+
         :param jobId: Identifier of the job running the workflow.
         :type jobId: str
         """
-        with self._lock:
+        with self.jobLock(jobId):
             logprint.info("DanesfieldWorkflowManager.advance Job={}".format(jobId))
 
             jobData = self._getJobData(jobId)
 
-            incompleteSteps = [
-                step
-                for step in self.workflow.steps
-                if (
-                    step.name not in jobData["completedSteps"]
-                    and step.name not in jobData["failedSteps"]
+            if not jobData["runningSteps"] and not jobData["readySteps"]:
+                incompleteSteps = (
+                    set(self.workflow.stepsByName)
+                    - set(jobData["completedSteps"])
+                    - set(jobData["failedSteps"])
                 )
-            ]
 
-            # Skip run-metrics if the AOI is unknown
-            # model = jobData['options'].get('classify-materials', {}).get(
-            #     'model')
-            # if model is None or model == 'STANDARD':
-            #     try:
-            #         incompleteSteps.remove(RunMetricsStep)
-            #     except ValueError as e:
-            #         pass
-
-            logprint.info(
-                "DanesfieldWorkflowManager.advance IncompleteSteps={}".format(
-                    [step.name for step in incompleteSteps]
-                )
-            )
+                # Finalize job if either:
+                # - All steps have completed, or
+                # - Steps failed, and the remaining steps depend on them
+                # Steps that don't depend on a failed step keep running.
+                if not incompleteSteps or jobData["failedSteps"]:
+                    if incompleteSteps:
+                        logprint.info(
+                            "DanesfieldWorkflowManager.advance "
+                            "BlockedSteps={}".format(sorted(incompleteSteps))
+                        )
+                    self.finalizeJob(jobId)
+                else:
+                    logprint.error(
+                        "DanesfieldWorkflowManager.advance StuckSteps={}".format(
+                            sorted(incompleteSteps)
+                        )
+                    )
+                    # TODO: More error notification/handling/clean up
+                return
 
-            runningSteps = [
-                step
-                for step in self.workflow.steps
-                if step.name in jobData["runningSteps"]
+            # Claim the ready steps. Another Girder process may have
+            # started some of them since the job data was loaded.
+            steps = [
+                self.workflow.getStep(stepName)
+                for stepName in jobData["readySteps"]
+                if WorkflowJob().startStep(jobId, stepName) is not None
             ]
 
-            logprint.info(
-                "DanesfieldWorkflowManager.advance RunningSteps={}".format(
-                    [step.name for step in runningSteps]
+            if steps:
+                logprint.info(
+                    "DanesfieldWorkflowManager.advance StartedSteps={}".format(
+                        [step.name for step in steps]
+                    )
                 )
-            )
+                jobData = self._getJobData(jobId)
+
+            # Start steps that can process the output of running steps
+            # as it's created
+            jobData, streamingDependencies = self._startStreamingSteps(jobId, jobData)
+
+            # Streaming dependencies that have completed
+            completedDependencies = {
+                streaming["dependency"]
+                for streaming in jobData.get("streaming", {}).values()
+                if not streaming["done"]
+                and streaming["dependency"] in jobData["completedSteps"]
+            }
 
-            # Finalize job if either:
-            # - All steps have completed, or
-            # - A previous step failed and no steps are running
-            # Note that it's possible that future steps could run
-            # successfully if they don't depend on the failed step;
-            # that's not currently handled.
-            if not runningSteps and (not incompleteSteps or jobData["failedSteps"]):
-                self.finalizeJob(jobId)
+            if not steps and not streamingDependencies and not completedDependencies:
                 return
 
-            readySteps = [
-                step
-                for step in incompleteSteps
-                if step.name not in jobData["runningSteps"]
-                and step.dependencies.issubset(jobData["completedSteps"])
-            ]
+            jobInfo = self._createJobInfo(jobId, jobData)
+
+        # Process the items that were created before the streaming steps
+        # started
+        for dependency in streamingDependencies - completedDependencies:
+            self.streamItems(jobId, dependency)
+
+        cachedSteps = False
+        errors = []
+        for step in steps:
+            try:
+                # Create output directory for step
+                outputFolder = self._createStepOutputFolder(jobInfo, step.name)
+
+                if self._reuseStepResult(jobInfo, step, outputFolder):
+                    cachedSteps = True
+                    continue
+
+                step.run(jobInfo, outputFolder)
+            except Exception as e:
+                # Don't leave the step running forever. The other claimed
+                # steps still run, since no other process will start them.
+                self.stepFailed(jobId, step.name)
+                errors.append(e)
+
+        # Streaming steps that completed, and steps whose output was
+        # reused, may make other steps ready
+        completed = [
+            self.streamItems(jobId, dependency, final=True)
+            for dependency in sorted(completedDependencies)
+        ]
+        if cachedSteps or any(completed):
+            self.advance(jobId)
+
+        # Report the first error once the other steps have started
+        if errors:
+            raise errors[0]
+
+    def _reuseStepResult(self, jobInfo, step, outputFolder):
+        """
+        Reuse the output of a previous run of a step with the same inputs,
+        if any, by copying its items into the output folder of the step.
+        Copies refer to the same files in the assetstore, so no data is
+        transferred. Otherwise, record the cache key of the step so that
+        its output is registered when it succeeds.
 
-            logprint.info(
-                "DanesfieldWorkflowManager.advance ReadySteps={}".format(
-                    [step.name for step in readySteps]
-                )
+        Returns True if the output was reused and the step succeeded.
+        """
+        cacheKey = step.getCacheKey(jobInfo)
+        if cacheKey is None:
+            return False
+
+        outputPrefix = step.getOutputPrefix(jobInfo)
+        result = StepResult().getResult(cacheKey)
+        if result is None:
+            WorkflowJob().setCacheKey(jobInfo.jobId, step.name, cacheKey, outputPrefix)
+            return False
+
+        logprint.info(
+            "DanesfieldWorkflowManager.reuseStepResult Job={} StepName={} "
+            "Key={}".format(jobInfo.jobId, step.name, cacheKey)
+        )
+
+        cachedPrefix = result.get("outputPrefix")
+        for item in result["items"]:
+            name = item["name"]
+            if outputPrefix and cachedPrefix and name.startswith(cachedPrefix):
+                name = outputPrefix + name[len(cachedPrefix) :]
+            copy = Item().copyItem(
+                item, creator=jobInfo.requestInfo.user, name=name, folder=outputFolder
             )
+            for file in Item().childFiles(copy):
+                self.addFile(jobInfo.jobId, step.name, file)
 
-            if not runningSteps and not readySteps and incompleteSteps:
-                logprint.error(
-                    "DanesfieldWorkflowManager.advance StuckSteps={}".format(
-                        [step.name for step in incompleteSteps]
-                    )
+        self.stepSucceeded(jobInfo.jobId, step.name, recordDuration=False)
+        return True
+
+    def streamItems(self, jobId, dependency, final=False):
+        """
+        Run the steps in streaming mode that depend on a step on the items
+        the step created that they haven't processed yet.
+
+        When final is True, the dependency has completed: process its
+        remaining items and record that the streaming steps won't receive
+        more items.
+
+        Returns True if a streaming step completed.
+
+        :param jobId: Identifier of the job running the workflow.
+        :type jobId: str
+        :param dependency: The name of the streaming dependency.
+        :type dependency: str (DanesfieldStep)
+        :param final: Whether the dependency has completed.
+        :type final: bool
+        """
+        with self.jobLock(jobId):
+            jobData = self._getJobData(jobId)
+
+            stepNames = [
+                stepName
+                for stepName, streaming in jobData.get("streaming", {}).items()
+                if streaming["dependency"] == dependency and not streaming["done"]
+            ]
+            if not stepNames:
+                return False
+
+            if final:
+                # Once the dependency completed, its items are in its
+                # working set
+                workingSetId = jobData["workingSetIds"].get(dependency)
+                workingSet = (
+                    WorkingSet().load(workingSetId, force=True)
+                    if workingSetId is not None
+                    else None
                 )
-                # TODO: More error notification/handling/clean up
-                return
+                itemIds = workingSet["datasetIds"] if workingSet is not None else []
+            else:
+                itemIds = jobData["files"].get(dependency, [])
+
+            jobInfo = self._createJobInfo(jobId, jobData)
+
+        completed = False
+        for stepName in stepNames:
+            step = self.workflow.getStep(stepName)
+            consumedItemIds = {
+                str(itemId)
+                for itemId in jobData["streaming"][stepName]["consumedItems"]
+            }
+            items = [
+                item
+                for item in (
+                    Item().load(itemId, force=True)
+                    for itemId in itemIds
+                    if str(itemId) not in consumedItemIds
+                )
+                if item is not None
+            ]
 
-            jobInfo = JobInfo(
-                jobId=jobId,
-                requestInfo=jobData["requestInfo"],
-                workingSets=jobData["workingSets"],
-                standardOutput=jobData["standardOutput"],
-                outputFolder=jobData["outputFolder"],
-                options=jobData["options"],
-            )
+            outputFolder = None
+            for group in step.groupStreamingItems(dependency, items, final):
+                claimed = WorkflowJob().claimStreamingItems(
+                    jobId, stepName, [item["_id"] for item in group]
+                )
+                if claimed is None:
+                    continue
 
-            if readySteps:
-                adminUser = User().getAdmins().next()
-                for step in readySteps:
-                    # Create output directory for step
-                    outputFolder = Folder().createFolder(
-                        parent=jobInfo.outputFolder,
-                        name=step.name,
-                        parentType="folder",
-                        public=False,
-                        creator=adminUser,
-                        reuseExisting=True,
+                logprint.info(
+                    "DanesfieldWorkflowManager.streamItems Job={} StepName={} "
+                    "Items={}".format(jobId, stepName, [item["name"] for item in group])
+                )
+
+                try:
+                    if outputFolder is None:
+                        outputFolder = self._createStepOutputFolder(jobInfo, stepName)
+                    step.runItems(jobInfo, outputFolder, group)
+                except Exception:
+                    logprint.exception(
+                        "DanesfieldWorkflowManager.streamItems Error running "
+                        "Job={} StepName={}".format(jobId, stepName)
                     )
+                    # The job wasn't started, so complete it here
+                    self.compositeStepJobCompleted(jobId, stepName, successful=False)
+                    self._finishStreamingStep(jobId, stepName)
+
+            if final:
+                WorkflowJob().finishStreaming(jobId, stepName, successful=True)
+                completed = self._finishStreamingStep(jobId, stepName) or completed
+
+        return completed
+
+    def _finishStreamingStep(self, jobId, stepName):
+        """
+        Record the completion of a step in streaming mode if its streaming
+        dependency has finished and its jobs have completed. Job events
+        only do so when a job of the step completes last.
+
+        Returns True if the step succeeded.
+        """
+        with self.jobLock(jobId):
+            jobData = self._getJobData(jobId)
+            if stepName not in jobData["runningSteps"] or not (
+                self._isCompositeStepComplete(jobData, stepName)
+            ):
+                return False
 
-                    jobData["runningSteps"].add(step.name)
-                    step.run(jobInfo, outputFolder)
+            if jobData["groupResult"][stepName]["failed"]:
+                self.stepFailed(jobId, stepName)
+                return False
+            return self.stepSucceeded(jobId, stepName)
 
-    def stepSucceeded(self, jobId, stepName):
+    def stepSucceeded(self, jobId, stepName, recordDuration=True):
         """
         Call when a step completes successfully.
+
+        Returns False if the step wasn't running, for example because
+        another Girder process already recorded its completion.
+
+        :param recordDuration: Whether to record the duration of the step
+            to estimate the duration of future runs.
+        :type recordDuration: bool
         """
-        with self._lock:
+        with self.jobLock(jobId):
             logprint.info(
                 "DanesfieldWorkflowManager.stepSucceeded Job={} StepName={}".format(
                     jobId, stepName
@@ -390,28 +1084,68 @@ class DanesfieldWorkflowManager:
             )
 
             jobData = self._getJobData(jobId)
-
-            # Record that step completed
-            jobData["runningSteps"].remove(stepName)
-            jobData["completedSteps"].add(stepName)
-
-            # Create working set containing files created by step
-            files = jobData["files"].get(stepName)
-            workingSet = None
-            if files:
-                initialWorkingSet = jobData["workingSets"][DanesfieldStep.INIT]
-                workingSetName = "{}: {}".format(initialWorkingSet["name"], stepName)
-                datasetIds = [file["itemId"] for file in files]
-                workingSet = WorkingSet().createWorkingSet(
-                    name=workingSetName,
-                    parentWorkingSet=initialWorkingSet,
-                    datasetIds=datasetIds,
+            if stepName not in jobData["runningSteps"]:
+                return False
+
+            # Create working set containing files created by step. The
+            # working set is recorded in the same update that unlocks the
+            # successors, so that they never start without it, even when
+            # another Girder process completes their other dependencies.
+            try:
+                datasetIds, workingSet = self._createStepWorkingSet(jobData, stepName)
+            except Exception:
+                # Don't leave the step running forever
+                self.stepFailed(jobId, stepName)
+                raise
+
+            # Record that step completed and unlock its successors
+            successors = self.workflow.successors.get(stepName, [])
+            jobData = WorkflowJob().finishStep(
+                jobId,
+                stepName,
+                successful=True,
+                successors=successors,
+                workingSet=workingSet,
+            )
+            if self._checkJobData(jobId, jobData) is None:
+                # Another Girder process recorded the completion
+                if workingSet is not None:
+                    WorkingSet().remove(workingSet)
+                return False
+
+            startTime = jobData["stepStartTimes"].get(stepName)
+            if recordDuration and startTime is not None:
+                StepDuration().recordDuration(
+                    stepName,
+                    jobId,
+                    (datetime.datetime.utcnow() - startTime).total_seconds(),
                 )
-                jobData["workingSets"][stepName] = workingSet
 
-            # Remove data applicable only while step is running
-            jobData["files"].pop(stepName, None)
-            jobData["groupResult"].pop(stepName, None)
+            if workingSet is not None:
+                # The content of the items may have been replaced, and the
+                # working set of a previous run of the step is replaced
+                previousWorkingSetId = jobData["workingSetIds"].get(stepName)
+                if previousWorkingSetId is not None:
+                    previousWorkingSet = WorkingSet().load(
+                        previousWorkingSetId, force=True
+                    )
+                    if previousWorkingSet is not None:
+                        TileCache().invalidateItems(previousWorkingSet["datasetIds"])
+                TileCache().invalidateItems(datasetIds)
+
+                # Register the output so that runs with the same inputs
+                # reuse it
+                cacheKey = jobData.get("cacheKeys", {}).get(stepName)
+                if cacheKey is not None:
+                    StepResult().recordResult(
+                        cacheKey["key"],
+                        stepName,
+                        datasetIds,
+                        outputPrefix=cacheKey["outputPrefix"],
+                    )
+
+                # Render the map tiles of the output in the background
+                TileCache().prefillItems(datasetIds)
 
             logprint.info(
                 "DanesfieldWorkflowManager.createdWorkingSet Job={} "
@@ -422,21 +1156,78 @@ class DanesfieldWorkflowManager:
                 )
             )
 
+            # Successors become ready once the working set of the step is
+            # recorded
+            readySteps = [
+                successor
+                for successor in successors
+                if jobData["remainingDependencies"].get(successor) == 1
+                and successor not in jobData["completedSteps"]
+                # Steps in streaming mode already started
+                and successor not in jobData["runningSteps"]
+            ]
+            if readySteps:
+                WorkflowJob().addReadySteps(jobId, readySteps)
+
+            return True
+
+    def _createStepWorkingSet(self, jobData, stepName):
+        """
+        Create the working set of the items created by a step.
+
+        :returns: Tuple of the form (item IDs, working set), where the
+            working set is None if the step created no items.
+        """
+        datasetIds = jobData["files"].get(stepName)
+        if datasetIds:
+            # Output uploaded while the step ran may have been removed
+            # since, such as temporary files
+            datasetIds = [
+                item["_id"]
+                for item in Item().find({"_id": {"$in": datasetIds}}, fields=["_id"])
+            ]
+        if not datasetIds:
+            return datasetIds, None
+
+        initialWorkingSet = WorkingSet().load(
+            jobData["workingSetIds"][DanesfieldStep.INIT], force=True, exc=True
+        )
+        workingSet = WorkingSet().createWorkingSet(
+            name="{}: {}".format(initialWorkingSet["name"], stepName),
+            parentWorkingSet=initialWorkingSet,
+            datasetIds=datasetIds,
+        )
+        return datasetIds, workingSet
+
     def stepFailed(self, jobId, stepName):
         """
         Call when a step fails or is canceled.
+
+        Returns False if the step wasn't running, for example because
+        another Girder process already recorded its failure.
         """
-        with self._lock:
+        with self.jobLock(jobId):
             logprint.info(
                 "DanesfieldWorkflowManager.stepFailed Job={} "
                 "StepName={}".format(jobId, stepName)
             )
 
-            jobData = self._getJobData(jobId)
-
             # Record that step failed
-            jobData["runningSteps"].remove(stepName)
-            jobData["failedSteps"].add(stepName)
-
-            if not jobData["runningSteps"]:
+            jobData = WorkflowJob().finishStep(jobId, stepName, successful=False)
+            if self._checkJobData(jobId, jobData) is None:
+                return False
+
+            # Steps in streaming mode that depend on the step fail once
+            # their jobs complete
+            for consumer, streaming in jobData.get("streaming", {}).items():
+                if streaming["dependency"] == stepName:
+                    WorkflowJob().finishStreaming(jobId, consumer, successful=False)
+                    self._finishStreamingStep(jobId, consumer)
+
+            # Steps that don't depend on the failed step keep running, so
+            # only finalize the job if no other step is running or ready
+            jobData = self._getJobData(jobId)
+            if not jobData["runningSteps"] and not jobData["readySteps"]:
                 self.finalizeJob(jobId)
+
+            return True
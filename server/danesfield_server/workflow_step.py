@@ -7,13 +7,17 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
+import hashlib
+import json
+
 from girder.models.file import File
 from girder.models.folder import Folder
 from girder.models.item import Item
 from girder.models.setting import Setting
 
+from .settings import PluginSettings
 from .workflow import DanesfieldWorkflowException
-from .workflow_utilities import fileFromItem
+from .workflow_utilities import fileFromItem, getItems, getOptions
 
 
 class DanesfieldWorkflowStep:
@@ -24,6 +28,15 @@ class DanesfieldWorkflowStep:
     def __init__(self, name):
         self.name = name
         self.dependencies = set()
+        # Dependencies whose output the step can process item by item
+        self.streamingDependencies = set()
+        # Parser of the standard output of the step. The output of steps
+        # without a parser isn't kept.
+        self.outputParser = None
+        # Whether the output of the step depends only on its input files,
+        # its options and the Docker image, so that it can be reused
+        # from a previous run with the same inputs (see getCacheKey)
+        self.cacheable = False
 
     def addDependency(self, name):
         """
@@ -32,6 +45,19 @@ class DanesfieldWorkflowStep:
         """
         self.dependencies.add(name)
 
+    def addStreamingDependency(self, name):
+        """
+        Add a dependency whose output the step can process item by item.
+
+        When the dependency is the only incomplete dependency of the step
+        and it's running, the step runs in streaming mode: rather than
+        calling run() once the dependency completes, runItems() is called
+        on groups of items as the jobs of the dependency create them.
+        Otherwise, the step runs normally.
+        """
+        self.addDependency(name)
+        self.streamingDependencies.add(name)
+
     def run(self, jobInfo, outputFolder):
         """
         Run the step. Subclasses must implement this method.
@@ -41,6 +67,158 @@ class DanesfieldWorkflowStep:
         """
         raise NotImplementedError("Implement in subclass")
 
+    def groupStreamingItems(self, dependency, items, final):
+        """
+        Group items created by a streaming dependency into the inputs of
+        runItems(). Items that aren't part of a group are passed again
+        when the dependency creates more items. By default, each item is
+        processed individually.
+
+        :param dependency: The name of the streaming dependency.
+        :type dependency: str (DanesfieldStep)
+        :param items: Item documents that haven't been processed yet.
+        :type items: list[dict]
+        :param final: Whether the dependency has completed, in which case
+        it won't create more items.
+        :type final: bool
+        :returns: list[list[dict]]
+        """
+        return [[item] for item in items]
+
+    def runItems(self, jobInfo, outputFolder, items):
+        """
+        Run the step in streaming mode on a group of items created by a
+        streaming dependency. Subclasses that have streaming dependencies
+        must implement this method, which must start exactly one job.
+
+        :param jobInfo: The job context in which to run the step.
+        :type jobInfo: JobInfo
+        :param outputFolder: Output folder document.
+        :type outputFolder: dict
+        :param items: Item documents, as grouped by groupStreamingItems().
+        :type items: list[dict]
+        """
+        raise NotImplementedError("Implement in subclass")
+
+    def getOutputPrefix(self, jobInfo):
+        """
+        Get the prefix of the names of the files that the step creates,
+        if the names depend on the job. The prefix is replaced when the
+        output of a previous run is reused.
+
+        :param jobInfo: The job context.
+        :type jobInfo: JobInfo
+        :returns: str or None
+        """
+        return None
+
+    def getCacheKey(self, jobInfo):
+        """
+        Get a key that identifies the inputs of a run of the step: the
+        name of the step, the IDs of the items of the working sets of its
+        dependencies and the SHA-512 checksums of their files, its options
+        and the digest of the Docker image (see
+        PluginSettings.DOCKER_IMAGE_DIGEST). Runs with the same key create
+        the same output.
+
+        Returns None if the step isn't cacheable, the digest of the image
+        isn't configured, an item of a working set doesn't exist or has no
+        files, an input file doesn't have a checksum, or the step has no
+        input files.
+
+        :param jobInfo: The job context.
+        :type jobInfo: JobInfo
+        :returns: str or None
+        """
+        if not self.cacheable:
+            return None
+
+        imageDigest = Setting().get(PluginSettings.DOCKER_IMAGE_DIGEST)
+        if not imageDigest:
+            return None
+
+        inputs = {}
+        for dependency in sorted(self.dependencies):
+            workingSet = jobInfo.workingSets.get(dependency)
+            if workingSet is None:
+                return None
+            try:
+                itemIds = [item["_id"] for item in getItems(workingSet)]
+            except DanesfieldWorkflowException:
+                return None
+            if len(itemIds) != len(workingSet["datasetIds"]):
+                return None
+
+            files = []
+            for file in File().find(
+                {"itemId": {"$in": itemIds}}, fields=["itemId", "sha512"]
+            ):
+                if not file.get("sha512"):
+                    return None
+                files.append((str(file["itemId"]), file["sha512"]))
+            # Each item must have files
+            if {itemId for itemId, _ in files} != {str(itemId) for itemId in itemIds}:
+                return None
+            inputs[dependency] = sorted(files)
+
+        if not any(inputs.values()):
+            return None
+
+        key = {
+            "step": self.name,
+            "inputs": inputs,
+            "options": getOptions(self.name, jobInfo),
+            "image": imageDigest,
+        }
+        return hashlib.sha512(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def estimateJobCount(self, workingSets):
+        """
+        Estimate the number of Girder Worker jobs that the step runs, for
+        planning. Composite steps override this method. Only the working
+        sets that exist before the workflow runs are available.
+
+        :param workingSets: Existing working sets, indexed by step name.
+        :type workingSets: dict
+        :returns: int
+        """
+        return 1
+
+    def estimateInputBytes(self, workingSets):
+        """
+        Estimate the number of bytes of input files that the step stages,
+        for planning. By default, counts the files of the working sets of
+        the dependencies of the step. Returns None if a dependency doesn't
+        have a working set yet.
+
+        :param workingSets: Existing working sets, indexed by step name.
+        :type workingSets: dict
+        :returns: int or None
+        """
+        total = 0
+        for dependency in self.dependencies:
+            workingSet = workingSets.get(dependency)
+            if workingSet is None:
+                return None
+            total += self.getFileBytes(workingSet)
+        return total
+
+    def getFileBytes(self, workingSet, condition=None):
+        """
+        Get the total size of the files in a working set.
+
+        :param workingSet: The working set containing the files.
+        :type workingSet: dict
+        :param condition: An optional condition that items in the
+        working set must meet.
+        :type condition: callable
+        """
+        itemIds = [item["_id"] for item in getItems(workingSet, condition)]
+        return sum(
+            file["size"]
+            for file in File().find({"itemId": {"$in": itemIds}}, fields=["size"])
+        )
+
     def getSingleFile(self, workingSet, condition=None):
         """
         Get a single file from a working set. An exception is raised if the
@@ -27,6 +27,12 @@ class FitDtmStep(DanesfieldWorkflowStep):
     def __init__(self):
         super(FitDtmStep, self).__init__(DanesfieldStep.FIT_DTM)
         self.addDependency(DanesfieldStep.GENERATE_DSM)
+        self.cacheable = True
+
+    def getOutputPrefix(self, jobInfo):
+        # Replace whitespace in the working set name with underscores
+        initWorkingSet = getWorkingSet(DanesfieldStep.INIT, jobInfo)
+        return re.sub("\\s", "_", initWorkingSet["name"])
 
     def run(self, jobInfo, outputFolder):
         # Get working sets
@@ -39,8 +45,7 @@ class FitDtmStep(DanesfieldWorkflowStep):
         # Get options
         fitDtmOptions = getOptions(self.name, jobInfo)
 
-        # Set output prefix; replacing whitespace with underscores
-        outputPrefix = re.sub("\\s", "_", initWorkingSet["name"])
+        outputPrefix = self.getOutputPrefix(jobInfo)
 
         # Run algorithm
         fitDtm(
@@ -26,6 +26,12 @@ class GenerateDsmStep(DanesfieldWorkflowStep):
     def __init__(self):
         super(GenerateDsmStep, self).__init__(DanesfieldStep.GENERATE_DSM)
         self.addDependency(DanesfieldStep.GENERATE_POINT_CLOUD)
+        self.cacheable = True
+
+    def getOutputPrefix(self, jobInfo):
+        # Replace whitespace in the working set name with underscores
+        initWorkingSet = getWorkingSet(DanesfieldStep.INIT, jobInfo)
+        return re.sub("\\s", "_", initWorkingSet["name"])
 
     def run(self, jobInfo, outputFolder):
         # Get working sets
@@ -40,8 +46,7 @@ class GenerateDsmStep(DanesfieldWorkflowStep):
         # Get options
         generateDsmOptions = getOptions(self.name, jobInfo)
 
-        # Set output prefix; replacing whitespace with underscores
-        outputPrefix = re.sub("\\s", "_", initWorkingSet["name"])
+        outputPrefix = self.getOutputPrefix(jobInfo)
 
         # Run algorithm
         generateDsm(
@@ -7,10 +7,11 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-from ..algorithms import msiToRgb
+from ..algorithms import msiToRgb, msiToRgbImage
 from ..constants import DanesfieldStep
 from ..workflow_step import DanesfieldWorkflowStep
-from ..workflow_utilities import getOptions, getWorkingSet
+from .pansharpen import PansharpenStep
+from ..workflow_utilities import fileFromItem, getOptions, getWorkingSet
 
 
 class MsiToRgbStep(DanesfieldWorkflowStep):
@@ -25,7 +26,12 @@ class MsiToRgbStep(DanesfieldWorkflowStep):
 
     def __init__(self):
         super(MsiToRgbStep, self).__init__(DanesfieldStep.MSI_TO_RGB)
-        self.addDependency(DanesfieldStep.PANSHARPEN)
+        # Convert each pansharpened image as soon as it's created
+        self.addStreamingDependency(DanesfieldStep.PANSHARPEN)
+
+    def estimateJobCount(self, workingSets):
+        # One job per pansharpened image
+        return PansharpenStep.countImagePairs(workingSets[DanesfieldStep.INIT])
 
     def run(self, jobInfo, outputFolder):
         # Get working set
@@ -48,3 +54,17 @@ class MsiToRgbStep(DanesfieldWorkflowStep):
             imageFiles=imageFiles,
             **msiToRgbOptions
         )
+
+    def runItems(self, jobInfo, outputFolder, items):
+        initWorkingSet = getWorkingSet(DanesfieldStep.INIT, jobInfo)
+
+        # Run algorithm on a single pansharpened MSI image
+        msiToRgbImage(
+            initWorkingSetName=initWorkingSet["name"],
+            stepName=self.name,
+            requestInfo=jobInfo.requestInfo,
+            jobId=jobInfo.jobId,
+            outputFolder=outputFolder,
+            imageFile=fileFromItem(items[0]),
+            **getOptions(self.name, jobInfo)
+        )
@@ -10,7 +10,7 @@
 from ..algorithms import orthorectify
 from ..constants import DanesfieldStep
 from ..workflow_step import DanesfieldWorkflowStep
-from ..workflow_utilities import getOptions, getWorkingSet, isMsiImage
+from ..workflow_utilities import getItems, getOptions, getWorkingSet, isMsiImage
 
 
 class OrthorectifyStep(DanesfieldWorkflowStep):
@@ -28,6 +28,16 @@ class OrthorectifyStep(DanesfieldWorkflowStep):
         self.addDependency(DanesfieldStep.GENERATE_DSM)
         self.addDependency(DanesfieldStep.FIT_DTM)
 
+    def estimateJobCount(self, workingSets):
+        # One job per MSI source image
+        return len(getItems(workingSets[DanesfieldStep.INIT], isMsiImage))
+
+    def estimateInputBytes(self, workingSets):
+        total = super(OrthorectifyStep, self).estimateInputBytes(workingSets)
+        if total is None:
+            return None
+        return total + self.getFileBytes(workingSets[DanesfieldStep.INIT], isMsiImage)
+
     def run(self, jobInfo, outputFolder):
         # Get working sets
         initWorkingSet = getWorkingSet(DanesfieldStep.INIT, jobInfo)
@@ -7,10 +7,20 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-from ..algorithms import pansharpen
+from girder import logprint
+
+from ..algorithms import pansharpen, pansharpenImagePair
 from ..constants import DanesfieldStep
+from ..utilities import getPrefix
 from ..workflow_step import DanesfieldWorkflowStep
-from ..workflow_utilities import getOptions, getWorkingSet, isMsiImage, isPanImage
+from ..workflow_utilities import (
+    fileFromItem,
+    getItems,
+    getOptions,
+    getWorkingSet,
+    isMsiImage,
+    isPanImage,
+)
 
 
 class PansharpenStep(DanesfieldWorkflowStep):
@@ -23,7 +33,26 @@ class PansharpenStep(DanesfieldWorkflowStep):
 
     def __init__(self):
         super(PansharpenStep, self).__init__(DanesfieldStep.PANSHARPEN)
-        self.addDependency(DanesfieldStep.ORTHORECTIFY)
+        # Pansharpen each pair of images as soon as both are orthorectified
+        self.addStreamingDependency(DanesfieldStep.ORTHORECTIFY)
+
+    @staticmethod
+    def countImagePairs(workingSet):
+        """
+        Count the prefixes of the images in a working set that have both
+        a PAN and an MSI image. One pansharpened image is created per pair.
+        """
+        panPrefixes = {
+            getPrefix(item["name"]) for item in getItems(workingSet, isPanImage)
+        }
+        msiPrefixes = {
+            getPrefix(item["name"]) for item in getItems(workingSet, isMsiImage)
+        }
+        return len((panPrefixes & msiPrefixes) - {None})
+
+    def estimateJobCount(self, workingSets):
+        # One job per pair of orthorectified images
+        return self.countImagePairs(workingSets[DanesfieldStep.INIT])
 
     def run(self, jobInfo, outputFolder):
         # Get working set
@@ -48,3 +77,40 @@ class PansharpenStep(DanesfieldWorkflowStep):
             imageFiles=imageFiles,
             **pansharpenOptions
         )
+
+    def groupStreamingItems(self, dependency, items, final):
+        # Group pairs of PAN and MSI images by prefix
+        pairs = {}
+        for item in items:
+            if isPanImage(item):
+                pairs.setdefault(getPrefix(item["name"]), {})["pan"] = item
+            elif isMsiImage(item):
+                pairs.setdefault(getPrefix(item["name"]), {})["msi"] = item
+
+        groups = []
+        for prefix, pair in pairs.items():
+            if prefix is not None and len(pair) == 2:
+                groups.append([pair["pan"], pair["msi"]])
+            elif final:
+                logprint.info(
+                    "Step: {} -- Warning: Don't have both PAN and MSI "
+                    "images for: {}".format(self.name, prefix)
+                )
+        return groups
+
+    def runItems(self, jobInfo, outputFolder, items):
+        initWorkingSet = getWorkingSet(DanesfieldStep.INIT, jobInfo)
+        panItem, msiItem = items
+
+        # Run algorithm on a single pair of images
+        pansharpenImagePair(
+            initWorkingSetName=initWorkingSet["name"],
+            stepName=self.name,
+            requestInfo=jobInfo.requestInfo,
+            jobId=jobInfo.jobId,
+            outputFolder=outputFolder,
+            prefix=getPrefix(msiItem["name"]),
+            panImageFile=fileFromItem(panItem),
+            msiImageFile=fileFromItem(msiItem),
+            **getOptions(self.name, jobInfo)
+        )
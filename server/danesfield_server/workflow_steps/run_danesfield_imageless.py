@@ -7,30 +7,32 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-import os
-import tempfile
 from typing import Dict
 
-from danesfield_server.algorithms.generate_point_cloud import ResultRunDockerCommand
 from danesfield_server.workflow import DanesfieldWorkflowException
 
 from docker.types import DeviceRequest
 from girder.models.collection import Collection
 from girder.models.folder import Folder
 from girder.models.user import User
-from girder_worker.docker.tasks import docker_run
-from girder_worker.docker.transforms.girder import (
-    GirderUploadVolumePathToFolder,
-)
-from girder_worker.docker.transforms import BindMountVolume, VolumePath
 
 from danesfield_server.algorithms.common import (
     addJobInfo,
     createDockerRunArguments,
     createGirderClient,
+    createModelVolume,
+    dispatchDockerRun,
+    stageFile,
+)
+from danesfield_server.algorithms.scratch import ScratchWorkspace
+from danesfield_server.algorithms.staging import (
+    GirderFilesToVolume,
+    TemplateFileToVolume,
 )
+from danesfield_server.algorithms.upload import StreamingUploadVolume
 
 from ..constants import DanesfieldStep, DockerImage
+from ..model_registry import getModelsFolder
 from ..workflow_step import DanesfieldWorkflowStep
 from ..workflow_utilities import getWorkingSet
 from ..models.workingSet import WorkingSet
@@ -48,6 +50,27 @@ class RunDanesfieldImageless(DanesfieldWorkflowStep):
         super(RunDanesfieldImageless, self).__init__("Imageless")
         self.addDependency(DanesfieldStep.GENERATE_POINT_CLOUD)
 
+    def getModelsFolder(self):
+        """
+        Get the folder containing the models used by the workflow.
+        """
+        modelsFolder = getModelsFolder()
+        if modelsFolder is None:
+            raise DanesfieldWorkflowException(
+                "Models folder has not been created and populated"
+            )
+        return modelsFolder
+
+    def estimateInputBytes(self, workingSets):
+        total = super(RunDanesfieldImageless, self).estimateInputBytes(workingSets)
+        if total is None:
+            return None
+        try:
+            modelsFolder = self.getModelsFolder()
+        except DanesfieldWorkflowException:
+            return None
+        return total + Folder().getSizeRecursive(modelsFolder)
+
     def run(self, jobInfo, outputFolder):
         gc = createGirderClient(jobInfo.requestInfo)
         baseWorkingSet: Dict = getWorkingSet(DanesfieldStep.INIT, jobInfo)
@@ -65,64 +88,58 @@ class RunDanesfieldImageless(DanesfieldWorkflowStep):
             reuseExisting=True,
         )
 
-        modelsFolder = Folder().findOne(
-            {
-                "parentId": core3dCollection["_id"],
-                "name": "models",
-            }
-        )
-        if modelsFolder is None:
-            raise DanesfieldWorkflowException(
-                "Models folder has not been created and populated"
-            )
+        modelsFolder = self.getModelsFolder()
 
-        # Download models folder
-        models_folder = tempfile.mkdtemp()
-        modelsFolderVolume = BindMountVolume(models_folder, models_folder)
-        gc.downloadFolderRecursive(modelsFolder["_id"], models_folder)
+        # Inputs are downloaded on the worker. Models are cached on the
+        # worker host and mounted read-only.
+        modelsVolume = createModelVolume(gc, modelsFolder)
 
         # Get single file, there will only be one
-        point_cloud_path = tempfile.mktemp(suffix=".las")
         pointCloudFile = self.getFiles(pointCloudWorkingSet)[0]
-        gc.downloadFile(str(pointCloudFile["_id"]), point_cloud_path)
-        pointCloudFileVolume = BindMountVolume(point_cloud_path, point_cloud_path)
+        pointCloudPath = stageFile(gc, pointCloudFile, filename="point_cloud.las")
+
+        # Work directory in the scratch space of the worker, removed once
+        # the job completes
+        workspace = ScratchWorkspace(
+            jobInfo.jobId, expectedBytes=pointCloudFile["size"]
+        )
 
-        # Create output dir
-        outputDir = tempfile.mkdtemp()
-        outputDirVolume = BindMountVolume(host_path=outputDir, container_path=outputDir)
+        # Name prefix for output files, escaped for the config template
+        aoiName = baseWorkingSet["name"].replace(" ", "_").replace("$", "$$")
 
-        # Create config file
-        config_file, config_file_path = tempfile.mkstemp(suffix=".ini")
-        configFileVolume = BindMountVolume(config_file_path, config_file_path)
-        with open(config_file, "w") as in_config_file:
+        # Config file is written on the worker
+        configTemplate = (
             # Configure paths
-            paths_section = (
-                "[paths]\n"
-                + f"p3d_fpath = {point_cloud_path}\n"
-                + f"work_dir = {outputDir}\n"
-                # Supply empty dir so no errors are generated
-                + f"rpc_dir = {tempfile.mkdtemp()}\n"
-            )
-            in_config_file.write(f"{paths_section}\n")
-
+            "[paths]\n"
+            "p3d_fpath = $p3d_fpath\n"
+            "work_dir = $work_dir\n"
+            # Supply empty dir so no errors are generated
+            "rpc_dir = $rpc_dir\n"
+            "\n"
             # Set name prefix for output files
-            aoi_section = (
-                "[aoi]\n" + f"name = {baseWorkingSet['name'].replace(' ', '_')}"
-            )
-            in_config_file.write(f"{aoi_section}\n")
-
+            "[aoi]\n"
+            f"name = {aoiName}\n"
+            "\n"
             # Ground sample distancy of output imagery in meters per pixel
             # Default is 0.25
-            params_section = "[params]\n" + "gsd = 0.25\n"
-            in_config_file.write(f"{params_section}\n")
-
+            "[params]\n"
+            "gsd = 0.25\n"
+            "\n"
             # Parameters for the roof geon extraction step
-            roof_section = (
-                "[roof]\n"
-                + f"model_dir = {models_folder}/Columbia Geon Segmentation Model\n"
-                + "model_prefix = dayton_geon"
-            )
-            in_config_file.write(f"{roof_section}\n")
+            "[roof]\n"
+            "model_dir = $models_dir/Columbia Geon Segmentation Model\n"
+            "model_prefix = dayton_geon\n"
+        )
+        configFile = TemplateFileToVolume(
+            configTemplate,
+            filename="config.ini",
+            substitutions={
+                "p3d_fpath": pointCloudPath,
+                "rpc_dir": GirderFilesToVolume([], dirname="rpc", gc=gc),
+                "models_dir": modelsVolume,
+                "work_dir": workspace,
+            },
+        )
 
         # Ensure folder exists
         existing_folder_id = baseWorkingSet.get("output_folder_id")
@@ -137,35 +154,31 @@ class RunDanesfieldImageless(DanesfieldWorkflowStep):
             baseWorkingSet["output_folder_id"] = output_folder["_id"]
             WorkingSet().save(baseWorkingSet)
 
+        # Output files are uploaded while the container runs. The rasters
+        # displayed by the map views are converted to COGs.
+        outputVolume = StreamingUploadVolume(
+            workspace, existing_folder_id, cloudOptimize=True, gc=gc
+        )
+
         containerArgs = [
             "python",
             "/danesfield/tools/run_danesfield.py",
-            config_file_path,
+            configFile,
         ]
 
         resultHooks = [
-            # - Fix output folder permissions
-            ResultRunDockerCommand(
-                DockerImage.DANESFIELD,
-                command=["chown", "-R", f"{os.getuid()}:{os.getgid()}", outputDir],
-                volumes=outputDirVolume._repr_json_(),
-            ),
-            # Upload results
-            GirderUploadVolumePathToFolder(
-                VolumePath(".", volume=outputDirVolume),
-                existing_folder_id,
-            ),
+            # Upload remaining results
+            outputVolume.finish(),
+            # Remove the work directory
+            workspace.release(),
         ]
 
-        asyncResult = docker_run.delay(
+        asyncResult = dispatchDockerRun(
+            self.name,
             device_requests=[DeviceRequest(count=-1, capabilities=[["gpu"]])],
             shm_size="8G",
-            volumes=[
-                pointCloudFileVolume,
-                configFileVolume,
-                outputDirVolume,
-                modelsFolderVolume,
-            ],
+            # Inputs used in the configuration file are mounted explicitly
+            volumes=[outputVolume, modelsVolume, pointCloudPath],
             **createDockerRunArguments(
                 image=f"{DockerImage.DANESFIELD}:latest",
                 containerArgs=containerArgs,
@@ -7,11 +7,9 @@
 # See accompanying Copyright.txt and LICENSE files for details
 ###############################################################################
 
-import os
-
 from ..algorithms import selectBest
 from ..constants import DanesfieldStep
-from ..utilities import getPrefix
+from ..output_parsers import RegexOutputParser
 from ..workflow_step import DanesfieldWorkflowStep
 from ..workflow_utilities import getOptions, getWorkingSet, isPanImage
 
@@ -27,6 +25,10 @@ class SelectBestStep(DanesfieldWorkflowStep):
     def __init__(self):
         super(SelectBestStep, self).__init__(DanesfieldStep.SELECT_BEST)
         self.addDependency(DanesfieldStep.GENERATE_DSM)
+        # Keep the prefixes of the image file names in the output, in order
+        self.outputParser = RegexOutputParser(
+            r"([0-9]{2}[A-Z]{3}[0-9]{8})[-_][^/]*$", group=1, maxMatches=100
+        )
 
     def run(self, jobInfo, outputFolder):
         # Get working sets
@@ -58,15 +60,8 @@ class SelectBestStep(DanesfieldWorkflowStep):
     @staticmethod
     def getImagePrefixes(output):
         """
-        Parse output from select_best and return generator of image prefixes.
-        Output argument is a list of strings, where each string may contain
-        multiple lines.
+        Return generator of image prefixes from the parsed output of
+        select_best. The output is the list of prefixes extracted by the
+        output parser of the step.
         """
-        prefix = None
-        for group in output:
-            lines = group.splitlines()
-            for line in lines:
-                filename = os.path.basename(line)
-                prefix = getPrefix(filename)
-                if prefix is not None:
-                    yield prefix
+        return iter(output)
@@ -8,9 +8,14 @@
 ###############################################################################
 
 import os
+import re
 
+from bson.objectid import ObjectId
+
+from girder import logprint
 from girder.models.item import Item
 
+from .models.workingSet import WorkingSet
 from .utilities import hasExtension
 from .workflow import DanesfieldWorkflowException
 
@@ -165,6 +170,58 @@ def isCroppedAndPansharpend(item):
     return hasExtension(item, "_crop_pansharpened_processed.tif")
 
 
+def getStepWorkingSets(workingSet):
+    """
+    Get the working sets created by previous runs of the workflow on a
+    working set, indexed by step name. Steps that have a working set don't
+    need to run again.
+
+    Child working sets are named "<working set name>: <step name>".
+
+    :param workingSet: Source image working set.
+    :type workingSet: dict
+    """
+    workingSets = {}
+    stepNameRe = re.compile(".*:\\s(.*)")
+    for ws in WorkingSet().find({"parentWorkingSetId": workingSet["_id"]}):
+        match = re.match(stepNameRe, ws["name"])
+        if match:
+            workingSets[match.group(1)] = ws
+        else:
+            logprint.warning(
+                "getStepWorkingSets: Unable to parse step name "
+                "WorkingSetName={}".format(ws["name"])
+            )
+    return workingSets
+
+
+def getItems(workingSet, condition=None):
+    """
+    Get the items of a working set with a single query, in the order of
+    the working set. Raise an exception if an item doesn't exist.
+
+    :param workingSet: The working set containing the items.
+    :type workingSet: dict
+    :param condition: An optional condition that items must meet.
+    :type condition: callable
+    """
+    # Working sets created through the REST API store the IDs as strings
+    itemIds = [ObjectId(itemId) for itemId in workingSet["datasetIds"]]
+    items = {item["_id"]: item for item in Item().find({"_id": {"$in": itemIds}})}
+    missingIds = [itemId for itemId in itemIds if itemId not in items]
+    if missingIds:
+        raise DanesfieldWorkflowException(
+            "Items of working set {} not found: {}".format(
+                workingSet["_id"], [str(itemId) for itemId in missingIds]
+            )
+        )
+    return [
+        items[itemId]
+        for itemId in itemIds
+        if condition is None or condition(items[itemId])
+    ]
+
+
 def getWorkingSet(stepName, jobInfo):
     """
     Get a specific working set by step name. Raise an error if the
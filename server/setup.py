@@ -28,6 +28,11 @@ setup(
     ],
     entry_points={
         "girder.plugin": ["danesfield = danesfield_server:DanesfieldPlugin"],
+        # The worker plugin imports the danesfield_server package, so Girder
+        # is also required on worker hosts
+        "girder_worker_plugins": [
+            "danesfield = danesfield_server.worker_plugin:DanesfieldWorkerPlugin"
+        ],
     },
     author="Kitware Inc",
     author_email="",
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import pytest
+from bson.objectid import ObjectId
+
+from danesfield_server.models.batch import Batch
+
+
+@pytest.fixture
+def batch(db, admin):
+    jobs = [
+        {"jobId": jobId, "workingSetId": ObjectId(), "options": {}}
+        for jobId in ("job1", "job2", "job3")
+    ]
+    return Batch().createBatch(ObjectId(), admin, jobs, maxRunningJobs=2)
+
+
+def testStartJobRespectsBudget(batch):
+    # Jobs start in submission order until the budget is used
+    assert Batch().startJob(batch["_id"]) == "job1"
+    assert Batch().startJob(batch["_id"]) == "job2"
+    assert Batch().startJob(batch["_id"]) is None
+
+    doc = Batch().load(batch["_id"], force=True)
+    assert doc["pendingJobIds"] == ["job3"]
+    assert doc["runningJobIds"] == ["job1", "job2"]
+    assert doc["runningCount"] == 2
+
+    # A finished job lets the next job start
+    assert Batch().finishJob(batch["_id"], "job1", successful=True) is not None
+    assert Batch().finishJob(batch["_id"], "job1", successful=True) is None
+    assert Batch().startJob(batch["_id"]) == "job3"
+    assert Batch().startJob(batch["_id"]) is None
+
+    doc = Batch().load(batch["_id"], force=True)
+    assert doc["pendingJobIds"] == []
+    assert doc["runningJobIds"] == ["job2", "job3"]
+    assert doc["completedJobIds"] == ["job1"]
+    assert doc["runningCount"] == 2
+
+
+def testResumeJob(batch):
+    Batch().startJob(batch["_id"])
+    Batch().startJob(batch["_id"])
+    Batch().finishJob(batch["_id"], "job1", successful=False)
+    assert Batch().startJob(batch["_id"]) == "job3"
+
+    # Resumed jobs run regardless of the budget
+    assert Batch().resumeJob(batch["_id"], "job1") is not None
+    assert Batch().resumeJob(batch["_id"], "job1") is None
+    doc = Batch().load(batch["_id"], force=True)
+    assert doc["failedJobIds"] == []
+    assert doc["runningJobIds"] == ["job2", "job3", "job1"]
+    assert doc["runningCount"] == 3
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import io
+
+import pytest
+from bson.objectid import ObjectId
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.setting import Setting
+from girder.models.upload import Upload
+
+from danesfield_server.constants import DanesfieldStep
+from danesfield_server.job_info import JobInfo
+from danesfield_server.request_info import RequestInfo
+from danesfield_server.settings import PluginSettings
+from danesfield_server.workflow_step import DanesfieldWorkflowStep
+
+
+@pytest.fixture
+def folder(server, admin, fsAssetstore):
+    Setting().set(PluginSettings.DOCKER_IMAGE_DIGEST, "sha256:0123")
+    return Folder().createFolder(
+        admin, "inputs", parentType="user", creator=admin, reuseExisting=True
+    )
+
+
+@pytest.fixture
+def step():
+    step = DanesfieldWorkflowStep("step")
+    step.addDependency(DanesfieldStep.INIT)
+    step.cacheable = True
+    return step
+
+
+def createItem(folder, admin, name, content=None):
+    item = Item().createItem(name, admin, folder)
+    if content is not None:
+        Upload().uploadFromFile(
+            io.BytesIO(content),
+            len(content),
+            name,
+            parentType="item",
+            parent=item,
+            user=admin,
+        )
+    return item
+
+
+def createJobInfo(admin, items, options=None):
+    # Working sets created through the REST API store the IDs as strings
+    workingSet = {
+        "_id": ObjectId(),
+        "datasetIds": [str(item["_id"]) for item in items],
+    }
+    return JobInfo(
+        jobId="job",
+        requestInfo=RequestInfo(admin, "http://localhost/api/v1", "token"),
+        workingSets={DanesfieldStep.INIT: workingSet},
+        standardOutput={},
+        outputFolder={"_id": ObjectId()},
+        options=options or {},
+    )
+
+
+@pytest.mark.plugin("danesfield")
+def testCacheKeyDependsOnInputs(folder, admin, step):
+    item1 = createItem(folder, admin, "item1", b"content1")
+    item2 = createItem(folder, admin, "item2", b"content2")
+
+    key = step.getCacheKey(createJobInfo(admin, [item1, item2]))
+    assert key is not None
+    # The order of the items doesn't matter
+    assert step.getCacheKey(createJobInfo(admin, [item2, item1])) == key
+
+    # Items with the same content are different inputs
+    item3 = createItem(folder, admin, "item3", b"content2")
+    assert step.getCacheKey(createJobInfo(admin, [item1, item3])) != key
+
+    # Options are part of the key
+    options = {"step": {"parameter": 1}}
+    assert step.getCacheKey(createJobInfo(admin, [item1, item2], options)) != key
+
+    # So is the Docker image
+    Setting().set(PluginSettings.DOCKER_IMAGE_DIGEST, "sha256:4567")
+    assert step.getCacheKey(createJobInfo(admin, [item1, item2])) != key
+
+
+@pytest.mark.plugin("danesfield")
+def testNoCacheKey(folder, admin, step):
+    item = createItem(folder, admin, "item", b"content")
+    jobInfo = createJobInfo(admin, [item])
+    assert step.getCacheKey(jobInfo) is not None
+
+    # No input files
+    assert step.getCacheKey(createJobInfo(admin, [])) is None
+
+    # Item without files
+    emptyItem = createItem(folder, admin, "empty")
+    assert step.getCacheKey(createJobInfo(admin, [item, emptyItem])) is None
+
+    # Missing item
+    Item().remove(emptyItem)
+    assert step.getCacheKey(createJobInfo(admin, [item, emptyItem])) is None
+
+    # Step that isn't cacheable
+    step.cacheable = False
+    assert step.getCacheKey(jobInfo) is None
+    step.cacheable = True
+
+    # Image digest isn't configured
+    Setting().set(PluginSettings.DOCKER_IMAGE_DIGEST, "")
+    assert step.getCacheKey(jobInfo) is None
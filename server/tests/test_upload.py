@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import os
+
+from bson.objectid import ObjectId
+
+from danesfield_server.algorithms.upload import StreamingUploader
+
+
+class FakeGirderClient:
+    """
+    Girder client that records the items of a folder tree in memory.
+    """
+
+    def __init__(self):
+        # Items as dicts with the keys _id, folderId, name and content, by ID
+        self.items = {}
+        self.folders = {}
+        self.uploads = []
+
+    def createFolder(self, parentId, name, reuseExisting=False):
+        key = (parentId, name)
+        if key not in self.folders:
+            self.folders[key] = {"_id": str(ObjectId()), "name": name}
+        return self.folders[key]
+
+    def listItem(self, folderId, name=None):
+        return [
+            item
+            for item in self.items.values()
+            if item["folderId"] == folderId and item["name"] == name
+        ]
+
+    def listFile(self, itemId):
+        return [{"_id": itemId, "itemId": itemId}]
+
+    def uploadFile(self, parentId, stream, name, size, parentType, reference):
+        itemId = str(ObjectId())
+        self.items[itemId] = {
+            "_id": itemId,
+            "folderId": parentId,
+            "name": name,
+            "content": stream.read(size),
+        }
+        self.uploads.append(name)
+        return {"_id": itemId, "itemId": itemId}
+
+    def uploadFileContents(self, fileId, stream, size, reference):
+        self.items[fileId]["content"] = stream.read(size)
+        self.uploads.append(self.items[fileId]["name"])
+
+    def addMetadataToItem(self, itemId, metadata):
+        self.items[itemId].setdefault("meta", {}).update(metadata)
+
+    def delete(self, path):
+        del self.items[path.split("/")[1]]
+
+
+def write(directory, relativePath, content):
+    path = os.path.join(directory, relativePath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def contents(gc):
+    return sorted((item["name"], item["content"]) for item in gc.items.values())
+
+
+def testFinalPassUploadsRemainingFiles(tmp_path):
+    gc = FakeGirderClient()
+    directory = str(tmp_path)
+    # Files that were just written aren't uploaded while the container runs
+    uploader = StreamingUploader(gc, directory, "folder", quietPeriod=3600)
+    write(directory, "a.txt", b"a")
+    write(directory, "sub/b.txt", b"b")
+    uploader._poll()
+    uploader._wait()
+    assert gc.items == {}
+
+    uploader.finish()
+    assert contents(gc) == [("a.txt", b"a"), ("b.txt", b"b")]
+    subfolder = gc.folders[("folder", "sub")]
+    assert {item["folderId"] for item in gc.items.values()} == {
+        "folder",
+        subfolder["_id"],
+    }
+    assert uploader.streamedFiles == 0
+    assert uploader.finalFiles == 2
+    assert uploader.uploadedBytes == 2
+
+
+def testFinalPassUploadsChangedFiles(tmp_path):
+    gc = FakeGirderClient()
+    directory = str(tmp_path)
+    uploader = StreamingUploader(gc, directory, "folder", quietPeriod=0)
+    write(directory, "a.txt", b"a")
+    write(directory, "b.txt", b"b")
+    uploader._poll()
+    uploader._wait()
+    assert uploader.streamedFiles == 2
+
+    # Only the file that changed is uploaded again, into the same item
+    write(directory, "a.txt", b"changed")
+    uploader.finish()
+    assert contents(gc) == [("a.txt", b"changed"), ("b.txt", b"b")]
+    assert sorted(gc.uploads) == ["a.txt", "a.txt", "b.txt"]
+    assert uploader.finalFiles == 1
+
+
+def testFinalPassRemovesDeletedFiles(tmp_path):
+    gc = FakeGirderClient()
+    directory = str(tmp_path)
+    uploader = StreamingUploader(gc, directory, "folder", quietPeriod=0)
+    write(directory, "a.txt", b"a")
+    write(directory, "temporary.txt", b"temporary")
+    uploader._poll()
+    uploader._wait()
+
+    os.remove(os.path.join(directory, "temporary.txt"))
+    uploader.finish()
+    assert contents(gc) == [("a.txt", b"a")]
+    assert uploader.removedFiles == 1
+
+
+def testUploadReplacesExistingItems(tmp_path):
+    gc = FakeGirderClient()
+    directory = str(tmp_path)
+    write(directory, "a.txt", b"first run")
+    StreamingUploader(gc, directory, "folder").finish()
+
+    # Running the task again replaces the content of the item
+    write(directory, "a.txt", b"second run")
+    StreamingUploader(gc, directory, "folder").finish()
+    assert contents(gc) == [("a.txt", b"second run")]
+
+
+def testGeoTiffsWaitForFinalPass(tmp_path):
+    gc = FakeGirderClient()
+    directory = str(tmp_path)
+    # GeoTIFFs are converted to COGs before they're uploaded
+    uploader = StreamingUploader(
+        gc, directory, "folder", quietPeriod=0, cloudOptimize=True
+    )
+    write(directory, "a.txt", b"a")
+    write(directory, "b.tif", b"b")
+    uploader._poll()
+    uploader._wait()
+    assert contents(gc) == [("a.txt", b"a")]
+    uploader.cancel()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import pytest
+
+from danesfield_server.constants import DanesfieldStep
+from danesfield_server.workflow import DanesfieldWorkflow, DanesfieldWorkflowException
+from danesfield_server.workflow_step import DanesfieldWorkflowStep
+
+
+def createStep(name, dependencies=()):
+    step = DanesfieldWorkflowStep(name)
+    for dependency in dependencies:
+        step.addDependency(dependency)
+    return step
+
+
+def createWorkflow(steps):
+    workflow = DanesfieldWorkflow()
+    for name, dependencies in steps:
+        workflow.addStep(createStep(name, dependencies))
+    return workflow
+
+
+def testCompileOrdersSteps():
+    # Declared out of dependency order
+    workflow = createWorkflow(
+        [
+            ("c", ["a", "b"]),
+            ("a", [DanesfieldStep.INIT]),
+            ("b", ["a"]),
+            ("d", [DanesfieldStep.INIT]),
+        ]
+    )
+    workflow.compile()
+
+    order = [step.name for step in workflow.order]
+    assert sorted(order) == ["a", "b", "c", "d"]
+    assert order.index("a") < order.index("b") < order.index("c")
+    # Declaration order is kept between independent steps
+    assert order.index("a") < order.index("d")
+
+    assert workflow.stepsByName["b"].name == "b"
+    assert sorted(workflow.successors["a"]) == ["b", "c"]
+    assert workflow.successors["c"] == []
+    assert sorted(workflow.successors[DanesfieldStep.INIT]) == ["a", "d"]
+
+
+def testCompileAllowsDeclaredInputs():
+    workflow = createWorkflow([("a", [DanesfieldStep.GENERATE_POINT_CLOUD])])
+    workflow.addInput(DanesfieldStep.GENERATE_POINT_CLOUD)
+    workflow.compile()
+
+    assert [step.name for step in workflow.order] == ["a"]
+    assert workflow.successors[DanesfieldStep.GENERATE_POINT_CLOUD] == ["a"]
+
+
+@pytest.mark.parametrize(
+    "steps,message",
+    [
+        ([("a", []), ("a", [])], "Duplicate step 'a'"),
+        ([(DanesfieldStep.INIT, [])], "Duplicate step"),
+        ([("a", ["b"])], "depends on unknown step 'b'"),
+        ([("a", ["c"]), ("b", ["a"]), ("c", ["b"])], "Dependency cycle"),
+    ],
+)
+def testCompileRejectsInvalidWorkflows(steps, message):
+    workflow = createWorkflow(steps)
+    with pytest.raises(DanesfieldWorkflowException, match=message):
+        workflow.compile()
+    assert workflow.order is None
+
+
+def testGetStep():
+    workflow = createWorkflow([("a", [])])
+    with pytest.raises(DanesfieldWorkflowException, match="not compiled"):
+        workflow.getStep("a")
+
+    workflow.compile()
+    assert workflow.getStep("a").name == "a"
+    with pytest.raises(DanesfieldWorkflowException, match="Unknown step"):
+        workflow.getStep("b")
+
+
+def testGetCriticalPathLengths():
+    workflow = createWorkflow(
+        [
+            ("a", [DanesfieldStep.INIT]),
+            ("b", ["a"]),
+            ("c", ["a"]),
+            ("d", ["b", "c"]),
+        ]
+    )
+    with pytest.raises(DanesfieldWorkflowException, match="not compiled"):
+        workflow.getCriticalPathLengths({})
+
+    workflow.compile()
+    lengths = workflow.getCriticalPathLengths({"a": 1.0, "b": 10.0, "c": 2.0})
+
+    # Steps without an estimate use the default duration
+    assert lengths["d"] == 1.0
+    assert lengths["b"] == 11.0
+    assert lengths["c"] == 3.0
+    # The longest path from a goes through b
+    assert lengths["a"] == 12.0
+    assert DanesfieldStep.INIT not in lengths
+
+    lengths = workflow.getCriticalPathLengths({}, defaultDuration=2.0)
+    assert lengths == {"a": 6.0, "b": 4.0, "c": 4.0, "d": 2.0}
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+# Copyright Kitware Inc. and Contributors
+# Distributed under the Apache License, 2.0 (apache.org/licenses/LICENSE-2.0)
+# See accompanying Copyright.txt and LICENSE files for details
+###############################################################################
+
+import pytest
+from bson.objectid import ObjectId
+
+from danesfield_server.constants import DanesfieldStep
+from danesfield_server.models.workflowJob import WorkflowJob
+from danesfield_server.request_info import RequestInfo
+
+
+@pytest.fixture
+def workflowJob(db, admin):
+    """
+    Job of a workflow in which step a depends on the initial working set,
+    and steps b and c depend on a.
+    """
+    return WorkflowJob().createWorkflowJob(
+        jobId="job",
+        requestInfo=RequestInfo(admin, "http://localhost/api/v1", "token"),
+        workingSets={DanesfieldStep.INIT: {"_id": ObjectId()}},
+        outputFolder={"_id": ObjectId()},
+        options={},
+        completedSteps=[DanesfieldStep.INIT],
+        remainingDependencies={"a": 0, "b": 1, "c": 1},
+        readySteps=["a"],
+    )
+
+
+def testStartStep(workflowJob):
+    jobData = WorkflowJob().startStep("job", "a")
+    assert jobData["readySteps"] == []
+    assert jobData["runningSteps"] == ["a"]
+
+    # Only one process starts the step
+    assert WorkflowJob().startStep("job", "a") is None
+    # Steps that aren't ready don't start
+    assert WorkflowJob().startStep("job", "b") is None
+
+
+def testFinishStep(workflowJob):
+    WorkflowJob().startStep("job", "a")
+    workingSet = {"_id": ObjectId()}
+
+    # The state from before the update is returned
+    jobData = WorkflowJob().finishStep(
+        "job", "a", successful=True, successors=["b", "c"], workingSet=workingSet
+    )
+    assert jobData["runningSteps"] == ["a"]
+    assert jobData["remainingDependencies"] == {"a": 0, "b": 1, "c": 1}
+
+    jobData = WorkflowJob().load("job", force=True, objectId=False)
+    assert jobData["runningSteps"] == []
+    assert jobData["completedSteps"] == [DanesfieldStep.INIT, "a"]
+    assert jobData["remainingDependencies"] == {"a": 0, "b": 0, "c": 0}
+    assert jobData["workingSetIds"]["a"] == workingSet["_id"]
+
+    # Only one process handles the completion
+    assert WorkflowJob().finishStep("job", "a", successful=True) is None
+
+
+def testFinishStepFailed(workflowJob):
+    WorkflowJob().startStep("job", "a")
+    WorkflowJob().finishStep(
+        "job", "a", successful=False, successors=[], workingSet={"_id": ObjectId()}
+    )
+
+    jobData = WorkflowJob().load("job", force=True, objectId=False)
+    assert jobData["failedSteps"] == ["a"]
+    assert jobData["completedSteps"] == [DanesfieldStep.INIT]
+    assert jobData["remainingDependencies"] == {"a": 0, "b": 1, "c": 1}
+    assert "a" not in jobData["workingSetIds"]
+
+
+def testClaimStreamingItems(workflowJob):
+    WorkflowJob().startStep("job", "a")
+    # Steps only stream the output of a running dependency
+    assert WorkflowJob().startStreamingStep("job", "b", "c") is None
+    assert WorkflowJob().startStreamingStep("job", "b", "a") is not None
+    assert WorkflowJob().startStreamingStep("job", "b", "a") is None
+
+    jobData = WorkflowJob().claimStreamingItems("job", "b", ["item1", "item2"])
+    assert jobData["streaming"]["b"]["consumedItems"] == ["item1", "item2"]
+    assert jobData["groupResult"]["b"] == {"remaining": 1, "failed": 0}
+
+    # Items are only processed once
+    assert WorkflowJob().claimStreamingItems("job", "b", ["item2", "item3"]) is None
+
+    jobData = WorkflowJob().claimStreamingItems("job", "b", ["item3"])
+    assert jobData["groupResult"]["b"]["remaining"] == 2
+
+    # No job starts once the dependency has finished
+    assert WorkflowJob().finishStreaming("job", "b", successful=True) is not None
+    assert WorkflowJob().finishStreaming("job", "b", successful=True) is None
+    assert WorkflowJob().claimStreamingItems("job", "b", ["item4"]) is None
+
+
+def testSetStepStartTime(workflowJob):
+    # Steps that aren't running have no start time
+    assert WorkflowJob().setStepStartTime("job", "a") is None
+
+    WorkflowJob().startStep("job", "a")
+    jobData = WorkflowJob().setStepStartTime("job", "a")
+    startTime = jobData["stepStartTimes"]["a"]
+
+    # Other jobs of the step keep the time at which the first one ran
+    assert WorkflowJob().setStepStartTime("job", "a") is None
+    jobData = WorkflowJob().load("job", force=True, objectId=False)
+    assert jobData["stepStartTimes"]["a"] == startTime